@@ -23,18 +23,10 @@ import platform
 if platform.system() != 'Linux':
 	logging.warning("WARNING: You seem to be running this software on something other than Linux.  While in principle this should work, it is not tested or supported so you are on your own.  As a first step, make you have updated settings files with proper paths for your OS if it does not use Unix style paths.")
 
-# Check for the "serial" package, which is available in pip and 
-# conflicts with the much more popular "pyserial" package (which is
-# imported as "serial").  This causes a lot of confusion for people,
-# and the developer of "serial" really needs to rename their package.
-try:
-	import serial.abc # Sub-module in serial but not pyserial
-	sys.exit("It appears you have serial installed, which conflicts with the required package pyserial.  Please remove serial and install pyserial.  (see help-setup.txt)")
-except ImportError: # Also catches subclass ModuleNotFoundError
-	# The offending package isn't present, good
-	pass
-
+import os
+import json
 import importlib
+import importlib.metadata
 
 # Minimum verison allowed for each required module. "None" checks the  
 # module exists, but does not check versions.
@@ -56,50 +48,105 @@ package_names = {
 	'paho.mqtt': 'paho-mqtt'
 }
 
+# Importing every dependency is slow (scipy and flask especially), so
+# a passing check is remembered for this interpreter and set of
+# installed package versions
+CACHE_FILENAME = os.path.join(os.path.expanduser('~'), '.cache', 'pyhk', 'checkdep.json')
+
+# Return a description of the interpreter and installed packages, which
+# is the key for the cached check result.  Reads package metadata only,
+# nothing is imported.
+def fingerprint():
+	
+	packages = {}
+	for name in [package_names.get(m, m) for m in min_vers] + ['serial']:
+		try:
+			packages[name] = importlib.metadata.version(name)
+		except importlib.metadata.PackageNotFoundError:
+			packages[name] = None
+	
+	return {'executable': sys.executable, 'version': sys.version, 'packages': packages}
+
+# Returns True if the dependencies already passed with this fingerprint
+def cache_valid(fp):
+	try:
+		with open(CACHE_FILENAME, 'r') as f:
+			return json.load(f) == fp
+	except (OSError, ValueError):
+		return False
+
+# Remember that the dependencies passed with this fingerprint
+def cache_save(fp):
+	try:
+		os.makedirs(os.path.dirname(CACHE_FILENAME), exist_ok=True)
+		with open(CACHE_FILENAME, 'w') as f:
+			json.dump(fp, f)
+	except OSError:
+		pass # Checking again next time is fine
+
 def verstr(v):
 	return ".".join([str(x) for x in v])
 
-for modname, min_ver in min_vers.items():
+# Import every dependency and exit with a useful message if something
+# is missing or has the wrong version
+def check_all():
 	
-	if modname not in max_vers:
-		# Default max version allows only the last specified version
-		# value to change (1.1.34: <1.2.0, 0.1: <1.0, etc).
-		if min_ver is not None:
-			max_ver = list(min_ver)
-			max_ver[-1] = 0
-			max_ver[-2] += 1
-			max_vers[modname] = max_ver
+	# Check for the "serial" package, which is available in pip and 
+	# conflicts with the much more popular "pyserial" package (which is
+	# imported as "serial").  This causes a lot of confusion for people,
+	# and the developer of "serial" really needs to rename their package.
+	try:
+		import serial.abc # Sub-module in serial but not pyserial
+		sys.exit("It appears you have serial installed, which conflicts with the required package pyserial.  Please remove serial and install pyserial.  (see help-setup.txt)")
+	except ImportError: # Also catches subclass ModuleNotFoundError
+		# The offending package isn't present, good
+		pass
+
+	for modname, min_ver in min_vers.items():
+	
+		if modname not in max_vers:
+			# Default max version allows only the last specified version
+			# value to change (1.1.34: <1.2.0, 0.1: <1.0, etc).
+			if min_ver is not None:
+				max_ver = list(min_ver)
+				max_ver[-1] = 0
+				max_ver[-2] += 1
+				max_vers[modname] = max_ver
+			else:
+				max_ver = None
 		else:
-			max_ver = None
-	else:
-		max_ver = max_vers[modname]
+			max_ver = max_vers[modname]
 	
-	found_ver = None
-	try:
-		# Attempt to import the module and check its version
-		m = importlib.import_module(modname)
-		if min_ver is not None or max_ver is not None:
-			try: 
-				cur_ver_str = m.__version__
-			except AttributeError:
-				# At least one module (json5) uses VERSION instead of
-				# __version__, which is less than ideal
-				cur_ver_str = m.VERSION			
-			found_ver = [int(j) for j in cur_ver_str.split('.')]
+		found_ver = None
+		try:
+			# Attempt to import the module and check its version
+			m = importlib.import_module(modname)
+			if min_ver is not None or max_ver is not None:
+				try: 
+					cur_ver_str = m.__version__
+				except AttributeError:
+					# At least one module (json5) uses VERSION instead of
+					# __version__, which is less than ideal
+					cur_ver_str = m.VERSION			
+				found_ver = [int(j) for j in cur_ver_str.split('.')]
+				if min_ver is not None:
+					assert found_ver >= min_ver
+				if max_ver is not None:
+					assert found_ver < max_ver
+		except:
+			minstr = ''
+			maxstr = ''
+			foundstr = ''
 			if min_ver is not None:
-				assert found_ver >= min_ver
+				minstr = " >=%s" % verstr(min_ver)
 			if max_ver is not None:
-				assert found_ver < max_ver
-	except:
-		minstr = ''
-		maxstr = ''
-		foundstr = ''
-		if min_ver is not None:
-			minstr = " >=%s" % verstr(min_ver)
-		if max_ver is not None:
-			maxstr = " <%s" % verstr(max_ver)
-		if found_ver is not None:
-			foundstr = " (found %s)" % verstr(found_ver)
-		name = package_names.get(modname, modname) # Rename if needed
-		sys.exit("Please install %s%s%s%s (see the documentation for current package requirements)" % (name,minstr,maxstr,foundstr))
+				maxstr = " <%s" % verstr(max_ver)
+			if found_ver is not None:
+				foundstr = " (found %s)" % verstr(found_ver)
+			name = package_names.get(modname, modname) # Rename if needed
+			sys.exit("Please install %s%s%s%s (see the documentation for current package requirements)" % (name,minstr,maxstr,foundstr))
 
+fp = fingerprint()
+if not cache_valid(fp):
+	check_all()
+	cache_save(fp)
@@ -56,6 +56,40 @@ def send_single_packet(host, port, data, retry=True, delim=b'\n', max_retries=10
 			logging.error("Packet failed to send to %s:%s" % (str(host), str(port)))
 			return False
 
+# Connects to the server, sends a query packet, and returns the reply
+# (as a string) that the server sends back, or None if there is no
+# reply within 'timeout' seconds.  The 'delim' is added to the front and
+# back of the sent packet and marks the end of the reply.
+def send_query(host, port, data, timeout=5, delim=b'\n'):
+	
+	if isinstance(data, str):
+		data = data.encode()
+	
+	data = delim + data + delim
+	s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	s.settimeout(timeout)
+	
+	reply = b''
+	try:
+		s.connect((host, port))
+		s.sendall(data)
+		while delim not in reply:
+			chunk = s.recv(65536)
+			if len(chunk) == 0:
+				break
+			reply += chunk
+	except socket.error:
+		logging.error("Query to server at %s:%s failed" % (host, port))
+		return None
+	finally:
+		s.close()
+	
+	if delim not in reply:
+		logging.error("Incomplete reply from server at %s:%s" % (host, port))
+		return None
+	
+	return reply.split(delim)[0].decode()
+
 class PacketServer(object):
 	
 	PACKET_DELIM = b'\n'
@@ -104,6 +138,8 @@ class PacketServer(object):
 			self._thread_rx.join()
 	
 	# Called with each new packet that is received.  Override this function.
+	# If a string is returned, it is sent back on the same connection
+	# followed by PACKET_DELIM.
 	def handle_packet(self, data):
 		logging.error("Packet handler not implemented! Received: " + str(data))
 	
@@ -155,7 +191,9 @@ class PacketServer(object):
 					
 					for p in packets:
 						if len(p) != 0:
-							self.handle_packet(p.decode())
+							reply = self.handle_packet(p.decode())
+							if reply is not None:
+								self._send_reply(c, reply)
 					
 				except socket.timeout:
 					# No new data
@@ -163,6 +201,20 @@ class PacketServer(object):
 					pass
 		
 		logging.info("Packet server loop dying")
+	
+	# Send a reply to a packet back on connection 'conn'
+	def _send_reply(self, conn, reply):
+		
+		if isinstance(reply, str):
+			reply = reply.encode()
+		
+		try:
+			conn.settimeout(1)
+			conn.sendall(reply + self.PACKET_DELIM)
+		except socket.error:
+			logging.error("Failed to send reply to packet")
+		finally:
+			conn.settimeout(0.01)
 					
 if __name__ == "__main__":
 	
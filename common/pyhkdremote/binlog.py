@@ -0,0 +1,118 @@
+'''
+The binary log file format, an alternative to the text log files with
+the same date/type/name layout ("T1.bin" next to where "T1.txt" would
+be).  A file is a 64 byte header followed by fixed size records:
+
+	header:	8s magic ("PYHKBIN\\0"), uint16 version, uint16 record size,
+			zero padding to 64 bytes
+	record:	float64 time (unix seconds), float64 value, int64 sync
+			number (NO_SYNC if there wasn't one), little endian
+
+Values that aren't numbers are stored as NaN.  Files are only appended
+to, so a reader may see a partly written last record, which is ignored.
+A writer cuts such a record off with repair() before appending again.
+
+Usage:
+	- pyhkd writes these with LOG_FILE_FORMAT = 'binary' or 'both'
+	- Call load() for a read-only memory-mapped array of a file's
+	  records, with fields 't', 'v' and 'sync'
+'''
+
+import os
+import struct
+import numpy as np
+
+MAGIC = b'PYHKBIN\0'
+VERSION = 1
+HEADER_SIZE = 64
+EXTENSION = '.bin'
+
+# Sync number stored for values without one
+NO_SYNC = -1
+
+RECORD = np.dtype([('t', '<f8'), ('v', '<f8'), ('sync', '<i8')])
+_HEADER = struct.Struct('<8sHH')
+_RECORD = struct.Struct('<ddq')
+
+# Returns the header written at the start of each file
+def header():
+	return _HEADER.pack(MAGIC, VERSION, RECORD.itemsize).ljust(HEADER_SIZE, b'\0')
+
+# Returns one record as bytes
+def pack(update_time, value, sync_num = None):
+	try:
+		value = float(value)
+	except (TypeError, ValueError):
+		value = float('nan')
+	if sync_num is None:
+		sync_num = NO_SYNC
+	return _RECORD.pack(update_time, value, sync_num)
+
+# Returns True if 'data' (the start of a file) is a header this version
+# can read
+def check_header(data):
+	if len(data) < HEADER_SIZE:
+		return False
+	magic, version, record_size = _HEADER.unpack_from(data)
+	return magic == MAGIC and version == VERSION and record_size == RECORD.itemsize
+
+# Get an existing file ready to have records appended: a partly written
+# last record (or header, such as after a crash) is cut off so new
+# records line up.  Returns the number of bytes cut (0 if the file is
+# fine or doesn't exist), or None if it isn't a binary log file this
+# version can append to.  Raises OSError if it can't be read or cut.
+def repair(filename):
+
+	try:
+		f = open(filename, 'r+b')
+	except FileNotFoundError:
+		return 0
+
+	with f:
+		size = os.fstat(f.fileno()).st_size
+		data = f.read(HEADER_SIZE)
+
+		if size < HEADER_SIZE:
+			if not header().startswith(data):
+				return None
+			keep = 0
+		else:
+			if not check_header(data):
+				return None
+			keep = HEADER_SIZE + ((size - HEADER_SIZE) // RECORD.itemsize) * RECORD.itemsize
+
+		if keep != size:
+			f.truncate(keep)
+		return size - keep
+
+# Returns the records of 'filename' as a read-only structured array
+# (memory-mapped, so nothing is read until used), or None if the file
+# doesn't exist or isn't a binary log file
+def load(filename):
+
+	try:
+		with open(filename, 'rb') as f:
+			if not check_header(f.read(HEADER_SIZE)):
+				return None
+			size = os.fstat(f.fileno()).st_size
+	except OSError:
+		return None
+
+	n = (size - HEADER_SIZE) // RECORD.itemsize
+	if n <= 0:
+		# memmap can't map an empty range
+		return np.empty(0, dtype=RECORD)
+
+	return np.memmap(filename, dtype=RECORD, mode='r', offset=HEADER_SIZE, shape=(n,))
+
+# Returns the last record of 'filename' as (time, value, sync_num), or
+# None if there isn't one.  Reads only the end of the file.
+def load_last(filename):
+
+	records = load(filename)
+	if records is None or len(records) == 0:
+		return None
+
+	r = records[-1]
+	sync_num = int(r['sync'])
+	return (float(r['t']), float(r['v']), None if sync_num == NO_SYNC else sync_num)
@@ -0,0 +1,209 @@
+'''
+Block-compressed log files, for days that are no longer written to.  A
+text or binary log file ("T1.txt" or "T1.bin") is stored as "T1.txt.z"
+or "T1.bin.z": its contents split into blocks of whole lines (or whole
+records) of about BLOCK_SIZE bytes, each compressed with zlib, plus an
+index of the time span of each block.  Reading a time range only
+decompresses the blocks that overlap it.
+
+	header:	8s magic ("PYHKZ\\0\\0\\0"), uint16 version, uint16 kind
+			(KIND_TEXT or KIND_BINARY), uint32 number of blocks, uint64
+			offset of the index, uint64 uncompressed size
+	blocks:	zlib streams, one after the other
+	index:	per block: float64 earliest time, float64 latest time,
+			uint64 offset, uint32 compressed size, uint32 uncompressed
+			size
+
+The times in a file aren't always in order (the clock can be set back),
+so the index holds the earliest and latest time in each block rather
+than its first and last.  Binary files are stored without their binlog
+header, so the blocks hold only records.  A block whose times couldn't
+be read has NaN times and is always read.
+
+Usage:
+	- compress(filename) replaces a closed log file with its compressed
+	  version (pyhkd does this in the background, see day_compressor)
+	- read(filename, t_start, t_stop) returns the contents of the blocks
+	  overlapping [t_start, t_stop]
+'''
+
+import os
+import zlib
+import struct
+import numpy as np
+
+from pyhkdremote import binlog
+
+MAGIC = b'PYHKZ\0\0\0'
+VERSION = 1
+EXTENSION = '.z'
+BLOCK_SIZE = 65536
+
+KIND_TEXT = 0
+KIND_BINARY = 1
+
+_HEADER = struct.Struct('<8sHHIQQ')
+INDEX = np.dtype([('t_min', '<f8'), ('t_max', '<f8'), ('offset', '<u8'), ('size', '<u4'), ('raw_size', '<u4')])
+
+# Returns the earliest and latest of 'times', ignoring NaN, or NaNs if
+# there are none
+def _time_span(times):
+	times = np.asarray(times, dtype=float)
+	times = times[~np.isnan(times)]
+	if len(times) == 0:
+		return float('nan'), float('nan')
+	return float(times.min()), float(times.max())
+
+# Split text into blocks of whole lines, returns a list of (block,
+# earliest time, latest time)
+def _text_blocks(data):
+
+	blocks = []
+	start = 0
+	while start < len(data):
+
+		end = data.find(b'\n', min(start + BLOCK_SIZE, len(data)) - 1)
+		end = len(data) if end < 0 else end + 1
+		block = data[start:end]
+
+		t_min, t_max = _time_span([_line_time(l) for l in block.split(b'\n') if l != b''])
+		blocks.append((block, t_min, t_max))
+		start = end
+
+	return blocks
+
+def _line_time(line):
+	try:
+		return float(line.split(b'\t', 1)[0])
+	except ValueError:
+		return float('nan')
+
+# Split binary log records into blocks of whole records
+def _binary_blocks(data):
+
+	size = binlog.RECORD.itemsize
+	step = max(1, BLOCK_SIZE // size) * size
+	blocks = []
+	for start in range(0, len(data), step):
+		block = data[start:start + step]
+		records = np.frombuffer(block[:len(block) - len(block) % size], dtype=binlog.RECORD)
+		t_min, t_max = _time_span(records['t'])
+		blocks.append((block, t_min, t_max))
+	return blocks
+
+# Write the compressed version of 'filename' to 'filename' + EXTENSION
+# and remove the original, once the compressed file reads back the same.
+# Returns the compressed file name, or None if the file isn't a log file
+# (it is left as it was).
+def compress(filename, level=6):
+
+	with open(filename, 'rb') as f:
+		data = f.read()
+
+	if filename.endswith(binlog.EXTENSION):
+		if not binlog.check_header(data):
+			return None
+		kind = KIND_BINARY
+		data = data[binlog.HEADER_SIZE:]
+		blocks = _binary_blocks(data)
+	else:
+		kind = KIND_TEXT
+		blocks = _text_blocks(data)
+
+	dst = filename + EXTENSION
+	tmp = dst + '.tmp'
+
+	index = np.zeros(len(blocks), dtype=INDEX)
+	with open(tmp, 'wb') as f:
+
+		offset = _HEADER.size
+		f.write(b'\0' * offset)
+
+		for i, (block, t_min, t_max) in enumerate(blocks):
+			compressed = zlib.compress(block, level)
+			f.write(compressed)
+			index[i] = (t_min, t_max, offset, len(compressed), len(block))
+			offset += len(compressed)
+
+		f.write(index.tobytes())
+		f.seek(0)
+		f.write(_HEADER.pack(MAGIC, VERSION, kind, len(blocks), offset, len(data)))
+		f.flush()
+		os.fsync(f.fileno())
+
+	if read(tmp) != data:
+		os.remove(tmp)
+		raise IOError("Compressed copy of " + filename + " doesn't match, left uncompressed")
+
+	os.replace(tmp, dst)
+	os.remove(filename)
+	return dst
+
+# Returns (kind, index array) of a compressed file, or None if it doesn't
+# exist or isn't one
+def read_index(filename):
+
+	try:
+		with open(filename, 'rb') as f:
+			header = f.read(_HEADER.size)
+			if len(header) < _HEADER.size:
+				return None
+			magic, version, kind, num_blocks, index_offset, raw_size = _HEADER.unpack(header)
+			if magic != MAGIC or version != VERSION:
+				return None
+			f.seek(index_offset)
+			index = np.frombuffer(f.read(num_blocks * INDEX.itemsize), dtype=INDEX)
+	except OSError:
+		return None
+
+	return kind, index
+
+# Returns the uncompressed contents of the blocks overlapping [t_start,
+# t_stop] (None for no limit), or None if the file doesn't exist or isn't
+# a compressed log file.  For binary files the result is whole records,
+# without the binlog header.
+def read(filename, t_start=None, t_stop=None):
+
+	found = read_index(filename)
+	if found is None:
+		return None
+	kind, index = found
+
+	# NaN times compare False, so those blocks are kept
+	skip = np.zeros(len(index), dtype=bool)
+	if t_start is not None:
+		skip |= index['t_max'] < t_start
+	if t_stop is not None:
+		skip |= index['t_min'] > t_stop
+
+	parts = []
+	with open(filename, 'rb') as f:
+		for entry, skipped in zip(index, skip):
+			if skipped:
+				continue
+			f.seek(int(entry['offset']))
+			parts.append(zlib.decompress(f.read(int(entry['size']))))
+
+	return b''.join(parts)
+
+# Returns the records of a compressed binary log file overlapping
+# [t_start, t_stop] as a structured array (see binlog.RECORD), or None
+def load_records(filename, t_start=None, t_stop=None):
+
+	data = read(filename, t_start, t_stop)
+	if data is None:
+		return None
+	size = binlog.RECORD.itemsize
+	return np.frombuffer(data[:len(data) - len(data) % size], dtype=binlog.RECORD)
+
+# Returns the last block of a compressed file, for finding the latest
+# value, or None
+def read_last_block(filename):
+
+	found = read_index(filename)
+	if found is None or len(found[1]) == 0:
+		return None
+	entry = found[1][-1]
+	with open(filename, 'rb') as f:
+		f.seek(int(entry['offset']))
+		return zlib.decompress(f.read(int(entry['size'])))
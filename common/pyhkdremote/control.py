@@ -6,9 +6,10 @@ A set of functions used to command pyhkd from external applications
 
 import urllib.request, urllib.parse, urllib.error
 import logging
+import json
 
 from pyhkdremote.settings import PYHKD_IP, PYHKD_PORT
-from packetcomm.packetcomm import send_single_packet
+from packetcomm.packetcomm import send_single_packet, send_query
 
 # Tell pyhkd to set a value.
 # command: command string to send
@@ -39,3 +40,118 @@ def pyhkd_set_current(name, value, retry=True): return pyhkd_set('iset', name, v
 def pyhkd_set_currentramp(name, value, retry=True): return pyhkd_set('irset', name, value, retry)
 def pyhkd_set_state(name, value, retry=True): return pyhkd_set('sset', name, value, retry)
 
+# Ask pyhkd for its update loop statistics (duration, achieved period,
+# and scheduling lag of instrument updates).
+# name: instrument name (as listed in the full result), or None for all
+# Returns a dict indexed by instrument name, or None on failure.
+def pyhkd_get_loop_stats(name=None, timeout=5):
+	
+	data = 'loopstats'
+	if name is not None:
+		data += ',' + urllib.parse.quote(name)
+	
+	reply = send_query(PYHKD_IP, PYHKD_PORT, data, timeout)
+	if reply is None:
+		return None
+	
+	return json.loads(reply)
+
+# Ask pyhkd for the slowest traced instrument updates (only recorded
+# when pyhkd runs with --trace-stalls) and garbage collection pauses.
+# Returns a dict, or None on failure.
+def pyhkd_get_stalls(timeout=5):
+	
+	reply = send_query(PYHKD_IP, PYHKD_PORT, 'stalls', timeout)
+	if reply is None:
+		return None
+	
+	return json.loads(reply)
+
+# Ask pyhkd for the state of its log queue (depth, dropped values, and
+# the lag between a value arriving and being written).
+# Returns a dict, None if pyhkd runs with --sync-logging, or None on
+# failure.
+def pyhkd_get_log_queue(timeout=5):
+	
+	reply = send_query(PYHKD_IP, PYHKD_PORT, 'logqueue', timeout)
+	if reply is None:
+		return None
+	
+	return json.loads(reply)
+
+# Ask pyhkd for the log file write batch statistics, None if there is no
+# reply (or pyhkd writes each line as it comes)
+def pyhkd_get_file_writer(timeout=5):
+	
+	reply = send_query(PYHKD_IP, PYHKD_PORT, 'filewriter', timeout)
+	if reply is None:
+		return None
+	
+	return json.loads(reply)
+
+# Ask pyhkd for the statistics of its pool of open log files, None if
+# there is no reply (or pyhkd keeps every log file open)
+def pyhkd_get_file_pool(timeout=5):
+	
+	reply = send_query(PYHKD_IP, PYHKD_PORT, 'filepool', timeout)
+	if reply is None:
+		return None
+	
+	return json.loads(reply)
+
+# Ask pyhkd for the recent history of a sensor, kept in memory.
+# name:			sensor name (or alias)
+# sensor_type:	sensor type, such as 'temperature'
+# width:		None for the raw samples, or a bin width in seconds
+#				(10 or 60 by default) for binned values
+# start, stop:	optional time range, in seconds since the epoch
+# Returns a dict of lists, with keys 'time' and 'value' for raw
+# samples or 'time', 'min', 'max', 'mean', and 'count' for bins (the
+# time is the start of each bin), or None on failure.
+def pyhkd_get_history(name, sensor_type, width=None, start=None, stop=None, timeout=5):
+	
+	args = [urllib.parse.quote(name), sensor_type, width, start, stop]
+	data = 'history,' + ','.join(['' if a is None else str(a) for a in args])
+	
+	reply = send_query(PYHKD_IP, PYHKD_PORT, data, timeout)
+	if reply is None:
+		return None
+	
+	return json.loads(reply)
+
+# Ask pyhkd for the recent history of several sensors of one type in a
+# single query.
+# sensor_type:	sensor type, such as 'temperature'
+# names:		list of sensor names (or aliases)
+# start:		optional start time, in seconds since the epoch
+# Returns a dict indexed by name, with only the sensors that keep their
+# history.  Each entry has 'samples' (as pyhkd_get_history with no
+# width) and 'bins', a list of [width, bins] pairs.  Returns None on
+# failure.
+def pyhkd_get_histories(sensor_type, names, start=None, timeout=5):
+	
+	args = [sensor_type, '' if start is None else str(start)] + [urllib.parse.quote(n) for n in names]
+	data = 'histories,' + ','.join(args)
+	
+	reply = send_query(PYHKD_IP, PYHKD_PORT, data, timeout)
+	if reply is None:
+		return None
+	
+	return json.loads(reply)
+
+# Ask pyhkd for the last value of several sensors of one type, without
+# reading the log files.
+# sensor_type:	sensor type, such as 'temperature'
+# names:		list of sensor names (or aliases)
+# Returns a dict of [time, value] indexed by name, with only the
+# sensors pyhkd knows and has a value for (non-finite values are None),
+# or None on failure.
+def pyhkd_get_latest_values(sensor_type, names, timeout=5):
+	
+	data = 'latest,' + ','.join([sensor_type] + [urllib.parse.quote(n) for n in names])
+	
+	reply = send_query(PYHKD_IP, PYHKD_PORT, data, timeout)
+	if reply is None:
+		return None
+	
+	return json.loads(reply)
@@ -1,6 +1,7 @@
 '''
 A set of functions and classes designed to facilitate loading data
-saved by pyhkd
+saved by pyhkd, from either text or binary (see binlog) log files, and
+their compressed versions for older days (see blockzip)
 '''
 
 
@@ -12,6 +13,9 @@ import os
 import threading
 import urllib.request, urllib.parse, urllib.error
 import numpy as np
+
+from pyhkdremote import binlog
+from pyhkdremote import blockzip
 	
 # Returns the lastest (timestamp, value) tuple for a given sensor on the
 # given target date. If target_date == None, the function will attempt 
@@ -31,9 +35,33 @@ def pyhkd_get_latest(base_folder_location, subfolder_label, value_name, target_d
 			
 		return (ts,val)
 	
+	# A compressed file wins over a plain one of the same name, which is
+	# only left by an interrupted compression (see blockzip)
 	fn = pyhkd_get_filename(base_folder_location, subfolder_label, value_name, target_date)
-	line = get_last_line(fn)
-	return extract_data(line, return_as_datetime)
+	block = blockzip.read_last_block(fn + blockzip.EXTENSION)
+	if block is not None:
+		lines = block.decode().rstrip('\n').split('\n')
+		return extract_data(lines[-1] + '\n', return_as_datetime)
+	if os.path.exists(fn):
+		line = get_last_line(fn)
+		return extract_data(line, return_as_datetime)
+	
+	bin_fn = pyhkd_get_bin_filename(base_folder_location, subfolder_label, value_name, target_date)
+	block = blockzip.read_last_block(bin_fn + blockzip.EXTENSION)
+	if block is not None:
+		size = binlog.RECORD.itemsize
+		if len(block) < size:
+			return (None, None)
+		record = np.frombuffer(block[:len(block) - len(block) % size], dtype=binlog.RECORD)[-1]
+		last = (float(record['t']), float(record['v']))
+	else:
+		last = binlog.load_last(bin_fn)
+		if last is None:
+			return (None, None)
+	
+	if return_as_datetime:
+		return (datetime.datetime.fromtimestamp(last[0]), last[1])
+	return (last[0], last[1])
 	
 # Returns a list of values stored on a particular date in a subfolder.
 # Returns None if it fails (the subfolder doesnt exist).
@@ -45,12 +73,12 @@ def pyhkd_get_names(base_folder_location, subfolder_label, target_date):
 	if (dirname is None) or (not os.path.exists(dirname)):
 		return None
 	
-	l = []
+	l = set()
 	for f in os.listdir(dirname):
-		if f.endswith(".txt"): 
-			l.append(urllib.parse.unquote(f[0:-4]))
-	l.sort()
-	return l
+		for ext in [".txt", binlog.EXTENSION, ".txt" + blockzip.EXTENSION, binlog.EXTENSION + blockzip.EXTENSION]:
+			if f.endswith(ext): 
+				l.add(urllib.parse.unquote(f[0:-len(ext)]))
+	return sorted(l)
 		
 	
 # Get the subfolder for a particular data and type
@@ -66,6 +94,70 @@ def pyhkd_get_filename(base_folder_location, subfolder_label, value_name, target
 	return os.path.join(pyhkd_get_subfolder(base_folder_location, subfolder_label, target_date),
 						urllib.parse.quote(str(value_name)) + ".txt")	
 
+# Return the binary file name for a given value
+def pyhkd_get_bin_filename(base_folder_location, subfolder_label, value_name, target_date):
+	return os.path.join(pyhkd_get_subfolder(base_folder_location, subfolder_label, target_date),
+						urllib.parse.quote(str(value_name)) + binlog.EXTENSION)
+
+# Returns the binary log records (see binlog.RECORD) of a value on a
+# date, from the compressed version of the binary file or else the file
+# itself (memory-mapped), or None if there are neither.  For compressed
+# files only the blocks overlapping [t_start, t_stop] are read, so the
+# result can include records just outside the range.
+def pyhkd_load_records(base_folder_location, subfolder_label, value_name, target_date, t_start=None, t_stop=None):
+	
+	fn = pyhkd_get_bin_filename(base_folder_location, subfolder_label, value_name, target_date)
+	records = blockzip.load_records(fn + blockzip.EXTENSION, t_start, t_stop)
+	if records is None:
+		records = binlog.load(fn)
+	return records
+
+# Returns the contents of the compressed text log file of a value on a
+# date, or else of the text file, or None if there are neither.  As for
+# pyhkd_load_records, compressed files are read only where they overlap
+# [t_start, t_stop].
+def pyhkd_read_text(base_folder_location, subfolder_label, value_name, target_date, t_start=None, t_stop=None):
+	
+	fn = pyhkd_get_filename(base_folder_location, subfolder_label, value_name, target_date)
+	data = blockzip.read(fn + blockzip.EXTENSION, t_start, t_stop)
+	if data is not None:
+		return data.decode()
+	
+	if os.path.exists(fn):
+		with open(fn, 'r') as f:
+			return f.read()
+	return None
+
+# Returns the (times, values) arrays logged for a value on a date, in
+# [t_start, t_stop] if given.  Binary files are used if there are any
+# (memory-mapped, no parsing), then text files, either of them possibly
+# compressed.  Returns None if there is no file or it can't be read.
+def pyhkd_load_day(base_folder_location, subfolder_label, value_name, target_date, t_start=None, t_stop=None):
+	
+	records = pyhkd_load_records(base_folder_location, subfolder_label, value_name, target_date, t_start, t_stop)
+	if records is not None:
+		t, y = records['t'], records['v']
+	else:
+		text = pyhkd_read_text(base_folder_location, subfolder_label, value_name, target_date, t_start, t_stop)
+		if text is None:
+			return None
+		try:
+			data = np.loadtxt(text.splitlines(), usecols=(0, 1), ndmin=2)
+			t, y = data[:,0], data[:,1]
+		except (ValueError, TypeError, IndexError):
+			logging.error('Unabled to extract data for ' + str(value_name) + ' on ' + str(target_date) + ' (could be empty?)')
+			return None
+	
+	if t_start is not None or t_stop is not None:
+		keep = np.ones(len(t), dtype=bool)
+		if t_start is not None:
+			keep &= t >= t_start
+		if t_stop is not None:
+			keep &= t <= t_stop
+		t, y = t[keep], y[keep]
+	
+	return (t, y)
+
 
 # Returns the absolute path of the default live config folder
 def pyhkd_get_config_dir():
@@ -139,6 +231,43 @@ def extract_data(line, return_as_datetime = True):
 			return (None, None)
 	return (None, None)
 
+# Returns the value held at each of 'times' for a channel logged with a
+# deadband, where each value in 'y' (logged at 't') holds until the next
+# one.  Times before the first sample are NaN.  'times' should be in the
+# same units as 't' (floats, not datetimes).
+def hold_values(t, y, times):
+	
+	t = np.asarray(t, dtype=float)
+	y = np.asarray(y, dtype=float)
+	times = np.asarray(times, dtype=float)
+	
+	result = np.full(times.shape, np.nan)
+	if len(t) == 0:
+		return result
+	
+	index = np.searchsorted(t, times, side='right') - 1
+	valid = index >= 0
+	result[valid] = y[index[valid]]
+	return result
+
+# Returns the indices of the samples to keep out of 'n' when thinning
+# by 'downsample' from 'start': every downsample-th sample, the one
+# before each of those, and the last one.  For a channel logged with a
+# deadband the sample before a step is the held value, so the thinned
+# data still plots as a step rather than a ramp.  Keeps about 2/downsample
+# of the samples.
+def thin_indices(n, downsample, start=0):
+	
+	if n <= start:
+		return np.arange(0)
+	
+	index = np.arange(start, n, downsample)
+	if downsample > 1:
+		index = np.union1d(index, index[index > start] - 1)
+	if index[-1] != n - 1:
+		index = np.append(index, n - 1)
+	return index
+
 # A class for loading live file data and passing it to
 # a callback function as the data is written
 class DataLoader(object):
@@ -182,6 +311,33 @@ class DataLoader(object):
 		self.stop_live()
 		self._send_archived(date_start, date_stop)
 		
+	# Returns the values of every name held at each of 'times' (floats,
+	# seconds since the epoch) from date_start to date_stop
+	# (inclusive), as a 2D array with a row per name.  Each logged
+	# value holds until the next one (see hold_values), so channels
+	# logged with a deadband line up with the others.
+	def load_aligned(self, date_start, date_stop, times):
+		
+		result = []
+		for i in range(self._NUM_VALUES):
+			
+			t = []
+			y = []
+			date_to_load = date_start
+			while date_to_load <= date_stop:
+				data = pyhkd_load_day(self._base_folder_location, self._subfolder_label, self._value_names[i], date_to_load)
+				if data is not None:
+					t.append(data[0])
+					y.append(data[1])
+				date_to_load += datetime.timedelta(days=1)
+			
+			if len(t) == 0:
+				result.append(hold_values([], [], times))
+			else:
+				result.append(hold_values(np.concatenate(t), np.concatenate(y), times))
+		
+		return np.array(result)
+		
 	# Sends any new data added from a separate thread.  If 
 	# updates are currently being send from a previous load_***_live
 	# call, stop them.
@@ -209,13 +365,15 @@ class DataLoader(object):
 	def _open_current_files(self):
 		d = datetime.date.today()
 		self._current_filenames = [pyhkd_get_filename(self._base_folder_location, self._subfolder_label, vn, d) for vn in self._value_names]
+		self._current_bin_filenames = [pyhkd_get_bin_filename(self._base_folder_location, self._subfolder_label, vn, d) for vn in self._value_names]
 		self._last_filename_update = d
 		
 		for i in range(len(self._files)):
 			self._open_file(i)
 	
-	# Open self._current_filenames[index].  Returns True if it succeeds,
-	# False otherwise.
+	# Open self._current_filenames[index], or the binary file if there
+	# is only that (opened in binary mode after the header).  Returns
+	# True if it succeeds, False otherwise.
 	def _open_file(self, index):
 		if self._files[index] != None:
 			self._files[index].close()
@@ -223,9 +381,37 @@ class DataLoader(object):
 			self._files[index] = open(self._current_filenames[index], 'r')
 			#logging.debug("Data logger opening file " + str(self._current_filenames[index]))
 			return True
+		elif os.path.exists(self._current_bin_filenames[index]):
+			self._files[index] = open(self._current_bin_filenames[index], 'rb')
+			if not binlog.check_header(self._files[index].read(binlog.HEADER_SIZE)):
+				# Not written yet
+				self._files[index].close()
+				self._files[index] = None
+				return False
+			return True
 		else:
 			self._files[index] = None
 			return False
+	
+	# Read the next value from an open file, returns (timestamp, value),
+	# (None, None) for a bad line, or None if there is nothing new
+	def _read_next(self, index):
+		
+		f = self._files[index]
+		
+		if 'b' in f.mode:
+			data = f.read(binlog.RECORD.itemsize)
+			if len(data) < binlog.RECORD.itemsize:
+				# Partly written, try again later
+				f.seek(-len(data), os.SEEK_CUR)
+				return None
+			record = np.frombuffer(data, dtype=binlog.RECORD)[0]
+			return (datetime.datetime.fromtimestamp(float(record['t'])), float(record['v']))
+		
+		line = f.readline()
+		if line == '':
+			return None
+		return extract_data(line)
 				
 	# Send a multiple day's worth of data for each value
 	def _send_archived(self, date_start, date_end):
@@ -239,17 +425,13 @@ class DataLoader(object):
 		
 		for i in range(self._NUM_VALUES):
 
-			fn = pyhkd_get_filename(self._base_folder_location, self._subfolder_label, self._value_names[i], date_to_send)
+			data = pyhkd_load_day(self._base_folder_location, self._subfolder_label, self._value_names[i], date_to_send)
 			
-			if os.path.exists(fn):
+			if data is not None and len(data[0]) > 0:
 				
-				logging.info("Loading log file " + str(fn))
-				try:
-					data_t_float, data_y = np.loadtxt(fn, unpack=True, ndmin=2)
-					data_t = [datetime.datetime.fromtimestamp(data_t_float[j]) for j in range(len(data_t_float))]
-					self._callback(i, data_t, data_y.tolist())
-				except (ValueError, TypeError):
-					logging.error('Unabled to extract data from file ' + str(fn) + ' (could be empty?)')
+				data_t_float, data_y = data
+				data_t = [datetime.datetime.fromtimestamp(t) for t in data_t_float.tolist()]
+				self._callback(i, data_t, data_y.tolist())
 		
 		
 	# Starts a new thread on the live file monitoring.  Only sends
@@ -279,6 +461,10 @@ class DataLoader(object):
 			for i in range(self._NUM_VALUES):
 				if self._files[i] is not None:
 					self._files[i].seek(0,os.SEEK_END)
+					if 'b' in self._files[i].mode:
+						# Back to the end of the last whole record
+						partial = (self._files[i].tell() - binlog.HEADER_SIZE) % binlog.RECORD.itemsize
+						self._files[i].seek(-partial, os.SEEK_CUR)
 		
 		while True:
 			
@@ -307,10 +493,10 @@ class DataLoader(object):
 							# Give up
 							continue
 					
-					line = self._files[i].readline()
+					data = self._read_next(i)
 					
-					if line != '':
-						timestamp, value = extract_data(line)
+					if data is not None:
+						timestamp, value = data
 						
 						if (timestamp is not None) and (value is not None):
 							self._callback(i, [timestamp], [value])
@@ -10,6 +10,7 @@ import logging
 import os
 
 from pyhkdlib.settings import *
+from pyhkdlib import startup_profile
 sys.path.append(COMMON_CODE_DIR)
 
 # Configure logging
@@ -20,7 +21,8 @@ screen_handler.setFormatter(logging.Formatter(APP_LOG_FORMAT))
 logging.getLogger().addHandler(screen_handler)  # Print to screen as well
 logging.info("Starting pyhkd " + VERSION_STR)
 
-import checkdep # Verifies depenencies, comment out to override
+with startup_profile.timed('startup', 'checkdep'):
+	import checkdep # Verifies depenencies, comment out to override
 
 import os
 import socket
@@ -31,8 +33,11 @@ import setproctitle
 import psutil
 import time
 
-from pyhkdlib.data_acq import DataAcqController
-from pyhkdlib.instruments.instrument_loader import load_instruments
+# The optional subsystems are imported below, only when turned on
+with startup_profile.timed('startup', 'pyhkdlib imports'):
+	from pyhkdlib.data_acq import DataAcqController
+	from pyhkdlib.instruments.instrument_loader import load_instruments
+	from pyhkdlib import rollover
 
 service_name = 'pyhkd.service'
 service_fname = '/lib/systemd/system/' + service_name
@@ -63,6 +68,18 @@ if __name__ == '__main__':
 		epilog='Example (TIME):  ./pyhkd.py ./config/hw_time.json5\nExample (Shortkeck):  ./pyhkd.py ./config/hw_sk.json5\n ')
 	parser.add_argument('configfile', type=str, help='The hardware config file, normally located at ./config/hw_CRYOSTAT.json5.')
 	parser.add_argument('--install', action='store_true', help='Install pyhkd as a systemd service that starts automatically at boot (run as root).')
+	parser.add_argument('--load-threads', type=int, default=INSTRUMENT_LOAD_THREADS, help='Number of devices constructed at once at startup (default %i, 1 constructs them one at a time).' % INSTRUMENT_LOAD_THREADS)
+	parser.add_argument('--profile-startup', action='store_true', help='Log how long each step of startup took (dependency checks, imports, and each device init).')
+	parser.add_argument('--clock-rate', type=float, default=None, help='Run on a simulated clock this many times faster than real time, starting now (for testing with simulated instruments only, data is stored with simulated timestamps).')
+	parser.add_argument('--trace-stalls', type=int, default=0, metavar='N', help='Trace where the time goes in each instrument update (driver, lock waits, log writes, garbage collection) and keep the N slowest.  Query with "pyhkcmd stalls", also logged at exit.')
+	parser.add_argument('--sync-logging', action='store_true', help='Write log files from the threads that update the sensors, instead of queueing values for a separate log writer thread.')
+	parser.add_argument('--flush-time', type=float, default=FILE_FLUSH_TIME, metavar='SEC', help='Hold log file lines for up to this many seconds and write each file in one batch (default %g, 0 writes each line as it comes).' % FILE_FLUSH_TIME)
+	parser.add_argument('--fsync-interval', type=float, default=FILE_FSYNC_INTERVAL, metavar='SEC', help='Force the written log files to disk this often, bounding what a power cut can lose (default %g, 0 leaves it to the OS).' % FILE_FSYNC_INTERVAL)
+	parser.add_argument('--file-pool', type=int, default=FILE_POOL_SIZE, metavar='N', help='Keep at most N log files open at once, opening others again as they are written (default %i, 0 keeps every log file open).  Should be well below the open file limit (ulimit -n).' % FILE_POOL_SIZE)
+	parser.add_argument('--rollover-lead', type=float, default=ROLLOVER_LEAD_TIME, metavar='SEC', help='Open the log files of the next day this many seconds before midnight, so the loggers only switch files at midnight (default %g, 0 opens them at the first value of the day).' % ROLLOVER_LEAD_TIME)
+	parser.add_argument('--compress-after', type=int, default=COMPRESS_AFTER_DAYS, metavar='DAYS', help='Compress the log files of days at least this many days old in the background, keeping them readable by pyhkweb and pyhkcmd (default %i, 0 never compresses, otherwise at least 2).' % COMPRESS_AFTER_DAYS)
+	parser.add_argument('--gc-freeze', action='store_true', help='Exclude all objects created during startup from garbage collection, shortening collection pauses.')
+	parser.add_argument('--loop', type=str, default=DataAcqController.LOOP_SCHEDULED, choices=DataAcqController.VALID_LOOP_MODES, help='How instruments are updated: "scheduled" (default) updates instruments from one loop that sleeps until the next instrument is due, "roundrobin" polls all instruments in turn from one loop, "threaded" gives each instrument its own worker thread so slow instruments cannot stall the others, "asyncio" runs all timing and I/O on one event loop (required for asyncio-based instruments).')
 	
 	# They really should pass at least one argument.  If not, show the help.
 	if len(sys.argv) <= 1: 
@@ -75,6 +92,10 @@ if __name__ == '__main__':
 		print("Config file '" + str(args.configfile) + "' cannot be found")
 		exit()
 	
+	if args.compress_after == 1:
+		print("--compress-after should be 0 or at least 2 days, yesterday's files may still be written to")
+		exit()
+	
 	if args.install:
 		
 		print('Installing pyhkd systemd service (run as root)...')
@@ -100,11 +121,64 @@ if __name__ == '__main__':
 		logging.warning("The computer you are running this on seems rather feeble (%i CPU cores, %0.1f GB RAM).  Be aware of other processes that might bog down the machine and harm performance, especially web browsers." % (n_cpu, total_ram))
 		time.sleep(2) # Give them time to see it and feel the shame
 	
+	if args.clock_rate is not None:
+		from pyhkdlib import clock
+		logging.warning("Running on a simulated clock at %gx real time.  Data will be stored with simulated timestamps." % args.clock_rate)
+		clock.set_clock(clock.VirtualClock(args.clock_rate))
+	
+	if args.trace_stalls > 0:
+		from pyhkdlib import stall_tracer
+		stall_tracer.enable(args.trace_stalls)
+	
+	if args.file_pool > 0:
+		from pyhkdlib import file_pool
+		file_pool.start(args.file_pool)
+	
+	# Started before the log queue, so at exit the queue is written out
+	# before the held lines are
+	if args.flush_time > 0:
+		from pyhkdlib import file_writer
+		file_writer.start(args.flush_time, FILE_FLUSH_BYTES, args.fsync_interval or None)
+	
+	if args.rollover_lead > 0:
+		rollover.start(args.rollover_lead)
+	
+	if not args.sync_logging:
+		from pyhkdlib import log_queue
+		log_queue.start(LOG_QUEUE_DEPTH, LOG_QUEUE_POLICY)
+	
 	# Initialize the data acq process
-	instruments, loggers = load_instruments(args.configfile)
-	data_acq = DataAcqController(instruments, loggers)
+	with startup_profile.timed('startup', 'load_instruments'):
+		instruments, loggers = load_instruments(args.configfile, max_workers=args.load_threads)
+	with startup_profile.timed('startup', 'DataAcqController'):
+		data_acq = DataAcqController(instruments, loggers, loop_mode=args.loop)
+	
+	if args.profile_startup:
+		startup_profile.report()
+	
+	if args.gc_freeze:
+		from pyhkdlib import stall_tracer
+		stall_tracer.freeze_startup_objects()
+
+	if args.compress_after > 0:
+		from pyhkdlib import day_compressor
+		day_compressor.start(DATA_LOG_FOLDER, args.compress_after)
 
 	# Start the data acquisition loop
 	data_acq.main_loop()
+	
+	if args.compress_after > 0:
+		day_compressor.stop()
+	
+	# Write out any values still queued for the loggers, then what the
+	# loggers are holding back
+	if not args.sync_logging:
+		log_queue.stop()
+	rollover.flush_loggers()
+	rollover.stop()
+	if args.flush_time > 0:
+		file_writer.stop()
+	if args.file_pool > 0:
+		file_pool.stop()
 		
 	logging.info("Exiting")
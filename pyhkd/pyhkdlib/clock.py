@@ -0,0 +1,87 @@
+'''
+The source of time for pyhkd.  Code that schedules updates, times out,
+or picks the day's log file asks this module for the time instead of
+calling time.time() or datetime.date.today() directly.  A VirtualClock
+can then run the whole acquisition stack (with simulated instruments)
+faster than real time, for example to test a day of operation,
+including midnight rollover and reconnect timeouts, in minutes.
+
+Pauses that pace real hardware I/O should keep using time.sleep().
+
+Usage:
+	- Use clock.now(), clock.today(), and clock.sleep() in place of
+	  time.time(), datetime.date.today(), and time.sleep()
+	- Pass timeouts for threading/asyncio waits through real_timeout()
+	- Call set_clock(VirtualClock(rate)) once at startup to simulate
+'''
+
+import time
+import datetime
+
+# The normal clock, in step with the system time
+class WallClock:
+
+	# Simulated seconds per real second
+	rate = 1.0
+
+	# Seconds since the epoch
+	def now(self):
+		return time.time()
+
+	# Convert a duration on this clock to real seconds (None stays None)
+	def real_timeout(self, seconds):
+		return seconds
+
+# A clock that starts at 'start' (seconds since the epoch, default now)
+# and runs 'rate' times faster than real time
+class VirtualClock(WallClock):
+
+	def __init__(self, rate=100, start=None):
+
+		assert rate > 0, "The clock rate should be a positive number"
+
+		if start is None:
+			start = time.time()
+
+		self.rate = float(rate)
+		self._start = start
+		# Monotonic time is shared by all processes, so child processes
+		# given a copy of this clock stay in step
+		self._monotonic_start = time.monotonic()
+
+	def now(self):
+		return self._start + (time.monotonic() - self._monotonic_start) * self.rate
+
+	def real_timeout(self, seconds):
+		if seconds is None:
+			return None
+		return seconds / self.rate
+
+_clock = WallClock()
+
+# Replace the clock used by all of pyhkd.  Call before creating
+# instruments.
+def set_clock(new_clock):
+	global _clock
+	_clock = new_clock
+
+# Return the clock in use
+def get_clock():
+	return _clock
+
+# Seconds since the epoch
+def now():
+	return _clock.now()
+
+# The current local date
+def today():
+	return datetime.date.fromtimestamp(_clock.now())
+
+# Sleep for a duration in clock seconds
+def sleep(seconds):
+	time.sleep(max(_clock.real_timeout(seconds), 0))
+
+# Convert a duration in clock seconds to real seconds, for timeouts of
+# threading and asyncio waits
+def real_timeout(seconds):
+	return _clock.real_timeout(seconds)
@@ -2,18 +2,39 @@
 Main controller and packet server for the data acquistion system
 '''
 
+import os
+import sys
 import time
+import json
+import asyncio
 import logging
 import socket
 import threading
+import traceback
+import concurrent.futures
 import urllib.request, urllib.parse, urllib.error
 import numpy as np
 
 from .sensor import Sensor
+from . import clock
+from . import stall_tracer
+from . import log_queue
+from . import file_writer
+from . import file_pool
+from .sensor_registry import registry
+from .scheduler import UpdateScheduler
+from .loop_stats import LoopStats
 from .instruments.voltage_output_mixin import VoltageOutputMixin
-from pyhkdlib.settings import RECV_PORT
+from pyhkdlib.settings import RECV_PORT, DATA_LOG_FOLDER, LOOP_STATS_FILENAME, LOOP_STATS_EXPORT_PERIOD
 from packetcomm.packetcomm import PacketServer
 
+# True if 'inst' is an AsyncInstrument.  Their module (which needs
+# serial) is only imported by the instruments built on it, so if it
+# isn't loaded no instrument can be one.
+def _is_async(inst):
+	module = sys.modules.get(__package__ + '.instruments.async_instrument')
+	return module is not None and isinstance(inst, module.AsyncInstrument)
+
 class DataAcqController(PacketServer):
 	
 	COMMAND_SET_VOLTAGE = 'vset'
@@ -25,16 +46,74 @@ class DataAcqController(PacketServer):
 	COMMAND_SET_PERCENTAGE = 'perset'
 	VALID_COMMANDS = [COMMAND_SET_VOLTAGE, COMMAND_SET_POWER, COMMAND_SET_CURRENT, COMMAND_SET_CURRENTRAMP, COMMAND_SET_STATE, COMMAND_SET_TEMPERATURE, COMMAND_SET_PERCENTAGE]
 	
+	# Queries are answered on the same connection with a JSON string
+	# "loopstats" or "loopstats,<instrument>" returns update loop statistics
+	QUERY_LOOP_STATS = 'loopstats'
+	# "stalls" returns the slowest traced updates (with --trace-stalls)
+	QUERY_STALLS = 'stalls'
+	# "history,<name>,<type>[,<width>[,<start>[,<stop>]]]" returns the
+	# in-memory history of a sensor, raw samples if width is 0 or not
+	# given, otherwise bins of that many seconds
+	QUERY_HISTORY = 'history'
+	# "histories,<type>,<start>,<name>[,<name>...]" returns the raw
+	# samples and every level of bins since start (may be empty) of each
+	# sensor that keeps its history, in one reply
+	QUERY_HISTORIES = 'histories'
+	# "latest,<type>,<name>[,<name>...]" returns the last value and its
+	# time of each sensor that has one
+	QUERY_LATEST = 'latest'
+	# "logqueue" returns the log queue depth, drops, and lag
+	QUERY_LOG_QUEUE = 'logqueue'
+	QUERY_FILE_WRITER = 'filewriter'
+	QUERY_FILE_POOL = 'filepool'
+	VALID_QUERIES = [QUERY_LOOP_STATS, QUERY_STALLS, QUERY_HISTORY, QUERY_HISTORIES, QUERY_LATEST, QUERY_LOG_QUEUE, QUERY_FILE_WRITER, QUERY_FILE_POOL]
+	
+	# All instruments are updated from the main loop, which sleeps
+	# until the next instrument is due or a command arrives
+	LOOP_SCHEDULED = 'scheduled'
+	# All instruments are polled in turn from the main loop, sharing
+	# a single lock
+	LOOP_ROUNDROBIN = 'roundrobin'
+	# Each instrument is updated from its own worker thread with its
+	# own lock, so a slow instrument cannot stall the others
+	LOOP_THREADED = 'threaded'
+	# All timing and I/O runs on one asyncio event loop.  AsyncInstruments
+	# run as coroutines, other instruments run in an executor.
+	LOOP_ASYNCIO = 'asyncio'
+	VALID_LOOP_MODES = [LOOP_SCHEDULED, LOOP_ROUNDROBIN, LOOP_THREADED, LOOP_ASYNCIO]
+	
+	# Warn if a single instrument update takes longer than this
+	SLOW_UPDATE_TIME = 0.3 # seconds
+	
 	# 'instruments' is a list of instruments used by the data acq system
 	# 'loggers' is a list of extra global loggers used in addition to
 	#			the per-channel logger in the Sensor class
-	def __init__ (self, instruments, loggers):
+	# 'loop_mode' is one of VALID_LOOP_MODES
+	def __init__ (self, instruments, loggers, loop_mode = LOOP_SCHEDULED):
+		
+		assert loop_mode in self.VALID_LOOP_MODES, "Invalid loop mode: " + str(loop_mode)
 		
 		self.instruments = instruments
+		self.loop_mode = loop_mode
 		
 		self._action_lock = threading.Lock()
+		self._scheduler = None
+		self._event_loop = None
+		
+		for inst in self.instruments:
+			if _is_async(inst) and loop_mode != self.LOOP_ASYNCIO:
+				raise ValueError("Instrument of type %s needs the asyncio loop mode" % (inst.BOX_TYPE,))
 		
 		self.targets = {k:{} for k in Sensor.VALID_TARGET_TYPES}
+		
+		# Every sensor by (name, type) and (alias, type), and the
+		# instrument that owns it (for the lock to take when a target is
+		# changed)
+		self.sensors = registry
+		self.sensors.add_instruments(self.instruments)
+		
+		# Update duration, period, and lag histograms for each instrument
+		self.loop_stats = LoopStats()
 
 		# Let the instruments have access to the targets and any 
 		# global loggers
@@ -42,6 +121,7 @@ class DataAcqController(PacketServer):
 			inst.connect_targets(self.targets)
 			for l in loggers:
 				inst.add_logger(l)		
+			self.loop_stats.attach(inst)
 			
 		# Bound to localhost so external commands are not accepted
 		PacketServer.__init__(self, "localhost", RECV_PORT)
@@ -49,19 +129,78 @@ class DataAcqController(PacketServer):
 	# Main data acq loop
 	def main_loop(self):
 		
+		self.loop_stats.start_export(os.path.join(DATA_LOG_FOLDER, LOOP_STATS_FILENAME), LOOP_STATS_EXPORT_PERIOD)
+		
+		if self.loop_mode == self.LOOP_THREADED:
+			self._main_loop_threaded()
+		elif self.loop_mode == self.LOOP_ASYNCIO:
+			self._main_loop_asyncio()
+		elif self.loop_mode == self.LOOP_ROUNDROBIN:
+			self._main_loop_roundrobin()
+		else:
+			self._main_loop_scheduled()
+		
+		if stall_tracer.enabled:
+			stall_tracer.report()
+			
+	# Run a single instrument update under the shared lock
+	def _run_update(self, inst):
+		trace = stall_tracer.begin(self._trace_name(inst))
+		with self._action_lock:
+			if trace is not None:
+				trace.mark_lock_acquired()
+			start_time = time.time()
+			inst.update()
+			dt = time.time() - start_time
+		stall_tracer.end(trace)
+		if dt > self.SLOW_UPDATE_TIME:
+			logging.warning("Instrument of type " + str(inst.BOX_TYPE) + " held the update loop for %0.1f sec!  Should it have its own thread?" % dt)
+	
+	# The name used for an instrument in stall traces
+	@staticmethod
+	def _trace_name(inst):
+		if inst.loop_stats is not None:
+			return inst.loop_stats.name
+		return inst.BOX_TYPE
+	
+	# Update instruments from this thread when they are due, sleeping
+	# in between
+	def _main_loop_scheduled(self):
+		
+		logging.info("Starting main data loop (scheduled)")
+		
+		self._scheduler = UpdateScheduler(self.instruments, self._run_update)
+		
+		try:
+			self._scheduler.run()
+		except KeyboardInterrupt:
+			pass
+		
+		logging.info("Main data loop closing...")
+		
+		self._scheduler = None
+		
+		with self._action_lock:
+			for inst in self.instruments:
+				inst.close()				
+		
+		logging.info("Main data loop closed")
+	
+	# Update every instrument in turn from this thread
+	def _main_loop_roundrobin(self):
+		
 		logging.info("Starting main data loop")
 		
+		# Higher priority instruments go first in each pass
+		ordered = sorted(self.instruments, key=lambda inst: -inst.priority)
+		
 		try:
 
 			# Loop all of the instruments forever
 			while True:
-				for inst in self.instruments:
-					with self._action_lock:
-						start_time = time.time()
-						inst.update()
-						dt = time.time() - start_time
-						if dt > 0.3:
-							logging.warning("Instrument of type " + str(inst.BOX_TYPE) + " held the update loop for %0.1f sec!  Should it have its own thread?" % dt)
+				for inst in ordered:
+					self._run_update(inst)
+				self.loop_stats.check_overdue()
 				# Don't loop faster than 200 Hz to prevent CPU hogging
 				time.sleep(0.005)
 				
@@ -76,19 +215,333 @@ class DataAcqController(PacketServer):
 		
 		logging.info("Main data loop closed")
 		
+	# Update each instrument from its own worker thread, this thread
+	# only waits for the shutdown request
+	def _main_loop_threaded(self):
+		
+		logging.info("Starting per-instrument worker threads")
+		
+		from .instrument_worker import InstrumentWorker
+		
+		workers = [InstrumentWorker(inst) for inst in self.instruments]
+		for w in workers:
+			w.start()
+		
+		try:
+			while True:
+				time.sleep(1)
+				self.loop_stats.check_overdue()
+		except KeyboardInterrupt:
+			pass
+		
+		logging.info("Worker threads closing...")
+		
+		for w in workers:
+			w.stop()
+		
+		for inst in self.instruments:
+			with inst.action_lock:
+				inst.close()
+		
+		logging.info("Worker threads closed")
+		
+	# Run all instruments from an asyncio event loop in this thread
+	def _main_loop_asyncio(self):
+		
+		logging.info("Starting main data loop (asyncio)")
+		
+		try:
+			asyncio.run(self._async_main())
+		except KeyboardInterrupt:
+			pass
+		
+		logging.info("Main data loop closing...")
+		
+		for inst in self.instruments:
+			if not _is_async(inst):
+				with inst.action_lock:
+					inst.close()
+		
+		logging.info("Main data loop closed")
+		
+	# Start one task per instrument and run until cancelled
+	async def _async_main(self):
+		
+		async_insts = [inst for inst in self.instruments if _is_async(inst)]
+		bridged_insts = [inst for inst in self.instruments if not _is_async(inst)]
+		
+		# One executor thread per thread-based instrument, so a slow
+		# instrument cannot hold up the others
+		executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(len(bridged_insts), 1), thread_name_prefix="Instrument Bridge")
+		
+		for inst in async_insts:
+			await inst.open_async()
+		
+		self._event_loop = asyncio.get_running_loop()
+		
+		tasks = [asyncio.create_task(self._run_async_instrument(inst)) for inst in async_insts]
+		tasks += [asyncio.create_task(self._run_bridged_instrument(inst, executor)) for inst in bridged_insts]
+		tasks.append(asyncio.create_task(self._check_overdue_async()))
+		
+		try:
+			await asyncio.gather(*tasks)
+		finally:
+			self._event_loop = None
+			for t in tasks:
+				t.cancel()
+			for inst in async_insts:
+				try:
+					await inst.close_async()
+				except:
+					logging.error("Contained error closing instrument of type %s. %s" % (inst.BOX_TYPE, traceback.format_exc()))
+			executor.shutdown(wait=True)
+	
+	# Run an AsyncInstrument's updates as a coroutine
+	async def _run_async_instrument(self, inst):
+		
+		while True:
+			
+			delay = inst.next_update_time - clock.now()
+			await asyncio.sleep(clock.real_timeout(max(delay, UpdateScheduler.MIN_INTERVAL)))
+			
+			try:
+				await inst.update_async()
+			except asyncio.CancelledError:
+				raise
+			except:
+				logging.error("Contained update error in instrument of type %s. %s" % (inst.BOX_TYPE, traceback.format_exc()))
+		
+	# Check for instruments that stopped updating once a second
+	async def _check_overdue_async(self):
+		while True:
+			await asyncio.sleep(clock.real_timeout(1))
+			self.loop_stats.check_overdue()
+		
+	# Run a thread-based instrument's update() in the executor each time
+	# it is due, holding its own lock
+	async def _run_bridged_instrument(self, inst, executor):
+		
+		loop = asyncio.get_running_loop()
+		
+		while True:
+			
+			delay = inst.next_update_time - clock.now()
+			await asyncio.sleep(clock.real_timeout(max(delay, UpdateScheduler.MIN_INTERVAL)))
+			
+			try:
+				await loop.run_in_executor(executor, self._run_update_locked, inst)
+			except asyncio.CancelledError:
+				raise
+			except:
+				logging.error("Contained update error in instrument of type %s. %s" % (inst.BOX_TYPE, traceback.format_exc()))
+		
+	# Run a single instrument update under the instrument's own lock
+	def _run_update_locked(self, inst):
+		trace = stall_tracer.begin(self._trace_name(inst))
+		with inst.action_lock:
+			if trace is not None:
+				trace.mark_lock_acquired()
+			start_time = time.time()
+			inst.update()
+			dt = time.time() - start_time
+		stall_tracer.end(trace)
+		if dt > self.SLOW_UPDATE_TIME:
+			logging.warning("Instrument of type " + str(inst.BOX_TYPE) + " held its executor thread for %0.1f sec" % dt)
+		
+	# Apply a command from the event loop.  Targets owned by thread-based
+	# instruments are set from the executor under the instrument lock,
+	# targets owned by AsyncInstruments are set directly since they are
+	# only used from the event loop.
+	async def _handle_command_async(self, data, command, name, value):
+		
+		owner = self._find_target_owner(name)
+		
+		if owner is None or _is_async(owner):
+			logging.info("Valid command: " + str(data))	
+			self._handle_command(command, name, value)
+		else:
+			loop = asyncio.get_running_loop()
+			await loop.run_in_executor(None, self._handle_command_locked, owner.action_lock, data, command, name, value)
+		
 	def _safe_set_target(self, name, target_type, value):
-		if name in self.targets[target_type]:
-			self.targets[target_type][name].value = value
-			# ~ print(target_type, name, value, self.targets[target_type][name].value)
+		s = self.sensors.get(name, target_type)
+		if s is not None:
+			s.value = value
 		else:
 			logging.error("Can't set " + str(target_type) + ", name doesn't exist: " + str(name))
+			
+	# Return the instrument owning any target with the given name, or
+	# None if there isn't one
+	def _find_target_owner(self, name):
+		for target_type in Sensor.VALID_TARGET_TYPES:
+			s = self.sensors.get(name, target_type)
+			if s is not None:
+				return self.sensors.owner(s)
+		return None
 
 	# Handle incomming packets (from packet server thread)
 	def handle_packet(self, data):
-		with self._action_lock:
-			self._handle_packet_helper(data)
+		
+		# Queries are answered directly from this thread
+		if data.rstrip().split(",")[0] in self.VALID_QUERIES:
+			return self._handle_query(data)
+		
+		parsed = self._parse_packet(data)
+		if parsed is None:
+			return
+		
+		command, name, value = parsed
+		
+		# Commands are coroutines on the event loop in asyncio mode
+		event_loop = self._event_loop
+		if event_loop is not None:
+			asyncio.run_coroutine_threadsafe(self._handle_command_async(data, command, name, value), event_loop)
+			return
+		
+		# The scheduler applies commands from its own thread as soon as
+		# it wakes, between instrument updates
+		scheduler = self._scheduler
+		if scheduler is not None:
+			scheduler.submit(lambda: self._handle_command_locked(self._action_lock, data, command, name, value))
+			return
+		
+		# With worker threads, only lock the instrument that owns the
+		# target so the other instruments keep running
+		lock = self._action_lock
+		if self.loop_mode == self.LOOP_THREADED:
+			owner = self._find_target_owner(name)
+			if owner is not None:
+				lock = owner.action_lock
+			
+		self._handle_command_locked(lock, data, command, name, value)
+		
+	# Answer a query packet, returns the reply string
+	def _handle_query(self, data):
+		
+		query_split = data.rstrip().split(",")
+		
+		if query_split[0] == self.QUERY_LOOP_STATS:
+			name = None
+			if len(query_split) > 1:
+				name = urllib.parse.unquote(query_split[1])
+			return json.dumps(self.loop_stats.to_dict(name))
+		
+		if query_split[0] == self.QUERY_STALLS:
+			return json.dumps(stall_tracer.to_dict())
+		
+		if query_split[0] == self.QUERY_HISTORY:
+			return json.dumps(self._query_history(query_split[1:]))
+		
+		if query_split[0] == self.QUERY_HISTORIES:
+			return json.dumps(self._query_histories(query_split[1:]))
+		
+		if query_split[0] == self.QUERY_LATEST:
+			return json.dumps(self._query_latest(query_split[1:]))
+		
+		if query_split[0] == self.QUERY_LOG_QUEUE:
+			return json.dumps(log_queue.to_dict())
+		
+		if query_split[0] == self.QUERY_FILE_WRITER:
+			return json.dumps(file_writer.to_dict())
+		
+		if query_split[0] == self.QUERY_FILE_POOL:
+			return json.dumps(file_pool.to_dict())
+		
+		logging.error("Invalid query: " + str(data))
+		return json.dumps(None)
+		
+	# Return the in-memory history requested by the arguments of a
+	# history query (name, type, width, start, stop), or None
+	def _query_history(self, args):
+		
+		if len(args) < 2:
+			logging.error("History query needs a sensor name and type: " + str(args))
+			return None
+		
+		try:
+			name = urllib.parse.unquote(args[0])
+			sensor_type = args[1]
+			width = float(args[2]) if len(args) > 2 and args[2] != '' else 0
+			start = float(args[3]) if len(args) > 3 and args[3] != '' else None
+			stop = float(args[4]) if len(args) > 4 and args[4] != '' else None
+		except ValueError:
+			logging.error("Bad history query: " + str(args))
+			return None
+		
+		s = self.sensors.get(name, sensor_type)
+		if s is None:
+			return None
+		
+		d = s.get_history(width if width > 0 else None, start, stop)
+		if d is None:
+			return None
+		
+		d['name'] = s.name
+		d['type'] = s.sensor_type
+		d['width'] = width
+		d['widths'] = s.history_widths
+		return d
+		
+	# Return {name: {'samples': ..., 'bins': [[width, bins], ...]}} for
+	# the arguments of a histories query (type, start, names...), with
+	# the samples and bins as returned by a history query, skipping
+	# sensors that are unknown or don't keep their history
+	def _query_histories(self, args):
+		
+		if len(args) < 2:
+			logging.error("Histories query needs a sensor type and start: " + str(args))
+			return None
+		
+		sensor_type = args[0]
+		try:
+			start = float(args[1]) if args[1] != '' else None
+		except ValueError:
+			logging.error("Bad histories query: " + str(args))
+			return None
+		
+		result = {}
+		for arg in args[2:]:
+			name = urllib.parse.unquote(arg)
+			s = self.sensors.get(name, sensor_type)
+			if s is None:
+				continue
+			samples = s.get_history(None, start)
+			if samples is None:
+				continue
+			result[name] = {'samples': samples, 'bins': [[w, s.get_history(w, start)] for w in s.history_widths]}
+		return result
+		
+	# Return {name: [time, value]} for the arguments of a latest query
+	# (type, names...), skipping sensors that are unknown or not set
+	# yet.  Non-finite values are returned as None.
+	def _query_latest(self, args):
+		
+		if len(args) < 1:
+			logging.error("Latest query needs a sensor type: " + str(args))
+			return None
+		
+		sensor_type = args[0]
+		result = {}
+		for arg in args[1:]:
+			name = urllib.parse.unquote(arg)
+			s = self.sensors.get(name, sensor_type)
+			if s is None or s.last_update_time == 0:
+				continue
+			val = s.value
+			if isinstance(val, (int, float, np.number)):
+				val = float(val) if np.isfinite(val) else None
+			result[name] = [s.last_update_time, val]
+		return result
+		
+	# Apply a validated command while holding 'lock'
+	def _handle_command_locked(self, lock, data, command, name, value):
+		with lock:
+			logging.info("Valid command: " + str(data))	
+			self._handle_command(command, name, value)
 	
-	def _handle_packet_helper(self, data):
+	# Split and validate a packet.  Returns (command, name, value) or
+	# None if the packet is invalid.
+	def _parse_packet(self, data):
 							
 		try:
 			command_split = data.rstrip().split(",")
@@ -110,10 +563,14 @@ class DataAcqController(PacketServer):
 			
 		except (TypeError, AttributeError, ValueError):
 			logging.error("Invalid packet: " + str(data))	
-			return
+			return None
 			
-		# Handle the command
-		logging.info("Valid command: " + str(data))	
+		return (command, name, value)
+			
+	# Apply a validated command.  Assumes the caller holds the relevant
+	# action lock.
+	def _handle_command(self, command, name, value):
+		
 		if command == self.COMMAND_SET_VOLTAGE:
 			self._safe_set_target(name, Sensor.TYPE_TARGET_VOLTAGE, value)
 			self._safe_set_target(name, Sensor.TYPE_TARGET_OUTPUTMODE, VoltageOutputMixin.OUTPUT_MODE_VOLTAGE)
@@ -131,4 +588,13 @@ class DataAcqController(PacketServer):
 			self._safe_set_target(name, Sensor.TYPE_TARGET_STATE, value)
 		elif command == self.COMMAND_SET_PERCENTAGE:
 			self._safe_set_target(name, Sensor.TYPE_TARGET_PERCENTAGE, value)
+		
+		# Apply the new targets now instead of on the owner's next
+		# update, which may be many seconds away
+		owner = self._find_target_owner(name)
+		if owner is not None:
+			try:
+				owner.process_dirty_targets()
+			except:
+				logging.error("Contained error processing targets of %s. %s" % (self._trace_name(owner), traceback.format_exc()))
 
@@ -0,0 +1,212 @@
+'''
+Compresses the log files of days that are no longer written to, in a
+background thread.  Every check_interval seconds the data folder is
+scanned for days at least after_days old with uncompressed log files,
+and each file is replaced by its block-compressed version (see
+pyhkdremote.blockzip).  Yesterday's files can still be open for a while
+after midnight, so after_days is at least 2, and files modified in the
+last MIN_IDLE_TIME seconds are left for a later scan.  Alias symlinks are moved to the compressed
+files.  The readers in pyhkdremote.data_loader and pyhkweb read the
+compressed files transparently.
+
+Usage:
+	- Call start() once at startup (pyhkd.py --compress-after)
+	- Or make a DayCompressor and call compress_old_days() or
+	  compress_day() directly
+'''
+
+import os
+import time
+import datetime
+import logging
+import threading
+
+from pyhkdremote import binlog
+from pyhkdremote import blockzip
+from . import clock
+
+# The running DayCompressor, or None
+active = None
+
+# Uncompressed log file extensions
+_EXTENSIONS = ['.txt', binlog.EXTENSION]
+
+class DayCompressor:
+
+	# Files modified more recently than this (in seconds) may still be
+	# written to, and are skipped
+	MIN_IDLE_TIME = 3600
+
+	# 'base_folder'		The date-sorted log folder (DATA_LOG_FOLDER)
+	# 'after_days'		Compress days this many days before today, or
+	#					earlier (at least 2)
+	# 'check_interval'	Seconds between scans
+	def __init__(self, base_folder, after_days=7, check_interval=3600):
+
+		assert after_days >= 2, "Only days before yesterday can be compressed"
+
+		self._base_folder = base_folder
+		self._after_days = after_days
+		self._check_interval = check_interval
+
+		self._stop_event = threading.Event()
+		self._stats_lock = threading.Lock()
+		self.num_files = 0
+		self.num_errors = 0
+		self.bytes_before = 0
+		self.bytes_after = 0
+		self.last_scan = None
+		self._thread = None
+
+	# Scan in a background thread until stopped
+	def start(self):
+		self._thread = threading.Thread(target=self._run, name="Day Compressor")
+		self._thread.daemon = True
+		self._thread.start()
+
+	def _run(self):
+
+		while not self._stop_event.is_set():
+			try:
+				self.compress_old_days()
+			except Exception as e:
+				logging.error("Day compressor failed: " + repr(e))
+			self._stop_event.wait(self._check_interval)
+
+	# Returns the (date, folder) of each day folder in the log folder,
+	# oldest first
+	def _day_folders(self):
+
+		days = []
+		for year in _numeric_entries(self._base_folder):
+			year_folder = os.path.join(self._base_folder, year)
+			for month in _numeric_entries(year_folder):
+				month_folder = os.path.join(year_folder, month)
+				for day in _numeric_entries(month_folder):
+					try:
+						d = datetime.date(int(year), int(month), int(day))
+					except ValueError:
+						continue
+					days.append((d, os.path.join(month_folder, day)))
+		days.sort()
+		return days
+
+	# Compress every old enough day
+	def compress_old_days(self):
+
+		last_day = clock.today() - datetime.timedelta(days=self._after_days)
+		for d, folder in self._day_folders():
+			if d > last_day or self._stop_event.is_set():
+				break
+			self.compress_day(folder)
+
+		with self._stats_lock:
+			self.last_scan = time.time()
+
+	# Compress the log files in each type folder of a day folder
+	def compress_day(self, folder):
+
+		num_files = 0
+		bytes_before = 0
+		bytes_after = 0
+
+		for type_name in sorted(os.listdir(folder)):
+
+			type_folder = os.path.join(folder, type_name)
+			if not os.path.isdir(type_folder):
+				continue
+
+			entries = sorted(os.listdir(type_folder))
+			links = []
+			for name in entries:
+
+				filename = os.path.join(type_folder, name)
+
+				if name.endswith(blockzip.EXTENSION + '.tmp'):
+					# Left by an interrupted run
+					os.remove(filename)
+					continue
+
+				if not any(name.endswith(ext) for ext in _EXTENSIONS):
+					continue
+				if os.path.islink(filename):
+					links.append(name)
+					continue
+
+				try:
+					if (time.time() - os.path.getmtime(filename)) < self.MIN_IDLE_TIME:
+						continue
+					size = os.path.getsize(filename)
+					compressed = blockzip.compress(filename)
+				except (OSError, IOError) as e:
+					logging.error("Failed to compress %s: %s" % (filename, repr(e)))
+					with self._stats_lock:
+						self.num_errors += 1
+					continue
+
+				if compressed is not None:
+					num_files += 1
+					bytes_before += size
+					bytes_after += os.path.getsize(compressed)
+
+			# Point the aliases at the compressed files
+			for name in links:
+				filename = os.path.join(type_folder, name)
+				target = os.readlink(filename)
+				if os.path.exists(os.path.join(type_folder, target + blockzip.EXTENSION)):
+					try:
+						os.symlink(target + blockzip.EXTENSION, filename + blockzip.EXTENSION)
+					except OSError:
+						pass
+					os.remove(filename)
+
+		if num_files > 0:
+			logging.info("Compressed %i log files in %s, %0.1f MB to %0.1f MB" % (num_files, folder, bytes_before / 1e6, bytes_after / 1e6))
+
+		with self._stats_lock:
+			self.num_files += num_files
+			self.bytes_before += bytes_before
+			self.bytes_after += bytes_after
+
+	def stop(self, timeout=10):
+		self._stop_event.set()
+		if self._thread is not None:
+			self._thread.join(timeout)
+
+	# Return a JSON-friendly summary
+	def to_dict(self):
+		with self._stats_lock:
+			return {'after_days': self._after_days,
+					'num_files': self.num_files,
+					'num_errors': self.num_errors,
+					'bytes_before': self.bytes_before,
+					'bytes_after': self.bytes_after,
+					'last_scan': self.last_scan}
+
+# Returns the entries of 'folder' that are numbers (years, months or
+# days), or [] if it can't be listed
+def _numeric_entries(folder):
+	try:
+		return [name for name in os.listdir(folder) if name.isdigit()]
+	except OSError:
+		return []
+
+# Start compressing old days (see DayCompressor for the arguments)
+def start(base_folder, after_days=7, check_interval=3600):
+
+	global active
+
+	if active is None:
+		active = DayCompressor(base_folder, after_days, check_interval)
+		active.start()
+	return active
+
+# Stop after the file being compressed
+def stop():
+
+	global active
+
+	c = active
+	active = None
+	if c is not None:
+		c.stop()
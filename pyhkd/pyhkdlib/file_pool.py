@@ -0,0 +1,189 @@
+'''
+A pool of open log files shared by every SoloDateLogger, for configs
+with more log files than the open file limit allows.  Once started,
+loggers get a PooledFile for each of their files instead of an open
+file.  At most max_open of them have an open file at once: writing to
+one that isn't open opens it again (in append mode) and closes the
+least recently used one if the pool is full.
+
+With the file_writer each file is written once per flush, so a pool
+smaller than the number of files opens about (files - max_open) files
+per flush.  That is cheap next to running out of file descriptors, and
+the hit, miss and eviction counts (and how long the opens take) show
+what it costs.
+
+Usage:
+	- Call start() once at startup, before instruments are created
+	- Call stop() at shutdown, after the file_writer
+	- Call to_dict() for the pool statistics
+'''
+
+import time
+import errno
+import logging
+import threading
+import collections
+
+from .loop_stats import RollingHistogram
+
+# The running FilePool, or None when loggers keep their files open
+active = None
+
+# A log file opened through the pool.  Has the parts of the file object
+# interface that the loggers and the file_writer use.  Once closed it
+# stays closed, and using it raises ValueError as a closed file does
+# (a file only closed to make room in the pool opens again).
+class PooledFile:
+
+	__slots__ = ['name', 'closed', '_pool']
+
+	mode = 'ab'
+
+	def __init__(self, pool, name):
+		self._pool = pool
+		self.name = name
+		self.closed = False
+
+	def write(self, data):
+		return self._pool.write(self, data)
+
+	def tell(self):
+		return self._pool.call(self, 'tell')
+
+	def fileno(self):
+		return self._pool.call(self, 'fileno')
+
+	def close(self):
+		self._pool.close(self)
+
+class FilePool:
+
+	# 'max_open'	Most files open at once
+	def __init__(self, max_open=512):
+
+		assert max_open > 0, "max_open should be a positive number of files"
+
+		self._max_open = max_open
+
+		# PooledFile -> open file, least recently used first
+		self._lock = threading.Lock()
+		self._open_files = collections.OrderedDict()
+
+		self.open_duration = RollingHistogram(min_value=1e-6, max_value=1e1)
+		self.num_hits = 0
+		self.num_misses = 0
+		self.num_evictions = 0
+		self.num_errors = 0
+
+	# Returns a PooledFile for 'filename', which is opened (and created
+	# if need be) right away so errors show up here.  Raises OSError if
+	# it can't be opened.
+	def open(self, filename):
+		pooled = PooledFile(self, filename)
+		with self._lock:
+			self._get(pooled)
+		return pooled
+
+	# Returns the open file of 'pooled', opening it if need be.  Called
+	# holding _lock.  Raises ValueError if 'pooled' was closed.
+	def _get(self, pooled):
+
+		if pooled.closed:
+			raise ValueError("I/O operation on closed file")
+
+		f = self._open_files.get(pooled)
+		if f is not None:
+			self._open_files.move_to_end(pooled)
+			self.num_hits += 1
+			return f
+
+		self.num_misses += 1
+		while len(self._open_files) >= self._max_open:
+			_, old = self._open_files.popitem(last=False)
+			old.close()
+			self.num_evictions += 1
+
+		start_time = time.perf_counter()
+		while True:
+			try:
+				# Unbuffered, as SoloDateLogger opens its files
+				f = open(pooled.name, 'ab', buffering=0)
+				break
+			except OSError as e:
+				# Out of file descriptors (used by something else), so
+				# give up some of ours
+				if e.errno == errno.EMFILE and len(self._open_files) > 0:
+					_, old = self._open_files.popitem(last=False)
+					old.close()
+					self.num_evictions += 1
+					continue
+				self.num_errors += 1
+				raise
+		self.open_duration.add(time.perf_counter() - start_time)
+
+		self._open_files[pooled] = f
+		return f
+
+	def write(self, pooled, data):
+		with self._lock:
+			return self._get(pooled).write(data)
+
+	# Call a method of the open file of 'pooled'
+	def call(self, pooled, method):
+		with self._lock:
+			return getattr(self._get(pooled), method)()
+
+	def close(self, pooled):
+		with self._lock:
+			pooled.closed = True
+			f = self._open_files.pop(pooled, None)
+		if f is not None:
+			f.close()
+
+	# Close every open file (they open again if written to)
+	def close_all(self):
+		with self._lock:
+			open_files = list(self._open_files.values())
+			self._open_files.clear()
+		for f in open_files:
+			f.close()
+
+	# Return a JSON-friendly summary
+	def to_dict(self):
+		with self._lock:
+			lookups = self.num_hits + self.num_misses
+			return {'max_open': self._max_open,
+					'num_open': len(self._open_files),
+					'num_hits': self.num_hits,
+					'num_misses': self.num_misses,
+					'hit_rate': (self.num_hits / lookups) if lookups > 0 else None,
+					'num_evictions': self.num_evictions,
+					'num_errors': self.num_errors,
+					'open_duration': self.open_duration.to_dict()}
+
+# Start pooling log files (see FilePool for the arguments)
+def start(max_open=512):
+
+	global active
+
+	if active is None:
+		active = FilePool(max_open)
+		logging.info("Keeping at most %i log files open" % (max_open,))
+	return active
+
+# Close the open files and stop pooling new ones
+def stop():
+
+	global active
+
+	p = active
+	active = None
+	if p is not None:
+		p.close_all()
+
+# Return a summary of the running pool, or None
+def to_dict():
+	p = active
+	if p is None:
+		return None
+	return p.to_dict()
@@ -0,0 +1,267 @@
+'''
+Batches the lines written to the log files.  Once started, loggers hand
+each formatted line to the writer instead of writing it to its file, and
+a worker thread writes everything held for a file with a single write
+call, every flush_time seconds or sooner if more than max_pending bytes
+are held.  With a few hundred log files this replaces a system call per
+value with one per file per flush.
+
+Lines reach the files at most flush_time seconds late (plus the log
+queue lag), which is also how much data a crash can lose.  To also
+bound what a power cut can lose, fsync_interval makes the worker
+os.fsync() the files written since the last fsync that often.
+
+Usage:
+	- Call start() once at startup, before the log queue and instruments
+	- Loggers call write() and close() instead of writing or closing
+	  their files, which falls back to direct calls when not started
+	- Call stop() at shutdown to write out everything held (also done
+	  at exit)
+	- Call to_dict() for the batch statistics
+'''
+
+import os
+import time
+import atexit
+import logging
+import threading
+
+from .loop_stats import RollingHistogram
+
+# The running FileWriter, or None when loggers write directly
+active = None
+
+class FileWriter:
+
+	# Log write errors at most this often
+	WARN_INTERVAL = 60 # seconds
+
+	# 'flush_time'		Longest time a line is held before it is written
+	# 'max_pending'		Bytes held (across all files) that start a flush
+	#					before flush_time
+	# 'fsync_interval'	How often to fsync the written files, or None
+	def __init__(self, flush_time=1.0, max_pending=1048576, fsync_interval=None):
+
+		assert flush_time > 0, "flush_time should be a positive number of seconds"
+		assert max_pending > 0, "max_pending should be a positive number of bytes"
+		assert fsync_interval is None or fsync_interval > 0, "fsync_interval should be None or a positive number of seconds"
+
+		self._flush_time = flush_time
+		self._max_pending = max_pending
+		self._fsync_interval = fsync_interval
+
+		# fileobj -> [bytes, list of lines] held for it.  Reentrant
+		# locks, since a logger collected by the garbage collector
+		# while a thread holds one closes its files through us.
+		self._cond = threading.Condition(threading.RLock())
+		self._pending = {}
+		self._pending_bytes = 0
+		self._stopping = False
+
+		# Held while writing, so the lines of each file reach it in order
+		self._io_lock = threading.RLock()
+		self._unsynced = set()
+		self._last_fsync = time.monotonic()
+
+		self._stats_lock = threading.Lock()
+		self.flush_duration = RollingHistogram(min_value=1e-6, max_value=1e2)
+		self.num_lines = 0
+		self.num_bytes = 0
+		self.num_writes = 0
+		self.num_flushes = 0
+		self.num_fsyncs = 0
+		self.fsync_time = 0.0
+		self.num_errors = 0
+		self._last_warning = 0
+
+		self._thread = threading.Thread(target=self._run, name="File Writer")
+		self._thread.daemon = True
+		self._thread.start()
+
+	# Hold 'data' (bytes) to be written to 'fileobj'
+	def write(self, fileobj, data):
+		with self._cond:
+			entry = self._pending.get(fileobj)
+			if entry is None:
+				entry = self._pending[fileobj] = [0, []]
+			entry[0] += len(data)
+			entry[1].append(data)
+			self._pending_bytes += len(data)
+			if self._pending_bytes >= self._max_pending:
+				self._cond.notify()
+
+	# Write out anything held for 'fileobj' and close it
+	def close(self, fileobj):
+		with self._io_lock:
+
+			with self._cond:
+				entry = self._pending.pop(fileobj, None)
+				if entry is not None:
+					self._pending_bytes -= entry[0]
+
+			if entry is not None:
+				self._write_file(fileobj, entry)
+
+			if fileobj in self._unsynced:
+				self._unsynced.discard(fileobj)
+				self._fsync([fileobj])
+
+			fileobj.close()
+
+	# Write out everything held so far
+	def flush(self):
+		with self._io_lock:
+
+			with self._cond:
+				pending = self._pending
+				self._pending = {}
+				self._pending_bytes = 0
+
+			start_time = time.perf_counter()
+			for fileobj, entry in pending.items():
+				self._write_file(fileobj, entry)
+
+			if self._fsync_interval is not None and (time.monotonic() - self._last_fsync) >= self._fsync_interval:
+				unsynced = self._unsynced
+				self._unsynced = set()
+				self._fsync(unsynced)
+				self._last_fsync = time.monotonic()
+
+			with self._stats_lock:
+				self.num_flushes += 1
+				if len(pending) > 0:
+					self.flush_duration.add(time.perf_counter() - start_time)
+
+	# Write the held lines of one file, called holding _io_lock
+	def _write_file(self, fileobj, entry):
+
+		size, lines = entry
+		try:
+			fileobj.write(b''.join(lines))
+		except (OSError, ValueError) as e:
+			self._error("Failed to write %i bytes to %s: %s" % (size, getattr(fileobj, 'name', '?'), repr(e)))
+			return
+
+		if self._fsync_interval is not None:
+			self._unsynced.add(fileobj)
+
+		with self._stats_lock:
+			self.num_lines += len(lines)
+			self.num_bytes += size
+			self.num_writes += 1
+
+	def _fsync(self, fileobjs):
+
+		start_time = time.perf_counter()
+		n = 0
+		for fileobj in fileobjs:
+			try:
+				os.fsync(fileobj.fileno())
+				n += 1
+			except (OSError, ValueError):
+				# Closed since, or not a real file
+				pass
+
+		with self._stats_lock:
+			self.num_fsyncs += n
+			self.fsync_time += time.perf_counter() - start_time
+
+	def _error(self, msg):
+		with self._stats_lock:
+			self.num_errors += 1
+			now = time.time()
+			if (now - self._last_warning) > self.WARN_INTERVAL:
+				logging.error(msg)
+				self._last_warning = now
+
+	# Flush every flush_time seconds (or when enough is held) until stopped
+	def _run(self):
+
+		while True:
+
+			with self._cond:
+				if self._pending_bytes < self._max_pending and not self._stopping:
+					self._cond.wait(self._flush_time)
+				stopping = self._stopping
+
+			self.flush()
+
+			if stopping:
+				break
+
+	# Write out everything held and stop the worker
+	def stop(self, timeout=10):
+
+		with self._cond:
+			self._stopping = True
+			self._cond.notify_all()
+		self._thread.join(timeout)
+
+		# Anything written while stopping, and a last fsync
+		if self._fsync_interval is not None:
+			self._last_fsync = 0
+		self.flush()
+
+	# Return a JSON-friendly summary
+	def to_dict(self):
+		with self._cond:
+			pending_bytes = self._pending_bytes
+			pending_files = len(self._pending)
+		with self._stats_lock:
+			return {'flush_time': self._flush_time,
+					'max_pending': self._max_pending,
+					'fsync_interval': self._fsync_interval,
+					'pending_bytes': pending_bytes,
+					'pending_files': pending_files,
+					'num_lines': self.num_lines,
+					'num_bytes': self.num_bytes,
+					'num_writes': self.num_writes,
+					'num_flushes': self.num_flushes,
+					'lines_per_write': (self.num_lines / self.num_writes) if self.num_writes > 0 else None,
+					'num_fsyncs': self.num_fsyncs,
+					'fsync_time': self.fsync_time,
+					'num_errors': self.num_errors,
+					'flush_duration': self.flush_duration.to_dict()}
+
+# Start batching log file writes (see FileWriter for the arguments)
+def start(flush_time=1.0, max_pending=1048576, fsync_interval=None):
+
+	global active
+
+	if active is None:
+		active = FileWriter(flush_time, max_pending, fsync_interval)
+		atexit.register(stop)
+	return active
+
+# Write out everything held, then write directly again
+def stop():
+
+	global active
+
+	w = active
+	active = None
+	if w is not None:
+		w.stop()
+
+# Write 'data' (bytes) to 'fileobj', through the running writer if any
+def write(fileobj, data):
+	w = active
+	if w is None:
+		fileobj.write(data)
+	else:
+		w.write(fileobj, data)
+
+# Close 'fileobj' after writing out anything held for it
+def close(fileobj):
+	w = active
+	if w is None:
+		fileobj.close()
+	else:
+		w.close(fileobj)
+
+# Return a summary of the running writer, or None
+def to_dict():
+	w = active
+	if w is None:
+		return None
+	return w.to_dict()
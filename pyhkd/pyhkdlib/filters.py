@@ -0,0 +1,394 @@
+'''
+Streaming filters for sensor values.  Each stage keeps its own state and
+handles one sample at a time, at a cost that depends only on its
+settings, not on how many samples it has seen: O(log window) per sample
+for "median" and "spike", O(1) (amortized over a window) for "mavg",
+and O(order) for "butter".
+Stages are chained per sensor with the "filters" channel key, for
+example:
+
+	"filters": [["spike", 5, 3.0], ["butter", 2, 0.1], ["ema", 0.2]]
+
+Stages (name and arguments in the config file):
+	["median", window]				Rolling median of the last 'window' values
+	["spike", window, threshold]	Replace values more than 'threshold'
+									standard deviations from the rolling
+									median with the median
+	["butter", order, cutoff]		Low pass Butterworth filter, 'cutoff' is
+									a fraction of the Nyquist frequency
+	["mavg", window]				Rolling mean of the last 'window' values
+	["ema", alpha]					Exponential moving average
+
+NaN (and other non-finite) values pass through without changing the
+state of any stage.
+
+Usage:
+	- Add "filters" to a channel in the hardware config file
+	- Or call build_chain() with a list of stages and call the returned
+	  FilterChain with each new value
+'''
+
+import sys
+import math
+import heapq
+import collections
+
+# Median of a multiset of values in two heaps: the lower half (negated,
+# so its largest value is on top) and the upper half.  Removed values
+# are only counted and dropped once they reach the top of a heap, so
+# adding or removing a value costs O(log n).  Removed values buried in
+# a heap take up room until rebuild() is called.
+class _MedianHeaps:
+
+	__slots__ = ['_low', '_high', '_n_low', '_n_high', '_removed']
+
+	def __init__(self):
+		self.clear()
+
+	def clear(self):
+		self._low = []
+		self._high = []
+		self._n_low = 0
+		self._n_high = 0
+		self._removed = collections.Counter()
+
+	# Entries in the heaps, including removed ones not dropped yet
+	def __len__(self):
+		return len(self._low) + len(self._high)
+
+	def add(self, x):
+		if self._n_low == 0 or x <= -self._low[0]:
+			heapq.heappush(self._low, -x)
+			self._n_low += 1
+		else:
+			heapq.heappush(self._high, x)
+			self._n_high += 1
+		self._balance()
+
+	# Remove one copy of 'x', which must have been added
+	def remove(self, x):
+		self._removed[x] += 1
+		if x <= -self._low[0]:
+			self._n_low -= 1
+			if x == -self._low[0]:
+				self._prune(self._low, -1)
+		else:
+			self._n_high -= 1
+			if len(self._high) > 0 and x == self._high[0]:
+				self._prune(self._high, 1)
+		self._balance()
+
+	def median(self):
+		if self._n_low > self._n_high:
+			return -self._low[0]
+		return 0.5 * (-self._low[0] + self._high[0])
+
+	# Start over from 'values', dropping the removed values
+	def rebuild(self, values):
+		s = sorted(values)
+		half = (len(s) + 1) // 2
+		self.clear()
+		self._low = [-v for v in reversed(s[:half])]
+		self._high = s[half:]
+		self._n_low = len(self._low)
+		self._n_high = len(self._high)
+
+	# Drop removed values from the top of 'heap' ('sign' is -1 for the
+	# negated lower half)
+	def _prune(self, heap, sign):
+		while len(heap) > 0:
+			x = sign * heap[0]
+			if self._removed[x] == 0:
+				break
+			self._removed[x] -= 1
+			if self._removed[x] == 0:
+				del self._removed[x]
+			heapq.heappop(heap)
+
+	# Keep the lower half the same size as the upper half, or one larger
+	def _balance(self):
+		if self._n_low > self._n_high + 1:
+			heapq.heappush(self._high, -heapq.heappop(self._low))
+			self._n_low -= 1
+			self._n_high += 1
+			self._prune(self._low, -1)
+		elif self._n_low < self._n_high:
+			heapq.heappush(self._low, -heapq.heappop(self._high))
+			self._n_low += 1
+			self._n_high -= 1
+			self._prune(self._high, 1)
+
+# Rolling window of the last 'window' values, with their mean and
+# variance (and optionally their median) kept up to date as values come
+# and go.  The sums are taken relative to a recent value to avoid
+# cancellation between large, nearly equal values.
+class _Window:
+
+	__slots__ = ['values', 'heaps', 'window', '_shift', '_s1', '_s2', '_since_refresh']
+
+	def __init__(self, window, keep_median=False):
+		self.window = window
+		self.values = collections.deque()
+		self.heaps = _MedianHeaps() if keep_median else None
+		self._shift = None
+		self._s1 = 0.0
+		self._s2 = 0.0
+		self._since_refresh = 0
+
+	def add(self, x):
+
+		if self._shift is None:
+			self._shift = x
+
+		self.values.append(x)
+		d = x - self._shift
+		self._s1 += d
+		self._s2 += d * d
+		if self.heaps is not None:
+			self.heaps.add(x)
+
+		if len(self.values) > self.window:
+			old = self.values.popleft()
+			d = old - self._shift
+			self._s1 -= d
+			self._s2 -= d * d
+			if self.heaps is not None:
+				self.heaps.remove(old)
+
+		# Recompute the sums once per window so rounding errors from
+		# the running updates can't build up, and drop the removed
+		# values buried in the median heaps
+		self._since_refresh += 1
+		if self._since_refresh >= self.window:
+			self._shift = x
+			self._s1 = math.fsum([v - x for v in self.values])
+			self._s2 = math.fsum([(v - x) * (v - x) for v in self.values])
+			if self.heaps is not None and len(self.heaps) > 2 * self.window:
+				self.heaps.rebuild(self.values)
+			self._since_refresh = 0
+
+	def mean(self):
+		return self._shift + self._s1 / len(self.values)
+
+	# Sample variance (n - 1 in the denominator)
+	def variance(self):
+		n = len(self.values)
+		if n < 2:
+			return 0.0
+		return max((self._s2 - self._s1 * self._s1 / n) / (n - 1), 0.0)
+
+	def median(self):
+		return self.heaps.median()
+
+	def clear(self):
+		self.values.clear()
+		if self.heaps is not None:
+			self.heaps.clear()
+		self._shift = None
+		self._s1 = 0.0
+		self._s2 = 0.0
+		self._since_refresh = 0
+
+class Median:
+
+	__slots__ = ['_win']
+
+	def __init__(self, window):
+		if int(window) != window or window < 1:
+			raise ValueError("median window should be a positive integer")
+		self._win = _Window(int(window), keep_median=True)
+
+	def __call__(self, x):
+		self._win.add(x)
+		return self._win.median()
+
+	def reset(self):
+		self._win.clear()
+
+# Replaces spikes with the rolling median.  The window includes the new
+# value, and values pass through until the window is full.
+class SpikeFilter:
+
+	__slots__ = ['_win', '_threshold']
+
+	def __init__(self, window, threshold=3.0):
+		if int(window) != window or window < 2:
+			raise ValueError("spike window should be an integer of at least 2")
+		if threshold <= 0:
+			raise ValueError("spike threshold should be positive")
+		self._win = _Window(int(window), keep_median=True)
+		self._threshold = float(threshold)
+
+	def __call__(self, x):
+
+		win = self._win
+		win.add(x)
+		n = len(win.values)
+		if n < win.window:
+			return x
+
+		median = win.median()
+		std = math.sqrt(win.variance())
+
+		if std > 0 and abs(x - median) > self._threshold * std:
+			return median
+		return x
+
+	def reset(self):
+		self._win.clear()
+
+class MovingAverage:
+
+	__slots__ = ['_win']
+
+	def __init__(self, window):
+		if int(window) != window or window < 1:
+			raise ValueError("mavg window should be a positive integer")
+		self._win = _Window(int(window))
+
+	def __call__(self, x):
+		self._win.add(x)
+		return self._win.mean()
+
+	def reset(self):
+		self._win.clear()
+
+# The same filter as the Sensor "filter" key
+class EMA:
+
+	__slots__ = ['_alpha', '_y']
+
+	def __init__(self, alpha):
+		if not (0 < alpha <= 1):
+			raise ValueError("ema alpha should be in the range (0, 1]")
+		self._alpha = float(alpha)
+		self._y = None
+
+	def __call__(self, x):
+		if self._y is None:
+			self._y = x
+		else:
+			self._y += self._alpha * (x - self._y)
+		return self._y
+
+	def reset(self):
+		self._y = None
+
+# Low pass Butterworth filter, run as a cascade of second order sections
+# (plus one first order section for odd orders).  The coefficients are
+# the bilinear transform of the analog prototype with the cutoff
+# pre-warped, which gives the same filter as scipy.signal.butter(order,
+# cutoff).  The state starts at the first value, as if the input had
+# always been that value.
+class Butterworth:
+
+	__slots__ = ['_sections', '_state']
+
+	# 'cutoff' is a fraction of the Nyquist frequency (0 to 1)
+	def __init__(self, order, cutoff):
+
+		if int(order) != order or order < 1:
+			raise ValueError("butter order should be a positive integer")
+		if not (0 < cutoff < 1):
+			raise ValueError("butter cutoff should be a fraction of the Nyquist frequency, between 0 and 1")
+
+		order = int(order)
+		k = math.tan(math.pi * cutoff / 2)
+
+		# (b0, b1, b2, a1, a2) for each section
+		self._sections = []
+		for i in range(order // 2):
+			q = 1 / (2 * math.cos(math.pi * (order - 1 - 2 * i) / (2 * order)))
+			norm = 1 / (1 + k / q + k * k)
+			b0 = k * k * norm
+			self._sections.append((b0, 2 * b0, b0, 2 * (k * k - 1) * norm, (1 - k / q + k * k) * norm))
+		if order % 2:
+			norm = 1 / (1 + k)
+			self._sections.append((k * norm, k * norm, 0.0, (k - 1) * norm, 0.0))
+
+		self._state = None
+
+	def __call__(self, x):
+
+		state = self._state
+		if state is None:
+			# Steady state for a constant input (each section has unity
+			# gain at DC)
+			state = self._state = []
+			for b0, b1, b2, a1, a2 in self._sections:
+				s2 = (b2 - a2) * x
+				state.append([(b1 - a1) * x + s2, s2])
+
+		# Transposed direct form II
+		for (b0, b1, b2, a1, a2), s in zip(self._sections, state):
+			y = b0 * x + s[0]
+			s[0] = b1 * x - a1 * y + s[1]
+			s[1] = b2 * x - a2 * y
+			x = y
+
+		return x
+
+	def reset(self):
+		self._state = None
+
+# Stage names used in the config file
+STAGES = {
+	'median': Median,
+	'spike': SpikeFilter,
+	'butter': Butterworth,
+	'mavg': MovingAverage,
+	'ema': EMA,
+}
+
+# A list of stages applied in order
+class FilterChain:
+
+	__slots__ = ['_stages']
+
+	def __init__(self, stages):
+		self._stages = tuple(stages)
+
+	# Return the filtered value.  Values that aren't finite numbers are
+	# returned unchanged.
+	def __call__(self, x):
+
+		try:
+			x = float(x)
+		except (TypeError, ValueError):
+			return x
+		if not math.isfinite(x):
+			return x
+
+		for stage in self._stages:
+			x = stage(x)
+		return x
+
+	def reset(self):
+		for stage in self._stages:
+			stage.reset()
+
+	def __len__(self):
+		return len(self._stages)
+
+# Build a FilterChain from a list of [name, arg, ...] stages, as in the
+# "filters" channel key.  Exits with an error naming 'chan_name' if the
+# list is invalid.
+def build_chain(spec, chan_name=''):
+
+	if not isinstance(spec, (list, tuple)):
+		sys.exit("The channel parameter 'filters' of '%s' should be a list of stages, such as [[\"median\", 5], [\"ema\", 0.2]]" % chan_name)
+
+	stages = []
+	for stage in spec:
+
+		if isinstance(stage, str):
+			stage = [stage]
+		if not isinstance(stage, (list, tuple)) or len(stage) < 1 or stage[0] not in STAGES:
+			sys.exit("Bad filter stage %s for channel '%s' (valid stages: %s)" % (repr(stage), chan_name, ", ".join(STAGES.keys())))
+
+		try:
+			stages.append(STAGES[stage[0]](*stage[1:]))
+		except (TypeError, ValueError) as e:
+			sys.exit("Bad filter stage %s for channel '%s': %s" % (repr(stage), chan_name, str(e)))
+
+	return FilterChain(stages)
@@ -0,0 +1,177 @@
+'''
+Recent history of a sensor, kept in memory so recent-window plots and
+dashboards can be served by pyhkd without reading the log files.  Each
+history holds a ring buffer of the newest raw samples and, for each
+configured bin width, a ring buffer of binned min/max/mean values.
+Memory use is fixed when the history is created.
+
+Usage:
+	- Sensors create a SensorHistory on their first numeric value (see
+	  HISTORY_SAMPLES and HISTORY_LEVELS in settings)
+	- Call add() with each new value
+	- Call samples() or bins() to read it back (for example through the
+	  "history" query of pyhkd)
+'''
+
+import math
+import numpy as np
+
+from .settings import HISTORY_SAMPLES, HISTORY_LEVELS
+
+# Binned min/max/mean of the values in fixed-width time bins.  The bin
+# being filled is kept in plain floats and only stored in the arrays
+# once a value arrives for a later bin.
+class _BinRing:
+
+	__slots__ = ['width', '_bin_ids', '_min', '_max', '_sum', '_count',
+				 '_cur_bin', '_cur_min', '_cur_max', '_cur_sum', '_cur_count']
+
+	def __init__(self, width, num_bins):
+
+		self.width = width
+		self._bin_ids = np.full(num_bins, -1, dtype=np.int64)
+		self._min = np.full(num_bins, np.nan)
+		self._max = np.full(num_bins, np.nan)
+		self._sum = np.zeros(num_bins)
+		self._count = np.zeros(num_bins, dtype=np.int32)
+
+		self._cur_bin = None
+		self._reset()
+
+	def _reset(self):
+		self._cur_min = math.inf
+		self._cur_max = -math.inf
+		self._cur_sum = 0.0
+		self._cur_count = 0
+
+	# Store the bin being filled in the arrays
+	def _store(self):
+
+		i = self._cur_bin % len(self._bin_ids)
+		self._bin_ids[i] = self._cur_bin
+		if self._cur_count > 0:
+			self._min[i] = self._cur_min
+			self._max[i] = self._cur_max
+		else:
+			self._min[i] = np.nan
+			self._max[i] = np.nan
+		self._sum[i] = self._cur_sum
+		self._count[i] = self._cur_count
+
+	def add(self, value, update_time):
+
+		b = int(update_time // self.width)
+
+		if b != self._cur_bin:
+			if self._cur_bin is not None:
+				# Values older than the bin being filled are dropped
+				if b < self._cur_bin:
+					return
+				self._store()
+			self._cur_bin = b
+			self._reset()
+
+		# NaN values only count towards the raw history
+		if value == value:
+			if value < self._cur_min:
+				self._cur_min = value
+			if value > self._cur_max:
+				self._cur_max = value
+			self._cur_sum += value
+			self._cur_count += 1
+
+	# Return a dict of lists (time of the bin start, min, max, mean,
+	# count) for the bins overlapping start to stop, oldest first
+	def to_dict(self, start=None, stop=None):
+
+		if self._cur_bin is None:
+			return {'time': [], 'min': [], 'max': [], 'mean': [], 'count': []}
+
+		# Include the bin being filled
+		self._store()
+
+		oldest = self._cur_bin - len(self._bin_ids) + 1
+		if start is not None:
+			oldest = max(oldest, int(start // self.width))
+		newest = self._cur_bin
+		if stop is not None:
+			newest = min(newest, int(stop // self.width))
+
+		valid = (self._bin_ids >= oldest) & (self._bin_ids <= newest)
+		order = np.argsort(self._bin_ids[valid])
+		count = self._count[valid][order]
+
+		with np.errstate(invalid='ignore', divide='ignore'):
+			mean = np.where(count > 0, self._sum[valid][order] / count, np.nan)
+
+		return {'time': (self._bin_ids[valid][order] * self.width).tolist(),
+				'min': self._min[valid][order].tolist(),
+				'max': self._max[valid][order].tolist(),
+				'mean': mean.tolist(),
+				'count': count.tolist()}
+
+# The recent history of one sensor.  Not thread safe, Sensor calls it
+# while holding its update lock.
+class SensorHistory:
+
+	__slots__ = ['_times', '_values', '_next', '_full', '_levels']
+
+	# 'num_samples'	Number of raw samples kept
+	# 'levels'		List of (bin width in seconds, number of bins)
+	def __init__(self, num_samples=HISTORY_SAMPLES, levels=HISTORY_LEVELS):
+
+		self._times = np.full(num_samples, np.nan)
+		self._values = np.full(num_samples, np.nan)
+		self._next = 0
+		self._full = False
+		self._levels = [_BinRing(width, num_bins) for width, num_bins in levels]
+
+	# Bin widths (in seconds) available from bins()
+	@property
+	def widths(self):
+		return [level.width for level in self._levels]
+
+	# Add a value (a float, may be NaN) from 'update_time'
+	def add(self, value, update_time):
+
+		if len(self._values) > 0:
+			i = self._next
+			self._times[i] = update_time
+			self._values[i] = value
+			i += 1
+			if i >= len(self._values):
+				i = 0
+				self._full = True
+			self._next = i
+
+		for level in self._levels:
+			level.add(value, update_time)
+
+	# Return a dict of lists (time, value) of the raw samples from start
+	# to stop, oldest first
+	def samples(self, start=None, stop=None):
+
+		if self._full:
+			times = np.concatenate((self._times[self._next:], self._times[:self._next]))
+			values = np.concatenate((self._values[self._next:], self._values[:self._next]))
+		else:
+			times = self._times[:self._next]
+			values = self._values[:self._next]
+
+		valid = np.ones(len(times), dtype=bool)
+		if start is not None:
+			valid &= (times >= start)
+		if stop is not None:
+			valid &= (times <= stop)
+
+		return {'time': times[valid].tolist(), 'value': values[valid].tolist()}
+
+	# Return the binned values for bin width 'width' (see _BinRing.to_dict),
+	# or None if there is no level with that width
+	def bins(self, width, start=None, stop=None):
+
+		for level in self._levels:
+			if level.width == width:
+				return level.to_dict(start, stop)
+
+		return None
@@ -0,0 +1,89 @@
+'''
+Runs the update loop of a single instrument in its own thread, so a
+slow or blocking driver cannot stall the other instruments.
+
+Usage:
+	- Create one InstrumentWorker per instrument
+	- Call start() to begin calling Instrument.update()
+	- Call stop() to end the thread (the instrument is not closed)
+'''
+
+import time
+import logging
+import threading
+import traceback
+
+from . import clock
+from . import stall_tracer
+
+class InstrumentWorker:
+
+	# Minimum pause between update() calls, used when the instrument
+	# is polling (its next update time does not move forward)
+	UPDATE_PAUSE = 0.005 # seconds
+	
+	# Re-check for updates at least this often while sleeping
+	MAX_SLEEP = 1.0 # seconds
+
+	# Warn if a single update() takes longer than this
+	SLOW_UPDATE_TIME = 0.3 # seconds
+
+	def __init__(self, instrument):
+
+		self.instrument = instrument
+		
+		self._trace_name = instrument.BOX_TYPE
+		if instrument.loop_stats is not None:
+			self._trace_name = instrument.loop_stats.name
+
+		self._stop_event = threading.Event()
+		self._thread = threading.Thread(target = self._loop, name="Instrument Worker (%s)" % (instrument.BOX_TYPE,))
+
+		# Don't let the thread keep the program alive
+		self._thread.daemon = True
+
+	# Start calling Instrument.update() from the worker thread
+	def start(self):
+		self._thread.start()
+
+	# Ask the worker thread to stop and wait for it to finish
+	def stop(self):
+		self._stop_event.set()
+		if self._thread.is_alive():
+			self._thread.join()
+
+	# Returns True if the worker thread is running
+	@property
+	def running(self):
+		return self._thread.is_alive()
+
+	# Run forever, calling update() with the instrument's own lock held
+	def _loop(self):
+
+		inst = self.instrument
+
+		logging.debug("Starting worker thread for instrument of type " + str(inst.BOX_TYPE))
+
+		while not self._stop_event.is_set():
+
+			trace = stall_tracer.begin(self._trace_name)
+			with inst.action_lock:
+				if trace is not None:
+					trace.mark_lock_acquired()
+				start_time = time.time()
+				try:
+					inst.update()
+				except:
+					logging.error("Contained update error in instrument of type %s. %s" % (inst.BOX_TYPE, traceback.format_exc()))
+				dt = time.time() - start_time
+			stall_tracer.end(trace)
+
+			if dt > self.SLOW_UPDATE_TIME:
+				logging.warning("Instrument of type " + str(inst.BOX_TYPE) + " held its worker thread for %0.1f sec" % dt)
+
+			# Sleep until the instrument is next due
+			delay = inst.next_update_time - clock.now()
+			delay = min(max(delay, self.UPDATE_PAUSE), self.MAX_SLEEP)
+			self._stop_event.wait(clock.real_timeout(delay))
+
+		logging.debug("Worker thread stopped for instrument of type " + str(inst.BOX_TYPE))
@@ -0,0 +1,288 @@
+'''
+Base classes for instruments that run on the asyncio event loop used by
+the "asyncio" loop mode of DataAcqController.  All I/O and timing for
+these instruments happens as coroutines on one thread, instead of
+dedicated RX/TX threads with polling sleeps.
+
+Usage:
+	- Inherit from AsyncInstrument (or AsyncSerialInstrument)
+	- Redefine NUM_SENSORS, BOX_NAME
+	- Implement update_periodic_async() as a coroutine
+	- Optionally implement open_async() and close_async()
+	- Run pyhkd with --loop asyncio
+'''
+
+import time
+import asyncio
+import logging
+import serial
+
+from .instrument import Instrument
+from .. import clock
+
+class AsyncInstrument(Instrument):
+
+	# Called once on the event loop before the first update.  Open
+	# connections here.
+	async def open_async(self):
+		pass
+
+	# Called on the event loop at shutdown.  Close connections here.
+	async def close_async(self):
+		pass
+
+	# The coroutine version of Instrument.update().  Called by the
+	# event loop whenever next_update_time is reached.
+	async def update_async(self):
+
+		self.process_dirty_targets()
+
+		now = clock.now()
+		if now < self._next_update_time:
+			return
+		due_time = self._next_update_time
+		self.last_update_time = now
+		self._advance_update_time(now)
+		await self.update_periodic_async()
+		if self.loop_stats is not None:
+			self.loop_stats.record(due_time, now, clock.now(), self.wait_time, self.max_interval)
+
+	# Runs periodic instrument updates (with a period of wait_time).
+	# Must not block, use await for any I/O or waiting.
+	async def update_periodic_async(self):
+		pass
+
+	# Async instruments can only be updated from the event loop
+	def update(self):
+		raise RuntimeError("Instrument of type %s needs the asyncio loop mode (--loop asyncio)" % (self.BOX_TYPE,))
+
+# An instrument communicating over serial, read by the event loop when
+# data arrives instead of by polling threads.
+#
+# Public interface functions:
+# 	send_packet (coroutine)
+# 	ask (coroutine)
+# Functions to be implemented by subclasses:
+# 	on_reconnect (optional)
+#	handle_packet (optional, receives packets that are not "ask" answers)
+# Public interface properties:
+# 	connected
+#
+class AsyncSerialInstrument(AsyncInstrument):
+
+	SER_RECONNECT_TIME = 5 # seconds
+	SER_TX_PAUSE = 0.05 # seconds to pause between sends
+	SER_ASK_TIMEOUT = 2 # seconds to wait for an "ask" response
+	SER_MAX_RX_BUF = 65536 # bytes kept while waiting for a packet end
+
+	# pkt_end: marks the end of a packet
+	# pkt_start: marks the start of a packet, or None to start immediately after pkt_end
+	def __init__(self, port, baudrate, pkt_end = '\n', pkt_start = None,
+				 bytesize=serial.EIGHTBITS, parity=serial.PARITY_NONE,
+				 stopbits=serial.STOPBITS_ONE, return_bytes=False, **kwargs):
+
+		if hasattr(pkt_start, 'encode'):
+			pkt_start = pkt_start.encode()
+		if hasattr(pkt_end, 'encode'):
+			pkt_end = pkt_end.encode()
+
+		if pkt_start is not None and len(pkt_start) == 0:
+			pkt_start = None
+
+		self._port = port
+		self._baudrate = baudrate
+		self._bytesize = bytesize
+		self._parity = parity
+		self._stopbits = stopbits
+		self._pkt_start = pkt_start
+		self._pkt_end = pkt_end
+		self._return_bytes = return_bytes
+
+		self._ser = None
+		self._loop = None
+		self._tx_lock = None
+		self._ask_future = None
+		self._rx_buf = bytearray()
+		self._last_reconnect_try = 0
+
+		AsyncInstrument.__init__(self, **kwargs)
+
+	# Returns true if the serial device is thought to be connected.
+	@property
+	def connected(self):
+		return (self._ser is not None)
+
+	# Implements AsyncInstrument.open_async
+	async def open_async(self):
+		self._loop = asyncio.get_running_loop()
+		self._tx_lock = asyncio.Lock()
+		self._ser_reconnect()
+
+	# Implements AsyncInstrument.close_async
+	async def close_async(self):
+		self._ser_disconnect()
+
+	# Called whenever a successful serial connection is opened or re-opened
+	def on_reconnect(self):
+		pass
+
+	# Implement in subclass.  Called with each received packet that is
+	# not the answer to an "ask".
+	def handle_packet(self, packet):
+		pass
+
+	# Re-open the serial port, return True if it works
+	def _ser_reconnect(self):
+
+		if self._ser is not None:
+			return True
+
+		if (clock.now() - self._last_reconnect_try) < self.SER_RECONNECT_TIME:
+			return False
+
+		self._last_reconnect_try = clock.now()
+
+		try:
+			self._ser = serial.Serial(
+				port=self._port,
+				baudrate=self._baudrate,
+				timeout=0, # Non-blocking read
+				bytesize=self._bytesize,
+				parity=self._parity,
+				stopbits=self._stopbits,
+				write_timeout=0, # Non-blocking write
+			)
+		except serial.SerialException:
+			self._ser = None
+			if self.verbose_fail:
+				logging.error("Error while opening serial communication (port %s)." % (self._port))
+			return False
+
+		logging.debug("Serial communication opened successfully (port %s)." % (self._port))
+
+		self._rx_buf = bytearray()
+		self._loop.add_reader(self._ser.fileno(), self._on_readable)
+		self.on_reconnect()
+
+		return True
+
+	# Close the serial port and fail any "ask" in progress
+	def _ser_disconnect(self):
+
+		if self._ser is not None:
+			try:
+				self._loop.remove_reader(self._ser.fileno())
+			except (ValueError, OSError):
+				pass
+			self._ser.close()
+			self._ser = None
+
+		if self._ask_future is not None and not self._ask_future.done():
+			self._ask_future.set_result(None)
+
+	# Called by the event loop when the serial port has data
+	def _on_readable(self):
+
+		try:
+			new_data = self._ser.read(max(self._ser.in_waiting, 1))
+		except (serial.SerialException, OSError):
+			if self.verbose_fail:
+				logging.error("Lost serial communication (port %s)." % (self._port))
+			self._ser_disconnect()
+			return
+
+		self._rx_buf += new_data
+
+		if len(self._rx_buf) > self.SER_MAX_RX_BUF:
+			logging.error("Flushing oversized incomplete serial packet received on port %s" % (self._port,))
+			self._rx_buf = bytearray()
+			return
+
+		# Extract complete packets
+		while True:
+
+			end = self._rx_buf.find(self._pkt_end)
+			if end < 0:
+				break
+
+			packet = bytes(self._rx_buf[:end])
+			del self._rx_buf[:end + len(self._pkt_end)]
+
+			if self._pkt_start is not None:
+				start = packet.rfind(self._pkt_start)
+				if start < 0:
+					continue
+				packet = packet[start + len(self._pkt_start):]
+
+			if not self._return_bytes:
+				try:
+					packet = packet.decode()
+				except UnicodeDecodeError:
+					logging.debug("Failed to decode unicode serial packet (port %s), should return_bytes be enabled for this hardware?" % (self._port,))
+					continue
+
+			if self._ask_future is not None and not self._ask_future.done():
+				self._ask_future.set_result(packet)
+			else:
+				self.handle_packet(packet)
+
+	# Write a packet now.  Returns True on success.
+	def _write(self, packet):
+
+		if hasattr(packet, 'encode'):
+			packet = packet.encode()
+		if self._pkt_end is not None:
+			packet = packet + self._pkt_end
+		if self._pkt_start is not None:
+			packet = self._pkt_start + packet
+
+		if self._ser is None:
+			return False
+
+		try:
+			self._ser.write(packet) # write_timeout=0, so not blocking
+			return True
+		except serial.SerialException:
+			if self.verbose_fail:
+				logging.error("Failed sending serial data (port %s)." % (self._port))
+			self._ser_disconnect()
+			return False
+
+	# Send a packet, paced so the instrument is not overloaded.
+	# Returns True on success.
+	async def send_packet(self, packet):
+		async with self._tx_lock:
+			ok = self._write(packet)
+			await asyncio.sleep(self.SER_TX_PAUSE)
+		return ok
+
+	# Send a packet and wait for the next packet received in response.
+	# Returns the response, or None on a timeout or failure.
+	async def ask(self, packet, timeout=None):
+
+		if timeout is None:
+			timeout = self.SER_ASK_TIMEOUT
+
+		async with self._tx_lock:
+
+			self._ask_future = self._loop.create_future()
+			self._rx_buf = bytearray()
+
+			try:
+				if not self._write(packet):
+					return None
+				return await asyncio.wait_for(self._ask_future, clock.real_timeout(timeout))
+			except asyncio.TimeoutError:
+				if self.verbose_fail:
+					logging.debug("Serial 'ask' timed out (port %s)" % (self._port,))
+				return None
+			finally:
+				self._ask_future = None
+				await asyncio.sleep(self.SER_TX_PAUSE)
+
+	# Reconnect if needed before running the periodic update.
+	# Overrides AsyncInstrument.update_async
+	async def update_async(self):
+		if not self.connected:
+			self._ser_reconnect()
+		await AsyncInstrument.update_async(self)
@@ -6,7 +6,8 @@ import random
 
 from ..instrument import Instrument
 from ..serial_instrument import SerialInstrument
-from ..sensor import Sensor
+from pyhkdlib import clock
+from pyhkdlib.sensor import Sensor
 
 # A set of parent classes for devices controlled with IEEE 488.2 or
 # SCPI syntax over either a GPIB bus or RS-232.  Provides GPIB bus 
@@ -66,7 +67,7 @@ class AbstractSCPIInstrument:
 			return
 		
 		with self._scpi_inst_lock:
-			self._scpi_last_resp = time.time()
+			self._scpi_last_resp = clock.now()
 
 		# Don't take the insturment lock into the response callback,
 		# we can't assume the user will not call another function
@@ -97,7 +98,7 @@ class AbstractSCPIInstrument:
 		elif (self._scpi_last_resp is None):
 			# We have an ask but not a response since boot.  Compare
 			# to the first ask, since the last ask keeps updating.
-			return ((time.time() - self._scpi_first_ask) < self.DISCONNECTED_TIMEOUT)
+			return ((clock.now() - self._scpi_first_ask) < self.DISCONNECTED_TIMEOUT)
 		elif (self._scpi_last_resp >= self._scpi_last_ask):
 			# We received an answer recently
 			return True
@@ -119,7 +120,7 @@ class AbstractSCPIInstrument:
 			cb = None
 			if resp_callback is not None:
 				cb = lambda x: self._callback_wrapper(resp_callback, x)
-				self._scpi_last_ask = time.time()
+				self._scpi_last_ask = clock.now()
 				if self._scpi_first_ask is None:
 					self._scpi_first_ask = self._scpi_last_ask	
 					
@@ -164,7 +165,7 @@ class AbstractSCPIInstrument:
 			if self._scpi_need_reconfig:
 				
 				# We are reconnected, send the config
-				if (time.time() - self._scpi_reconfig_time > self.RECONFIG_PAUSE):
+				if (clock.now() - self._scpi_reconfig_time > self.RECONFIG_PAUSE):
 					send_config = True
 					request_data = False
 					self._scpi_need_reconfig = False
@@ -175,9 +176,9 @@ class AbstractSCPIInstrument:
 				# Periodically ask IDN to check for reconnection.
 				self._scpi_last_responsive = False
 				self._scpi_need_reconfig = False
-				if (time.time()-self._scpi_last_print > self.RECHECK_TIME):
+				if (clock.now()-self._scpi_last_print > self.RECHECK_TIME):
 					logging.warning(self.SPECIFIC_DEVICE_ID + " appears to be disconnected")
-					self._scpi_last_print = time.time()
+					self._scpi_last_print = clock.now()
 					request_idn = True
 					
 			else:
@@ -187,7 +188,7 @@ class AbstractSCPIInstrument:
 					self._scpi_last_responsive = True
 					self._scpi_need_reconfig = True
 					send_cls = True
-					self._scpi_reconfig_time = time.time()
+					self._scpi_reconfig_time = clock.now()
 					logging.info(self.SPECIFIC_DEVICE_ID + " reconnected!")
 				else:
 					request_data = True
@@ -228,12 +229,13 @@ class GPIBSCPIInstrument(AbstractSCPIInstrument, Instrument):
 		self._gpib_address = address
 		self.SPECIFIC_DEVICE_ID = "GPIB device (address %i, type %s)" % (self._gpib_address, self.BOX_TYPE)
 		
-		Instrument.__init__(self, channels, wait_time=wait_time, **kwargs)
-		AbstractSCPIInstrument.__init__(self)
-		
 		# Add a random phase to the readout timing so we spread out
 		# the load on the bus a little bit
-		self.last_update_time += random.random() * wait_time
+		if kwargs.get('phase', None) is None:
+			kwargs['phase'] = random.random() * wait_time
+		
+		Instrument.__init__(self, channels, wait_time=wait_time, **kwargs)
+		AbstractSCPIInstrument.__init__(self)
 	
 	@property
 	def connected(self):
@@ -251,7 +253,7 @@ class GPIBSCPIInstrument(AbstractSCPIInstrument, Instrument):
 								
 			# Wrap the callback so we can monitor connection metrics
 			cb = lambda x: self._callback_wrapper(resp_callback, x)
-			self._scpi_last_ask = time.time()
+			self._scpi_last_ask = clock.now()
 			if self._scpi_first_ask is None:
 				self._scpi_first_ask = self._scpi_last_ask	
 					
@@ -15,6 +15,7 @@ Example usage:
 import logging
 from lakeshore import Model224
 from ..instrument import Instrument
+from pyhkdlib.sensor import Sensor
 
 LS224_CHANNELS = ['A', 'B', 'C1', 'C2', 'C3', 'C4', 'C5', 'D1', 'D2', 'D3', 'D4', 'D5']
 
@@ -28,6 +29,12 @@ class LakeShore224Interface(Instrument):
         if channels is None:
             channels = [{"name": ch, "type": "temperature"} for ch in LS224_CHANNELS]
         super().__init__(channels=channels, wait_time=wait_time, **kwargs)
+        # Temperature sensor of each configured channel, looked up once
+        self._temp_sensors = {}
+        for ch in LS224_CHANNELS:
+            sensor = self.get_sensor(ch, Sensor.TYPE_TEMPERATURE, none_on_fail=True)
+            if sensor is not None:
+                self._temp_sensors[ch] = sensor
         self.instrument = Model224(com_port=port, baud_rate=baud_rate, timeout=timeout)
         logging.info("Lake Shore 224 initialized on port %s", port)
 
@@ -99,15 +106,13 @@ class LakeShore224Interface(Instrument):
 
     def update_periodic(self):
         readings = self.get_all_kelvin()
-        for ch in LS224_CHANNELS:
-            # Find the channel id for this channel name
-            chan_id = ch
-            # Update the sensor value for this channel
-            sensor = self.get_sensor(chan_id, "temperature", none_on_fail=True)
-            if sensor is not None:
-                val = readings.get(ch)
-                if val is not None:
-                    sensor.value = val
+        frame = {}
+        for ch, sensor in self._temp_sensors.items():
+            val = readings.get(ch)
+            if val is not None:
+                frame[sensor] = val
+        # Update all channels with one timestamp
+        self.publish_frame(frame)
 
 # Example script usage
 if __name__ == "__main__":
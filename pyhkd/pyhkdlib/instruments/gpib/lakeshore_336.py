@@ -22,6 +22,13 @@ class AbstractLakeshore336:
 	THERM_IDS = ['A','B','C','D']
 	HEATER_IDS = ['I1','I2']
 	
+	# The target kept for each heater readback type
+	MAINTAINED_TARGETS = {Sensor.TYPE_STATE: Sensor.TYPE_TARGET_STATE, Sensor.TYPE_PERCENTAGE: Sensor.TYPE_TARGET_PERCENTAGE}
+	
+	# Temperature sensor of each THERM_IDS channel, looked up on the
+	# first reading
+	_therm_sensors = None
+	
 	def __init__(self):
 		pass	
 		
@@ -66,9 +73,11 @@ class AbstractLakeshore336:
 			logging.error("Error loading in Lakshore 336 temperatures (received: %s)" % (repr(response)))				
 			return
 		
-		# Save the values
-		for i in range(len(self.THERM_IDS)):
-			self.get_sensor(self.THERM_IDS[i], Sensor.TYPE_TEMPERATURE).value = extracted_raw[i]
+		if self._therm_sensors is None:
+			self._therm_sensors = [self.get_sensor(t, Sensor.TYPE_TEMPERATURE) for t in self.THERM_IDS]
+		
+		# Save the values as one frame
+		self.publish_frame(dict(zip(self._therm_sensors, extracted_raw)))
 
 	# Handle a generic class of single-channel heater parameters
 	def handle_heater_val(self, response, index, sensor_type):
@@ -83,6 +92,14 @@ class AbstractLakeshore336:
 			return
 		
 		self.get_sensor(self.HEATER_IDS[index], sensor_type).value = val
+		
+		# A target that was met but no longer matches the readback is
+		# sent again by the next update
+		target_type = self.MAINTAINED_TARGETS.get(sensor_type, None)
+		if target_type is not None:
+			target = self.get_sensor(self.HEATER_IDS[index], target_type).value
+			if target is not None and not math.isnan(target) and target != val:
+				self.mark_target_dirty(self.HEATER_IDS[index])
 
 	# Code to run when connected with a period of wait_time.
 	# Implements AbstractSCPIInstrument.update_connected
@@ -103,15 +120,25 @@ class AbstractLakeshore336:
 			# Output range (off, low, med, high)
 			resp_callback = (lambda x, i=i: self.handle_heater_val(x, i, Sensor.TYPE_STATE))
 			self.send_packet('RANGE? %i' % (i+1), resp_callback)
-			
-		# Process targets
-		self._process_state_targets()
-		self._process_percentage_targets()
 	
-	# Process output range changes
-	def _process_state_targets(self):
+	# Send the changed heater targets as soon as they are set.
+	# Implements Instrument.process_targets
+	def process_targets(self, chan_ids):
 		
-		for i in range(len(self.HEATER_IDS)):
+		# Keep them for once we reconnect
+		if not self.responsive:
+			for chan_id in chan_ids:
+				self.mark_target_dirty(chan_id)
+			return
+		
+		indices = [i for i in range(len(self.HEATER_IDS)) if self.HEATER_IDS[i] in chan_ids]
+		self._process_state_targets(indices)
+		self._process_percentage_targets(indices)
+	
+	# Process output range changes for the heaters at 'indices'
+	def _process_state_targets(self, indices):
+		
+		for i in indices:
 			
 			target = self.get_sensor(self.HEATER_IDS[i], Sensor.TYPE_TARGET_STATE)
 			
@@ -126,10 +153,10 @@ class AbstractLakeshore336:
 				self.send_packet('RANGE %i %i' % params)
 				target.value = None # Don't maintain if error triggered
 		
-	# Process output fraction changes
-	def _process_percentage_targets(self):
+	# Process output fraction changes for the heaters at 'indices'
+	def _process_percentage_targets(self, indices):
 		
-		for i in range(len(self.HEATER_IDS)):
+		for i in indices:
 			
 			target = self.get_sensor(self.HEATER_IDS[i], Sensor.TYPE_TARGET_PERCENTAGE)
 			
@@ -19,10 +19,10 @@ import busio
 import adafruit_ads1x15.ads1115 as ADS
 from adafruit_ads1x15.analog_in import AnalogIn
 import numpy as np
-from scipy import signal
 
 from ..instrument import Instrument
 from pyhkdlib.sensor import Sensor
+from pyhkdlib import filters
 
 class MKSADS1115Pressure(Instrument):
     """
@@ -60,36 +60,30 @@ class MKSADS1115Pressure(Instrument):
             self.filter_cutoff = nyquist_freq * 0.8
             logging.warning(f"Filter cutoff adjusted to {self.filter_cutoff:.3f} Hz (Nyquist: {nyquist_freq:.3f} Hz)")
         
-        # Filter state variables for higher order filter
-        self.filter_initialized = False
-        self.x_history = []  # Input history
-        self.y_history = []  # Output history
-        
-        # Calculate filter coefficients
-        if self.enable_filter:
-            try:
-                self.b, self.a = signal.butter(self.filter_order, self.filter_cutoff, fs=self.fs)
-                logging.info(f"Digital Butterworth filter initialized: fc={self.filter_cutoff:.3f} Hz, order={self.filter_order}, fs={self.fs:.3f} Hz")
-                
-                # Initialize history arrays
-                self.x_history = [0.0] * len(self.b)
-                self.y_history = [0.0] * (len(self.a) - 1)
-                
-            except ValueError as e:
-                logging.error(f"Failed to initialize filter: {e}")
-                self.enable_filter = False
-                logging.warning("Filter disabled due to invalid parameters")
-        
         # Moving average filter parameters
         self.enable_moving_average = True
         self.moving_average_window = 5
-        self.pressure_buffer = []
         
         # Spike filtering parameters
         self.enable_spike_filter = enable_spike_filter
         self.spike_threshold = spike_threshold  # Standard deviations
         self.median_window = median_window
-        self.recent_values = []
+        
+        # Filtering pipeline: remove spikes, Butterworth, moving average
+        stages = []
+        if self.enable_spike_filter:
+            stages.append(filters.SpikeFilter(self.median_window, self.spike_threshold))
+        if self.enable_filter:
+            try:
+                stages.append(filters.Butterworth(self.filter_order, self.filter_cutoff / nyquist_freq))
+                logging.info(f"Digital Butterworth filter initialized: fc={self.filter_cutoff:.3f} Hz, order={self.filter_order}, fs={self.fs:.3f} Hz")
+            except ValueError as e:
+                logging.error(f"Failed to initialize filter: {e}")
+                self.enable_filter = False
+                logging.warning("Filter disabled due to invalid parameters")
+        if self.enable_moving_average:
+            stages.append(filters.MovingAverage(self.moving_average_window))
+        self.filter_chain = filters.FilterChain(stages)
         
         if channels is None:
             channels = [
@@ -97,6 +91,10 @@ class MKSADS1115Pressure(Instrument):
                 {"name": "Filtered Pressure", "type": "pressure"}
             ]
         super().__init__(channels=channels, wait_time=wait_time, **kwargs)
+        # Raw (index 0 - "Pressure") and filtered (index 1 - "Filtered
+        # Pressure") sensors, looked up once
+        self._raw_sensor = self.get_sensor(0, Sensor.TYPE_PRESSURE, none_on_fail=True)
+        self._filtered_sensor = self.get_sensor(1, Sensor.TYPE_PRESSURE, none_on_fail=True)
         logging.info("MKSADS1115Pressure initialized with filtering capabilities.")
 
     def read_voltage(self):
@@ -115,95 +113,9 @@ class MKSADS1115Pressure(Instrument):
         pressure = self.voltage_to_pressure(v_sensor)
         return pressure
 
-    def apply_moving_average(self, filtered_pressure):
-        """Apply moving average filter as additional smoothing."""
-        if not self.enable_moving_average:
-            return filtered_pressure
-            
-        # Add to buffer
-        self.pressure_buffer.append(filtered_pressure)
-        
-        # Keep buffer size limited
-        if len(self.pressure_buffer) > self.moving_average_window:
-            self.pressure_buffer.pop(0)
-        
-        # Return average
-        return sum(self.pressure_buffer) / len(self.pressure_buffer)
-
-    def apply_spike_filter(self, raw_pressure):
-        """Remove spikes using median filter and statistical outlier detection."""
-        if not self.enable_spike_filter:
-            return raw_pressure
-            
-        self.recent_values.append(raw_pressure)
-        
-        # Keep window size limited
-        if len(self.recent_values) > self.median_window * 3:
-            self.recent_values.pop(0)
-        
-        if len(self.recent_values) < self.median_window:
-            return raw_pressure
-        
-        # Calculate median and standard deviation of recent values
-        import statistics
-        recent_median = statistics.median(self.recent_values[-self.median_window:])
-        recent_std = statistics.stdev(self.recent_values[-self.median_window:]) if len(self.recent_values) > 1 else 0
-        
-        # Check if current value is a spike
-        if recent_std > 0 and abs(raw_pressure - recent_median) > self.spike_threshold * recent_std:
-            logging.debug(f"Spike detected: {raw_pressure:.3e}, using median: {recent_median:.3e}")
-            return recent_median
-        
-        return raw_pressure
-
     def apply_digital_filter(self, raw_pressure):
         """Apply complete filtering pipeline."""
-        # 1. Remove spikes
-        spike_filtered = self.apply_spike_filter(raw_pressure)
-        
-        # 2. Apply Butterworth filter
-        butterworth_filtered = self.apply_butterworth_filter(spike_filtered)
-        
-        # 3. Apply moving average
-        final_filtered = self.apply_moving_average(butterworth_filtered)
-        
-        return final_filtered
-
-    def apply_butterworth_filter(self, raw_pressure):
-        """Apply higher order digital Butterworth filter (renamed from apply_digital_filter)."""
-        if not self.enable_filter:
-            return raw_pressure
-            
-        if not self.filter_initialized:
-            # Initialize filter with first reading
-            for i in range(len(self.x_history)):
-                self.x_history[i] = raw_pressure
-            for i in range(len(self.y_history)):
-                self.y_history[i] = raw_pressure
-            self.filter_initialized = True
-            return raw_pressure
-        
-        # Shift input history and add new input
-        self.x_history[1:] = self.x_history[:-1]
-        self.x_history[0] = raw_pressure
-        
-        # Apply filter equation: y[n] = sum(b[i]*x[n-i]) - sum(a[i]*y[n-i])
-        filtered_output = 0.0
-        
-        # Feed-forward terms (b coefficients)
-        for i in range(len(self.b)):
-            filtered_output += self.b[i] * self.x_history[i]
-        
-        # Feedback terms (a coefficients, skip a[0] which is 1)
-        for i in range(1, len(self.a)):
-            if i <= len(self.y_history):
-                filtered_output -= self.a[i] * self.y_history[i-1]
-        
-        # Shift output history and add new output
-        self.y_history[1:] = self.y_history[:-1]
-        self.y_history[0] = filtered_output
-        
-        return filtered_output
+        return self.filter_chain(raw_pressure)
 
     def get_pressure_filtered(self):
         raw_pressure = self.get_pressure_raw()
@@ -218,15 +130,13 @@ class MKSADS1115Pressure(Instrument):
         raw_pressure = self.get_pressure_raw()
         filtered_pressure = self.apply_digital_filter(raw_pressure)
         
-        # Update raw pressure sensor (index 0 - "Pressure")
-        raw_sensor = self.get_sensor(0, Sensor.TYPE_PRESSURE, none_on_fail=True)
-        if raw_sensor is not None:
-            raw_sensor.value = raw_pressure
-            
-        # Update filtered pressure sensor (index 1 - "Filtered Pressure")
-        filtered_sensor = self.get_sensor(1, Sensor.TYPE_PRESSURE, none_on_fail=True)
-        if filtered_sensor is not None:
-            filtered_sensor.value = filtered_pressure
+        # Update both sensors with one timestamp
+        frame = {}
+        if self._raw_sensor is not None:
+            frame[self._raw_sensor] = raw_pressure
+        if self._filtered_sensor is not None:
+            frame[self._filtered_sensor] = filtered_pressure
+        self.publish_frame(frame)
 
 # Example script usage
 if __name__ == "__main__":
@@ -45,6 +45,13 @@ class ThalesXPCDE4865(Instrument):
             raise ValueError("channels must be a list or None")
 
         super().__init__(channels=channels, wait_time=wait_time, **kwargs)
+        # (channel name, sensor) for every sensor, looked up once
+        self._channel_sensors = []
+        for channel_id, channel_config in self._channels.items():
+            for sensor_type in channel_config['types_processed']:
+                sensor = self.get_sensor(channel_id, sensor_type, none_on_fail=True)
+                if sensor is not None:
+                    self._channel_sensors.append((channel_config['name'], sensor))
         logging.info("ThalesXPCDE4865 initialized.")
 
     def connect(self):
@@ -262,13 +269,9 @@ class ThalesXPCDE4865(Instrument):
     def update_periodic(self):
         """Update all sensor values - called by the data logging system"""
         data = self.read()
-        for channel_id, channel_config in self._channels.items():
-            for sensor_type in channel_config['types_processed']:
-                sensor = self.get_sensor(channel_id, sensor_type, none_on_fail=True)
-                if sensor is not None:
-                    channel_name = channel_config['name']
-                    if channel_name in data:
-                        sensor.value = data[channel_name]
+        for channel_name, sensor in self._channel_sensors:
+            if channel_name in data:
+                sensor.value = data[channel_name]
 
     def set_pid_gains(self, kp, ki):
         """Set PID gains. Valid ranges: P: 1.0-8.0, I: 0.1-0.85"""
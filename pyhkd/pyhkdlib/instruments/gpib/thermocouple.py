@@ -7,7 +7,7 @@ and converted to Kelvin.
 
 Example usage:
     from pyhkdlib.instruments.gpib.thermocouple import ThermocoupleMAX31856
-    tc = ThermocoupleMAX31856(cs_pin=board.D5, thermocouple_type="E")
+    tc = ThermocoupleMAX31856(cs_pin="D5", thermocouple_type="E")
     print(tc.get_temperature())
 """
 
@@ -27,7 +27,7 @@ class ThermocoupleMAX31856(Instrument):
     NUM_SENSORS = 1
     BOX_TYPE = 'MAX31856'
 
-    def __init__(self, cs_pin=board.D5, thermocouple_type="E", wait_time=1, channels=None, **kwargs):
+    def __init__(self, cs_pin="D5", thermocouple_type="E", wait_time=1, channels=None, **kwargs):
         # Set up SPI
         self.spi = board.SPI()
         if isinstance(cs_pin, str):
@@ -42,6 +42,7 @@ class ThermocoupleMAX31856(Instrument):
         if channels is None:
             channels = [{"name": "Thermocouple 1", "type": "temperature"}]
         super().__init__(channels=channels, wait_time=wait_time, **kwargs)
+        self._temp_sensor = self.get_sensor(0, Sensor.TYPE_TEMPERATURE, none_on_fail=True)
         logging.info("ThermocoupleMAX31856 initialized.")
 
     def read_temperature_kelvin(self):
@@ -61,9 +62,8 @@ class ThermocoupleMAX31856(Instrument):
 
     def update_periodic(self):
         temp_K = self.read_temperature_kelvin()
-        sensor = self.get_sensor(0, Sensor.TYPE_TEMPERATURE, none_on_fail=True)
-        if sensor is not None:
-            sensor.value = temp_K
+        if self._temp_sensor is not None:
+            self._temp_sensor.value = temp_K
 
 # Example script usage
 if __name__ == "__main__":
@@ -13,8 +13,14 @@ import numpy as np
 import time
 import sys
 import logging
+import threading
 
-from ..sensor import Sensor
+from ..sensor import Sensor, NULL_SENSOR, call_listener
+from .. import clock
+from .. import stall_tracer
+from .. import log_queue
+from ..filters import build_chain
+from ..loggers.solo_date_logger import SoloDateLogger
 from calib.helpers import get_calib
 import units.units as units
 		
@@ -23,7 +29,16 @@ class Instrument:
 	NUM_SENSORS = 0
 	BOX_TYPE = 'GENERIC'	
 	
-	VALID_CHAN_KEYS = ['calib_func','name','type','alias','id','save_deriv','save_fast','downsample','r_total','r_heater','current_limit','output_range','filter']
+	# Scheduling priorities.  When several instruments are due, higher
+	# priority instruments are updated first, and lower priority updates
+	# are put off if they would make a higher priority one miss its
+	# deadline.
+	PRIORITY_LOW = -1
+	PRIORITY_NORMAL = 0
+	PRIORITY_HIGH = 1
+	PRIORITY_NAMES = {'low': PRIORITY_LOW, 'normal': PRIORITY_NORMAL, 'high': PRIORITY_HIGH}
+	
+	VALID_CHAN_KEYS = ['calib_func','name','type','alias','id','save_deriv','save_fast','downsample','r_total','r_heater','current_limit','output_range','filter','filters','deadband','max_interval','bin_time','bin_stats','history']
 	REQUIRED_CHAN_KEYS = ['name']
 				
 	# 'channels'				A list (length NUM_SENSORS) of dicts, one per sensor.  Stores per-channel
@@ -34,11 +49,19 @@ class Instrument:
 	# 'default_downsample'		Number of real samples to buffer and combine into one actual update. 
 	#							If raw sensors are used, those are what are buffered.  1 means no buffer,
 	#							all new values should be reported individually.
+	# 'wait_time'				The period in seconds between update_periodic() calls
+	# 'phase'					Offset in seconds of the update_periodic() grid relative to the
+	#							epoch (updates happen when (time - phase) is a multiple of wait_time).
+	#							If None, the grid starts wait_time after the instrument is created.
+	# 'priority'				Scheduling priority, one of PRIORITY_NAMES (or its number)
+	# 'max_interval'			Longest acceptable time in seconds between update_periodic() calls.
+	#							Longer gaps count as missed deadlines.  None for no deadline.
 	def __init__(self, channels=[], default_sensor_type = Sensor.TYPE_UNUSED, 
 		default_calib_func = (lambda x: 0), default_downsample = 1, 
 		default_save_deriv = False, default_save_fast = False,
 		verbose_rx=False, verbose_tx=False, verbose_fail=True,
-		verbose_raw=False, wait_time=10):
+		verbose_raw=False, wait_time=10, phase=None,
+		priority=PRIORITY_NORMAL, max_interval=None):
 		
 		assert isinstance(channels, list), "The 'channels' input should be a list (instrument type: %s)" % self.BOX_TYPE
 		assert (len(channels) == self.NUM_SENSORS), "The number of channels specified does not match expectectations for this instrument (instrument type: %s)" % self.BOX_TYPE
@@ -49,6 +72,13 @@ class Instrument:
 		assert isinstance(verbose_raw, bool), "verbose_raw should be a boolean value (not a string or number)"
 		
 		assert (np.isfinite(wait_time) and wait_time >= 0), "wait_time should be a positive number"
+		assert (phase is None) or np.isfinite(phase), "phase should be a number of seconds"
+		assert (max_interval is None) or (np.isfinite(max_interval) and max_interval >= wait_time), "max_interval should be a number of seconds, at least wait_time"
+		
+		if isinstance(priority, str):
+			assert priority in self.PRIORITY_NAMES, "priority should be one of " + str(list(self.PRIORITY_NAMES.keys()))
+			priority = self.PRIORITY_NAMES[priority]
+		assert isinstance(priority, int), "priority should be one of " + str(list(self.PRIORITY_NAMES.keys()))
 
 		self.verbose_fail = verbose_fail
 		self.verbose_rx = verbose_rx
@@ -56,6 +86,8 @@ class Instrument:
 		self.verbose_raw = verbose_raw
 		
 		self.wait_time = wait_time
+		self._priority = priority
+		self._max_interval = max_interval
 		
 		self._default_downsample = default_downsample
 		self._default_calib_func = default_calib_func
@@ -72,6 +104,17 @@ class Instrument:
 		# Access with get_sensor()
 		self._sensors = {}
 		
+		# Shared by all of our sensors (see publish_frame)
+		self._sensor_lock = threading.Lock()
+		
+		# Number of get_sensor() calls for each missing (chan_id, type)
+		self._missing_sensors = {}
+		
+		# Channels whose targets changed since process_targets() last
+		# ran (see mark_target_dirty)
+		self._dirty_lock = threading.Lock()
+		self._dirty_targets = set()
+		
 		self.sensor_ids = []
 		
 		# Name indexed
@@ -98,6 +141,12 @@ class Instrument:
 			c_save_fast = chan.get('save_fast', default_save_fast)
 			c_ds = chan.get('downsample', default_downsample)
 			c_filt = chan.get('filter', 1.0)
+			c_filters = chan.get('filters', None)
+			c_deadband = chan.get('deadband', None)
+			c_max_interval = chan.get('max_interval', None)
+			c_bin_time = chan.get('bin_time', None)
+			c_bin_stats = chan.get('bin_stats', None)
+			c_history = chan.get('history', None)
 			
 			try:
 				c_filt = float(c_filt)
@@ -105,6 +154,34 @@ class Instrument:
 			except:
 				sys.exit("The channel parameter 'filter' must be a value in the range [0,1].  See the documentation for details.")
 			
+			try:
+				if c_deadband is not None:
+					c_deadband = float(c_deadband)
+					assert c_deadband >= 0
+				if c_max_interval is not None:
+					c_max_interval = float(c_max_interval)
+					assert c_max_interval > 0
+			except:
+				sys.exit("The channel parameters 'deadband' and 'max_interval' must be values >= 0 and > 0 seconds.  See the documentation for details.")
+			
+			if c_bin_time is not None:
+				try:
+					c_bin_time = float(c_bin_time)
+					assert c_bin_time > 0
+					assert c_bin_stats is None or all(s in SoloDateLogger.BIN_STATS for s in c_bin_stats)
+				except:
+					sys.exit("The channel parameter 'bin_time' must be a value > 0 seconds, and 'bin_stats' a list of " + ", ".join(SoloDateLogger.BIN_STATS) + ".  See the documentation for details.")
+				# Bins replace the instrument's default downsampling
+				if 'downsample' not in chan:
+					c_ds = 1
+				if c_ds != 1 or c_deadband is not None or c_max_interval is not None:
+					sys.exit("The channel parameter 'bin_time' can't be combined with 'downsample', 'deadband' or 'max_interval' (channel '%s')" % (c_name,))
+			elif c_bin_stats is not None:
+				sys.exit("The channel parameter 'bin_stats' needs a 'bin_time' (channel '%s')" % (c_name,))
+			
+			if c_history is not None and not isinstance(c_history, bool):
+				sys.exit("The channel parameter 'history' must be true or false (channel '%s')" % (c_name,))
+			
 			# Default to using the position index
 			if c_id is None:
 				c_id = ci
@@ -146,9 +223,20 @@ class Instrument:
 				if c_type not in Sensor.VALID_TYPES:
 					sys.exit("Bad sensor type: " + str(c_type))
 					
-				sen = Sensor(c_name, c_type, alias=c_alias, downsample=c_ds, save_fast=c_save_fast, save_deriv=c_save_deriv, filt=c_filt)
+				# Each sensor keeps its own filter state.  Targets are
+				# never filtered.
+				c_chain = None
+				if c_filters is not None and c_type in Sensor.VALID_NONTARGET_TYPES:
+					c_chain = build_chain(c_filters, c_name)
+				
+				sen = Sensor(c_name, c_type, alias=c_alias, downsample=c_ds, save_fast=c_save_fast, save_deriv=c_save_deriv, filt=c_filt, filters=c_chain, deadband=c_deadband, max_interval=c_max_interval, bin_time=c_bin_time, bin_stats=c_bin_stats, history=c_history, lock=self._sensor_lock)
 				
 				self._sensors[(c_id, c_type)] = sen
+				
+				# Any write to a target marks its channel for the next
+				# process_targets()
+				if c_type in Sensor.VALID_TARGET_TYPES:
+					sen.add_listener(lambda sensors, update_time, sync_num, c_id=c_id: self.mark_target_dirty(c_id))
 			
 			c_calib = chan.get('calib_func', None)
 				
@@ -172,7 +260,21 @@ class Instrument:
 		assert (id_all or id_none), "Channel IDs must be provided for either all channels or no channels within an instrument (type %s)" % self.BOX_TYPE
 		
 		# Read-in timing
-		self.last_update_time = time.time()
+		self.last_update_time = clock.now()
+		self._phase = phase
+		if phase is None:
+			self._next_update_time = self.last_update_time + self.wait_time
+		else:
+			self._next_update_time = self.last_update_time
+			self._advance_update_time(self.last_update_time)
+		
+		# Held while update() runs or while targets owned by this
+		# instrument are changed.  Access with action_lock.
+		self._action_lock = threading.Lock()
+		
+		# Update timing statistics (an InstrumentLoopStats), filled in
+		# by update() if set by the controller
+		self.loop_stats = None
 		
 	# Shut down any relevant resources
 	def close(self):
@@ -182,6 +284,45 @@ class Instrument:
 	def default_downsample(self):
 		return self._default_downsample
 		
+	# The lock that serializes update() calls with other changes to
+	# this instrument (such as incoming target commands)
+	@property
+	def action_lock(self):
+		return self._action_lock
+		
+	# The period of update_periodic() calls in seconds
+	@property
+	def period(self):
+		return self.wait_time
+		
+	# The offset of the update grid in seconds (None if the grid is 
+	# aligned to the instrument start time)
+	@property
+	def phase(self):
+		return self._phase
+		
+	# Scheduling priority (higher numbers are more important)
+	@property
+	def priority(self):
+		return self._priority
+		
+	# The longest acceptable time between update_periodic() calls, or
+	# None if there is no deadline
+	@property
+	def max_interval(self):
+		return self._max_interval
+		
+	# The time (seconds since the epoch) of the next scheduled 
+	# update_periodic() call.  update() does nothing useful before then.
+	@property
+	def next_update_time(self):
+		return self._next_update_time
+		
+	# A list of all sensor objects owned by this instrument
+	@property
+	def sensors(self):
+		return list(self._sensors.values())
+		
 	# Return the channel configuration
 	def get_channel(self, chan_id):
 		return self._channels.get(chan_id, None)
@@ -201,7 +342,9 @@ class Instrument:
 		return chan.get('calib_func', self._default_calib_func)
 	
 	# Return the sensor of a given type from the given channel.
-	# This is the preferred way to access sensor objects.
+	# This is the preferred way to access sensor objects.  Instruments
+	# that update the same sensors often should look them up once (for
+	# example in __init__) and keep the returned handles.
 	def get_sensor(self, chan_id, chan_type, none_on_fail = False):
 		
 		s = self._sensors.get((chan_id, chan_type), None)
@@ -216,27 +359,160 @@ class Instrument:
 			
 			# Check again
 			if s is None:
-				# The sensor *still* isn't there, so give an error message.
-				# Return a dummy sensor so ignorant function calls work.
-				s = Sensor(name="Missing Sensor") 
-				logging.error("Sensor not found: id " + str(chan_id) + ", channel type " + str(chan_type) + ", box type " + str(self.BOX_TYPE) + " (valid keys: " + str(self._sensors.keys()) + ")")
+				# The sensor *still* isn't there, so give an error message
+				# the first time.  Return the shared null sensor so
+				# ignorant function calls work.
+				s = NULL_SENSOR
+				key = (chan_id, chan_type)
+				n = self._missing_sensors.get(key, 0)
+				self._missing_sensors[key] = n + 1
+				if n == 0:
+					logging.error("Sensor not found: id " + str(chan_id) + ", channel type " + str(chan_type) + ", box type " + str(self.BOX_TYPE) + " (valid keys: " + str(self._sensors.keys()) + ")")
 				
 		return s
 		
+	# Return the number of get_sensor() calls for each missing
+	# (chan_id, chan_type)
+	@property
+	def missing_sensors(self):
+		return dict(self._missing_sensors)
+	
+	# Set many sensors at once from one reading of the instrument.
+	# 'values' maps (chan_id, chan_type), or a sensor handle from
+	# get_sensor(), to the new value.  All values
+	# share one update_time (default now) and sync_num, and loggers added
+	# with add_logger receive them as a single frame (Logger.log_frame)
+	# instead of one call per value.
+	def publish_frame(self, values, update_time = None, sync_num = None):
+		
+		if update_time is None:
+			update_time = clock.now()
+		
+		sensors = [(key if isinstance(key, Sensor) else self.get_sensor(*key), value) for key, value in values.items()]
+		
+		# Our sensors share one lock, so take it once for the frame
+		if stall_tracer.enabled:
+			stall_tracer.timed_acquire(self._sensor_lock, stall_tracer.PHASE_SENSOR_LOCK)
+		else:
+			self._sensor_lock.acquire()
+		
+		pending = []
+		try:
+			for sen, value in sensors:
+				if sen.uses_lock(self._sensor_lock):
+					sen.update_in_frame(value, update_time, sync_num, pending, locked=True)
+		finally:
+			self._sensor_lock.release()
+		
+		# Anything else (such as the null sensor for a missing one)
+		for sen, value in sensors:
+			if not sen.uses_lock(self._sensor_lock):
+				sen.update_in_frame(value, update_time, sync_num, pending)
+		
+		# Group the values by logger, keeping their order
+		frames = {}
+		for l, sensor_name, sensor_type, value in pending:
+			frames.setdefault(l, []).append((sensor_name, sensor_type, value))
+		
+		log_start = time.perf_counter() if stall_tracer.enabled else None
+		q = log_queue.active
+		for l, entries in frames.items():
+			if q is not None:
+				q.put_frame(l, entries, update_time, sync_num)
+			else:
+				l.log_frame(entries, update_time, sync_num)
+		
+		# Only wait for room in the queue once the lock is released
+		if q is not None:
+			q.wait_for_room()
+		if log_start is not None:
+			stall_tracer.add(stall_tracer.PHASE_LOG_WRITE, time.perf_counter() - log_start)
+		
+		# Tell each listener once about all of its sensors that changed
+		listeners = {}
+		for sen, value in sensors:
+			for f in sen.listeners:
+				listeners.setdefault(f, []).append(sen)
+		for f, changed in listeners.items():
+			call_listener(f, changed, update_time, sync_num)
+	
+	# Mark the targets of 'chan_id' as changed.  Called whenever one of
+	# our target sensors is written.
+	def mark_target_dirty(self, chan_id):
+		with self._dirty_lock:
+			self._dirty_targets.add(chan_id)
+	
+	# Channels with target changes not yet processed
+	@property
+	def dirty_targets(self):
+		with self._dirty_lock:
+			return set(self._dirty_targets)
+	
+	# Pass the channels with changed targets to process_targets().
+	# DataAcqController calls this right after a command changes one
+	# of our targets (with the instrument's lock held), and update()
+	# calls it in case targets were changed some other way.
+	def process_dirty_targets(self):
+		
+		with self._dirty_lock:
+			if not self._dirty_targets:
+				return
+			chan_ids = self._dirty_targets
+			self._dirty_targets = set()
+		
+		self.process_targets(chan_ids)
+	
+	# Apply new target values to the hardware for the channels in
+	# 'chan_ids' (a set).  Instruments with targets should implement
+	# this instead of checking every target in update_periodic(), and
+	# call mark_target_dirty() for any channel that can't be applied
+	# yet so it is tried again on the next update.  Must not block for
+	# more than a fraction of a second.
+	def process_targets(self, chan_ids):
+		pass
+	
 	# Runs frequent instrument updates.
-	# Typically called many times a second, but not guarenteed to
-	# be called at a constant frequency. This function is not allowed 
-	# to block for more than a fraction of a second.
+	# Called at least as often as next_update_time requires, but not
+	# guarenteed to be called at a constant frequency. This function is
+	# not allowed to block for more than a fraction of a second.
 	def update(self):
 		
+		self.process_dirty_targets()
+		
 		# The default implementation is to occasionally call
 		# update_periodic() with a period of wait_time.  Note
 		# that subclasses that override update() will not 
 		# automatically have access to update_periodic().
-		if ((time.time() - self.last_update_time) < self.wait_time):
+		now = clock.now()
+		if now < self._next_update_time:
 			return
-		self.last_update_time = time.time()
+		due_time = self._next_update_time
+		self.last_update_time = now
+		self._advance_update_time(now)
 		self.update_periodic()
+		if self.loop_stats is not None:
+			self.loop_stats.record(due_time, now, clock.now(), self.wait_time, self._max_interval)
+		
+	# Move the next update time forward along the update grid until it
+	# is after 'now'.  Missed grid points are skipped, not made up.
+	def _advance_update_time(self, now):
+		
+		if self.wait_time <= 0:
+			self._next_update_time = now
+			return
+		
+		if self._next_update_time > now:
+			return
+		
+		# Step from the last grid point, or from the phase if one is
+		# given (in case wait_time changed)
+		if self._phase is None:
+			anchor = self._next_update_time
+		else:
+			anchor = self._phase
+		
+		n = np.floor((now - anchor) / self.wait_time) + 1
+		self._next_update_time = anchor + n * self.wait_time
 	
 	
 	# Runs periodic instrument updates (with a period of wait_time).
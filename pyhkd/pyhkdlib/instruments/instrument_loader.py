@@ -2,11 +2,17 @@
 Handles loading hardware config files
 '''
 
+import time
 import logging
 import importlib
+import concurrent.futures
 import json5
 import sys
 
+from pyhkdlib.settings import INSTRUMENT_LOAD_THREADS
+from pyhkdlib import startup_profile
+from pyhkdlib.sensor_registry import registry
+
 # Each entry is (module_name, class_name) for the device object.  All
 # classes should be children of the Instrument class.  Keys define the
 # name used in the hardware config file.
@@ -16,6 +22,8 @@ valid_devices = {
     "mks_pressure": (".instruments.gpib.mks_pressure", "MKSADS1115Pressure"),
     "thermocouple": (".instruments.gpib.thermocouple", "ThermocoupleMAX31856"),
     "thales_xpcde4865": (".instruments.gpib.thales_XPCDE4865", "ThalesXPCDE4865"),
+    "simdata": (".instruments.sim_data", "SimulatedData"),
+    "virtual": (".instruments.virtual_instrument", "VirtualInstrument"),
 }
 
 # Each entry is (module_name, class_name) for the logger object.  All
@@ -34,8 +42,10 @@ valid_subdevices = {
 # Load all of the instruments (and loggers) specified in a given config
 # file.  Returns two lists, one of instruments and one of loggers.
 # Note that the loggers here are extra user-specified global loggers,
-# the per-sensor default loggers are not included here.
-def load_instruments(fname):
+# the per-sensor default loggers are not included here.  Up to
+# 'max_workers' devices are constructed at once (in config order within
+# the returned lists), since opening ports and buses can be slow.
+def load_instruments(fname, max_workers=INSTRUMENT_LOAD_THREADS):
 	
 	instruments = []
 	loggers = []
@@ -48,68 +58,141 @@ def load_instruments(fname):
 		except ValueError as e:
 			logging.error("JSON5 Error: " + str(e).replace("<string>:", "Line "))
 			sys.exit("Error while reading the hardware config file!  Note that the JSON5 error printed above may not be the root cause of your syntax error, it may simply be a symptom.  Please check that your file is valid JSON5 data (valid JSON data is also valid JSON5 data, see json5.org).  Online JSON5 validators can be very helpful here (e.g. https://jsonformatter.org/json5-validator).   Note most validators will show one error at a time, and you may have multiple.")
+	
+	# Check the whole file and import the classes first, so config
+	# errors are found before any hardware is touched
+	jobs = [_prepare_device(c) for c in config]
+	
+	start_time = time.time()
+	
+	with concurrent.futures.ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix="Instrument Loader") as executor:
+		futures = [executor.submit(_build_device, job) for job in jobs]
+		results = [f.result() for f in futures]
+	
+	for job, objs in zip(jobs, results):
+		if job['is_logger']:
+			loggers += objs
+		else:
+			instruments += objs
+	
+	logging.info("Loaded %i instruments and %i loggers in %0.2f sec" % (len(instruments), len(loggers), time.time() - start_time))
+	
+	# Every sensor can be found by name from now on.  Virtual channels
+	# read the sensors of other devices, so they are connected once
+	# everything is built.
+	registry.add_instruments(instruments)
+	if any(job['class_name'] == valid_devices['virtual'][1] for job in jobs):
+		from .virtual_instrument import connect_virtual
+		connect_virtual(instruments, registry)
+	
+	return instruments, loggers
+
+# Validate one device config entry and import its classes.  Returns a
+# job dict describing how to construct it with _build_device.
+def _prepare_device(c):
+	
+	if 'type' not in c:
+		sys.exit("Error loading a device from the config file, type is missing")
+	
+	subdevices = []
+	c_type = c.pop('type')
+	isolate = c.pop('isolate', False)
+	isolate_timeout = c.pop('isolate_timeout', None)
+	
+	if c_type in list(valid_loggers.keys()):
 		
-	for c in config:
+		is_logger = True
+		module_name, class_name = valid_loggers[c_type]
 		
-		if 'type' not in c:
-			sys.exit("Error loading a device from the config file, type is missing")
+	elif c_type in list(valid_devices.keys()):
 		
-		subdevices = []
-		c_type = c.pop('type')
+		is_logger = False
+		module_name, class_name = valid_devices[c_type]
 		
-		if c_type in list(valid_loggers.keys()):
-			
-			is_logger = True
-			module_name, class_name = valid_loggers[c_type]
+		# Remove the subdevices key so it is not passed to the device
+		if 'subdevices' in c:
+			subdevices = c.pop('subdevices')
 			
-		elif c_type in list(valid_devices.keys()):
-			
-			is_logger = False
-			module_name, class_name = valid_devices[c_type]
-			
-			# Remove the subdevices key so it is not passed to the device
-			if 'subdevices' in c:
-				subdevices = c.pop('subdevices')
-				
-		else:
-			sys.exit("Error loading a device from the config file, bad type: " + c_type)
-				
-		# Load the device
-		DeviceClass = get_class(module_name, class_name)
-		device_obj = DeviceClass(**c)
+	else:
+		sys.exit("Error loading a device from the config file, bad type: " + c_type)
+	
+	isolate = isolate and not is_logger
+	if isolate and c_type == 'virtual':
+		sys.exit("Virtual devices cannot be isolated")
+	if isolate and len(subdevices) > 0:
+		sys.exit("Devices with subdevices cannot be isolated (%s)" % class_name)
+	
+	# Some devices have subdevices, these are built along with the device
+	subdevice_jobs = []
+	for d in subdevices:
 		
-		if is_logger:
-			
-			logging.info("Loaded global logger " + class_name)
-			loggers.append(device_obj)
+		if 'type' not in d:
+			sys.exit("Error loading subdevice, type is missing")
 		
-		else:
+		d_type = d.pop('type')
 		
-			instruments.append(device_obj)
-			
-			# Some devices have subdevices, load these as well			
-			for d in subdevices:
-				
-				if 'type' not in d:
-					sys.exit("Error loading subdevice, type is missing")
-				
-				d_type = d.pop('type')
-				
-				# Warn people still using old config syntax that things
-				# have changed
-				if d_type in ['agilent_e364xa','agilent_e363xa']:
-					sys.exit("Please specify the full version number for GPIB controlled Agilent power supplies in your config file (ex: agilent_e3641a)")
-				
-				if d_type not in list(valid_subdevices[c_type].keys()):
-					sys.exit("Error loading subdevice, bad type: " + d_type)
-					
-				# Load the subdevice
-				module_name, class_name = valid_subdevices[c_type][d_type]
-				SubDeviceClass = get_class(module_name, class_name)
-				subdevice_obj = SubDeviceClass(device_obj, **d)
-				instruments.append(subdevice_obj)
+		# Warn people still using old config syntax that things
+		# have changed
+		if d_type in ['agilent_e364xa','agilent_e363xa']:
+			sys.exit("Please specify the full version number for GPIB controlled Agilent power supplies in your config file (ex: agilent_e3641a)")
+		
+		if d_type not in list(valid_subdevices.get(c_type, {}).keys()):
+			sys.exit("Error loading subdevice, bad type: " + d_type)
+		
+		sub_module_name, sub_class_name = valid_subdevices[c_type][d_type]
+		with startup_profile.timed('import', sub_module_name):
+			SubDeviceClass = get_class(sub_module_name, sub_class_name)
+		subdevice_jobs.append((SubDeviceClass, d))
+	
+	# The isolated device module is only imported in the child
+	DeviceClass = None
+	if not isolate:
+		with startup_profile.timed('import', module_name):
+			DeviceClass = get_class(module_name, class_name)
+	
+	return {'is_logger': is_logger, 'module_name': module_name, 'class_name': class_name,
+			'config': c, 'isolate': isolate, 'isolate_timeout': isolate_timeout,
+			'class': DeviceClass, 'subdevices': subdevice_jobs}
 
-	return instruments, loggers
+# Construct a device (and its subdevices) from a _prepare_device job.
+# Returns a list of the constructed objects.
+def _build_device(job):
+	
+	start_time = time.time()
+	
+	if job['isolate']:
+		device_obj = load_isolated(job['module_name'], job['class_name'], job['config'], job['isolate_timeout'])
+	else:
+		device_obj = job['class'](**job['config'])
+	
+	objs = [device_obj]
+	for SubDeviceClass, d in job['subdevices']:
+		objs.append(SubDeviceClass(device_obj, **d))
+	
+	dt = time.time() - start_time
+	startup_profile.record('init', job['class_name'], dt)
+	
+	if job['is_logger']:
+		logging.info("Loaded global logger %s in %0.2f sec" % (job['class_name'], dt))
+	else:
+		logging.info("Loaded instrument %s in %0.2f sec" % (job['class_name'], dt))
+	
+	return objs
+
+# Start a device in a child process (see IsolatedInstrument).  The
+# device module is only imported in the child.
+def load_isolated(module_name, class_name, config, isolate_timeout=None):
+	
+	from .isolated_instrument import IsolatedInstrument
+	
+	kwargs = {}
+	if isolate_timeout is not None:
+		kwargs['isolate_timeout'] = isolate_timeout
+	
+	try:
+		return IsolatedInstrument(module_name, class_name, config, **kwargs)
+	except RuntimeError as e:
+		sys.exit(str(e))
 
 def get_class(module_name, class_name):
     """
@@ -0,0 +1,406 @@
+'''
+Runs an instrument with blocking drivers in a child process, so a hung
+driver cannot block the acquisition loop in the main process.
+
+The child process constructs the real instrument and runs its update
+loop.  Every value it reports is sent back over a pipe and set on a
+matching Sensor in the main process, which handles all logging.  Target
+changes made in the main process are forwarded to the child.  If the
+child stops responding for longer than isolate_timeout, it is killed
+and started again in a background thread, so the acquisition loop
+keeps running while the new child starts.
+
+Usage:
+	- Add "isolate": true to an instrument in the hardware config file
+	- Optionally set "isolate_timeout" (seconds)
+'''
+
+import time
+import logging
+import importlib
+import threading
+import traceback
+import multiprocessing
+
+from ..sensor import Sensor
+from ..loggers.logger import Logger
+from .instrument import Instrument
+from .. import clock
+
+# Keys that control how values are processed and saved.  These are
+# handled by the Sensors in the main process, so the child process
+# does not apply them a second time.
+PROCESSING_CHAN_KEYS = ['filter', 'filters', 'downsample', 'save_deriv', 'save_fast', 'deadband', 'max_interval', 'bin_time', 'bin_stats', 'history']
+PROCESSING_DEFAULT_KEYS = ['default_downsample', 'default_save_deriv', 'default_save_fast']
+
+# Keys that control how the main process schedules this instrument
+SCHEDULING_KEYS = ['priority', 'max_interval']
+
+class IsolatedInstrument(Instrument):
+
+	BOX_TYPE = 'ISOLATED'
+
+	# Time between checks of child health
+	POLL_TIME = 0.1 # seconds
+
+	# Time allowed for the child process to construct the instrument
+	STARTUP_TIMEOUT = 60 # seconds
+
+	# Minimum time between attempts to restart the child process
+	RESTART_TIME = 10 # seconds
+
+	# 'module_name', 'class_name'	Location of the instrument class (as in instrument_loader)
+	# 'config'						The instrument config (without the type), passed to the class
+	# 'isolate_timeout'				Seconds without contact before the child is restarted
+	def __init__(self, module_name, class_name, config, isolate_timeout=60):
+
+		assert isolate_timeout > 0, "isolate_timeout should be a positive number"
+
+		self._module_name = module_name
+		self._class_name = class_name
+		self._config = config
+		self._isolate_timeout = isolate_timeout
+
+		self._ctx = multiprocessing.get_context('spawn')
+		self._proc = None
+		self._conn = None
+		self._conn_lock = threading.Lock()
+		self._thread_rx = None
+		self._last_contact = 0
+		self._last_start = 0
+		self._restart_thread = None
+		self._closed = False
+
+		# The last target values known to match the child, indexed
+		# by (chan_id, sensor_type)
+		self._target_lock = threading.Lock()
+		self._target_values = {}
+
+		box_type, child_channels = self._start_child()
+		self.BOX_TYPE = box_type
+
+		# Build the sensors from the channel list the child reports,
+		# keeping the processing options from the config file
+		channels = self._merge_channels(child_channels)
+		self.NUM_SENSORS = len(channels)
+
+		kwargs = {k: config[k] for k in PROCESSING_DEFAULT_KEYS if k in config}
+		for k in ['verbose_rx', 'verbose_tx', 'verbose_fail', 'verbose_raw'] + SCHEDULING_KEYS:
+			if k in config:
+				kwargs[k] = config[k]
+
+		Instrument.__init__(self, channels=channels, wait_time=self.POLL_TIME, **kwargs)
+
+		for sen in self.sensors:
+			if sen.sensor_type in Sensor.VALID_TARGET_TYPES:
+				self._target_values[self._sensor_key(sen)] = sen.value
+
+		self._start_rx()
+
+		logging.info("Instrument of type %s is running in child process %i" % (self.BOX_TYPE, self._proc.pid))
+
+	# Combine the child's channel ids and types with the config options
+	def _merge_channels(self, child_channels):
+
+		by_name = {c['name']: c for c in self._config.get('channels', None) or []}
+
+		channels = []
+		for cc in child_channels:
+			chan = {k: v for k, v in by_name.get(cc['name'], {}).items() if k in Instrument.VALID_CHAN_KEYS}
+			chan.pop('calib_func', None)
+			chan.update(cc)
+			channels.append(chan)
+
+		return channels
+
+	# Return the (chan_id, sensor_type) key for one of our sensors
+	def _sensor_key(self, sen):
+		return (self.lookup_id[sen.name], sen.sensor_type)
+
+	# Start the child process and wait for it to construct the
+	# instrument.  Returns (box type, channel list) from the child.
+	def _start_child(self):
+
+		self._last_start = clock.now()
+
+		conn, child_conn = self._ctx.Pipe()
+		self._proc = self._ctx.Process(target=_isolated_main,
+			args=(self._module_name, self._class_name, self._config, child_conn, clock.get_clock()),
+			name="pyhkd isolated %s" % self._class_name)
+		self._proc.daemon = True
+		self._proc.start()
+		child_conn.close()
+
+		if not conn.poll(self.STARTUP_TIMEOUT):
+			self._kill_child()
+			raise RuntimeError("Isolated instrument %s did not start within %i sec" % (self._class_name, self.STARTUP_TIMEOUT))
+
+		try:
+			msg = conn.recv()
+		except EOFError:
+			self._kill_child()
+			raise RuntimeError("Isolated instrument %s exited during startup" % (self._class_name,))
+		
+		if msg[0] != 'ready':
+			self._kill_child()
+			raise RuntimeError("Isolated instrument %s failed to start: %s" % (self._class_name, msg[1]))
+
+		_, box_type, channels = msg
+
+		with self._conn_lock:
+			self._conn = conn
+		self._last_contact = clock.now()
+
+		return box_type, channels
+
+	# Start receiving values from the current child process
+	def _start_rx(self):
+		self._thread_rx = threading.Thread(target=self._loop_rx, args=(self._conn,), name="Isolated RX (%s)" % self._class_name)
+		self._thread_rx.daemon = True
+		self._thread_rx.start()
+
+	# Stop the child process, forcefully if needed
+	def _kill_child(self, grace_time=0):
+
+		if self._proc is None:
+			return
+
+		if grace_time > 0:
+			self._proc.join(grace_time)
+		if self._proc.is_alive():
+			self._proc.terminate()
+			self._proc.join(1)
+		if self._proc.is_alive():
+			self._proc.kill()
+			self._proc.join(1)
+
+		with self._conn_lock:
+			if self._conn is not None:
+				self._conn.close()
+				self._conn = None
+
+		self._proc = None
+
+	# Kill and restart a child that stopped responding.  Runs in
+	# _restart_thread, update_periodic() finishes the restart.
+	def _restart_child(self):
+
+		self._kill_child()
+
+		try:
+			self._start_child()
+		except (RuntimeError, OSError) as e:
+			logging.error(str(e))
+			self._kill_child()
+			return
+
+		if self._closed:
+			self._kill_child()
+
+	# Start receiving from a restarted child and re-send it all targets
+	def _finish_restart(self):
+
+		self._start_rx()
+		logging.info("Isolated instrument of type %s restarted in child process %i" % (self.BOX_TYPE, self._proc.pid))
+
+		with self._target_lock:
+			self._target_values = {k: float('nan') for k in self._target_values}
+			for chan_id, _ in self._target_values:
+				self.mark_target_dirty(chan_id)
+
+	# Send a message to the child, returns True on success
+	def _send(self, msg):
+		with self._conn_lock:
+			if self._conn is None:
+				return False
+			try:
+				self._conn.send(msg)
+				return True
+			except (OSError, ValueError):
+				return False
+
+	# Run until the pipe closes, applying values sent from the child
+	def _loop_rx(self, conn):
+
+		while True:
+
+			try:
+				msg = conn.recv()
+			except (EOFError, OSError):
+				break
+
+			self._last_contact = clock.now()
+
+			if msg[0] == 'value':
+				_, name, sensor_type, value, update_time, sync_num = msg
+				entries = [(name, sensor_type, value)]
+			elif msg[0] == 'frame':
+				_, entries, update_time, sync_num = msg
+			else:
+				continue
+
+			values = {}
+			for name, sensor_type, value in entries:
+
+				chan_id = self.lookup_id.get(name, None)
+				if self.get_sensor(chan_id, sensor_type, none_on_fail=True) is None:
+					continue
+
+				# Targets are set in the main process, the child's copy
+				# may be older than a change not yet forwarded
+				if sensor_type in Sensor.VALID_TARGET_TYPES:
+					continue
+
+				values[(chan_id, sensor_type)] = value
+
+			self.publish_frame(values, update_time, sync_num)
+
+	# Check the child is still alive, restarting it if not.
+	# Implements Instrument.update_periodic
+	def update_periodic(self):
+
+		# Wait for a restart to finish
+		thread = self._restart_thread
+		if thread is not None:
+			if thread.is_alive():
+				return
+			self._restart_thread = None
+			if self._proc is not None:
+				self._finish_restart()
+			return
+
+		if self._proc is None or not self._proc.is_alive() or (clock.now() - self._last_contact) > self._isolate_timeout:
+			if (clock.now() - self._last_start) > self.RESTART_TIME:
+				logging.error("Restarting isolated instrument of type %s" % (self.BOX_TYPE,))
+				self._last_start = clock.now()
+				self._restart_thread = threading.Thread(target=self._restart_child, name="Isolated restart (%s)" % self._class_name)
+				self._restart_thread.daemon = True
+				self._restart_thread.start()
+
+	# Forward changed targets of 'chan_ids' to the child, keeping any
+	# that can't be sent for the next update.
+	# Implements Instrument.process_targets
+	def process_targets(self, chan_ids):
+
+		with self._target_lock:
+			for key, old_value in self._target_values.items():
+				if key[0] not in chan_ids:
+					continue
+				value = self.get_sensor(*key).value
+				if _same_value(value, old_value):
+					continue
+				if self._send(('target', key[0], key[1], value)):
+					self._target_values[key] = value
+				else:
+					self.mark_target_dirty(key[0])
+
+	# Stop the child process
+	def close(self):
+		self._closed = True
+		thread = self._restart_thread
+		if thread is not None:
+			thread.join(5)
+		self._send(('stop',))
+		self._kill_child(grace_time=5)
+
+# Compare values treating NaN as equal to NaN
+def _same_value(a, b):
+	if a is None or b is None:
+		return (a is None) and (b is None)
+	try:
+		if (a != a) and (b != b):
+			return True
+	except TypeError:
+		pass
+	return a == b
+
+# Forwards every logged value from the child process to the main process
+class _PipeLogger(Logger):
+
+	def __init__(self, conn, conn_lock):
+		self._conn = conn
+		self._conn_lock = conn_lock
+
+	# Implements Logger.log, see base class for argument descriptions
+	def log(self, sensor_name, sensor_type, value, update_time, sync_num = None):
+		with self._conn_lock:
+			try:
+				self._conn.send(('value', sensor_name, sensor_type, value, update_time, sync_num))
+			except (OSError, ValueError):
+				pass
+
+	# Implements Logger.log_frame, sending the frame as one message
+	def log_frame(self, entries, update_time, sync_num = None):
+		with self._conn_lock:
+			try:
+				self._conn.send(('frame', entries, update_time, sync_num))
+			except (OSError, ValueError):
+				pass
+
+# Entry point of the child process.  Constructs the instrument, then
+# runs its update loop and applies targets from the main process until
+# told to stop.  'main_clock' is the clock used by the main process.
+def _isolated_main(module_name, class_name, config, conn, main_clock):
+
+	HEARTBEAT_TIME = 1 # seconds
+	MAX_SLEEP = 0.1 # seconds
+
+	clock.set_clock(main_clock)
+
+	# The main process does all of the logging, filtering, and history
+	Sensor.LOG_TO_FILES = False
+	Sensor.KEEP_HISTORY = False
+	config = dict(config)
+	for k in PROCESSING_DEFAULT_KEYS + SCHEDULING_KEYS:
+		config.pop(k, None)
+	if config.get('channels', None) is not None:
+		config['channels'] = [{k: v for k, v in c.items() if k not in PROCESSING_CHAN_KEYS} for c in config['channels']]
+
+	conn_lock = threading.Lock()
+
+	try:
+		module = importlib.import_module(module_name, package='pyhkdlib')
+		inst = getattr(module, class_name)(**config)
+	except BaseException:
+		conn.send(('error', traceback.format_exc()))
+		return
+
+	channels = []
+	for chan_id in inst.sensor_ids:
+		chan = inst.get_channel(chan_id)
+		channels.append({'id': chan_id, 'name': chan['name'], 'type': chan['types_processed'], 'alias': chan.get('alias', None)})
+
+	inst.add_logger(_PipeLogger(conn, conn_lock))
+
+	with conn_lock:
+		conn.send(('ready', inst.BOX_TYPE, channels))
+
+	last_heartbeat = 0
+
+	while True:
+
+		# Apply any messages from the main process
+		while conn.poll():
+			msg = conn.recv()
+			if msg[0] == 'stop':
+				inst.close()
+				return
+			elif msg[0] == 'target':
+				_, chan_id, sensor_type, value = msg
+				with inst.action_lock:
+					inst.get_sensor(chan_id, sensor_type).value = value
+
+		with inst.action_lock:
+			try:
+				inst.update()
+			except:
+				logging.error("Contained update error in isolated instrument of type %s. %s" % (inst.BOX_TYPE, traceback.format_exc()))
+
+		if (clock.now() - last_heartbeat) > HEARTBEAT_TIME:
+			last_heartbeat = clock.now()
+			with conn_lock:
+				conn.send(('heartbeat',))
+
+		# Sleep until the next update or a message arrives
+		delay = inst.next_update_time - clock.now()
+		conn.poll(clock.real_timeout(min(max(delay, 0.005), MAX_SLEEP)))
@@ -7,6 +7,7 @@ import threading
 import traceback
 
 from ..sensor import Sensor
+from .. import clock
 from ..instruments.instrument import Instrument
 
 # An instrument communicating over serial.  Uses two threads for serial
@@ -151,10 +152,10 @@ class SerialInstrument(Instrument):
 				return True
 			
 			# Make sure we don't try too often
-			if (time.time() - self._last_reconnect_try) < self.SER_RECONNECT_TIME:
+			if (clock.now() - self._last_reconnect_try) < self.SER_RECONNECT_TIME:
 				return False
 			
-			self._last_reconnect_try = time.time()
+			self._last_reconnect_try = clock.now()
 			
 			try:
 				self._ser = serial.Serial(
@@ -234,11 +235,11 @@ class SerialInstrument(Instrument):
 				
 				# Flush stale partial packets or asks
 				if len(self._rx_buf) > 0:
-					if (time.time() - self._last_rx_time) > self.SER_PACKET_TIMEOUT:
+					if (clock.now() - self._last_rx_time) > self.SER_PACKET_TIMEOUT:
 						logging.error("Flushing stale incomplete serial packet received on port %s.  RX buffer: %s" % (self._port, str(self._rx_buf)))
 						self._rx_reset()			
 				if self._ask_callback is not None:
-					if (time.time() - self._last_ask_time) > self.SER_ASK_TIMEOUT:
+					if (clock.now() - self._last_ask_time) > self.SER_ASK_TIMEOUT:
 						#~ logging.error("Flushing stale 'ask' (no response) on port %s.  RX buffer: %s" % (self._port, str(self._rx_buf)))
 						self._rx_reset()			
 
@@ -257,7 +258,7 @@ class SerialInstrument(Instrument):
 				if len(new_data) < 1:
 					continue
 					
-				self._last_rx_time = time.time()
+				self._last_rx_time = clock.now()
 				
 				if self.verbose_rx and self.verbose_raw:
 					if self._return_bytes:
@@ -359,7 +360,7 @@ class SerialInstrument(Instrument):
 			# before the connection check.
 			with self._tx_lock:
 				for (pkt,t,cb) in list(self._tx_buf):
-					if (time.time() - t) > self.SER_TX_TIMEOUT:
+					if (clock.now() - t) > self.SER_TX_TIMEOUT:
 						self._tx_buf.remove((pkt,t,cb))
 						hex_repr = ":".join("{:02x}".format(c) for c in pkt)
 						if self.verbose_tx:
@@ -407,18 +408,18 @@ class SerialInstrument(Instrument):
 			if resp_callback is not None:
 				
 				# Wait for an empty RX buffer before starting an "ask"
-				start_time = time.time()
+				start_time = clock.now()
 				while True:
 					
 					with self._rx_lock, self._ser_lock:
 						if self._ser.in_waiting == 0 and len(self._rx_buf) == 0:
 							self._ask_callback = resp_callback
-							self._last_ask_time = time.time()
+							self._last_ask_time = clock.now()
 							self._ser_send_packet_now(to_send)
 							#~ logging.debug("Serial 'ask' initialized (port %s)" % (self._port))
 							break
 							
-					if (time.time() - start_time) > self.SER_ASK_TIMEOUT:
+					if (clock.now() - start_time) > self.SER_ASK_TIMEOUT:
 						logging.error("Serial 'ask' failed, timeout reached when waiting for an empty RX buffer (port %s)" % (self._port))
 						break
 					
@@ -486,7 +487,7 @@ class SerialInstrument(Instrument):
 			packet = packet.encode()
 			
 		with self._tx_lock:				
-			self._tx_buf.append((packet, time.time(), resp_callback))
+			self._tx_buf.append((packet, clock.now(), resp_callback))
 		
 		if self.verbose_tx:	
 			logging.debug("Added packet to serial TX queue (port %s)" % (self._port))
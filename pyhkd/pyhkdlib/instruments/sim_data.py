@@ -0,0 +1,56 @@
+'''
+A fake instrument that reports a random walk on every channel, for
+testing pyhkd without hardware (including faster than real time, see
+the clock module).
+
+Usage:
+	- Add an instrument of type "simdata" to the hardware config file
+	  with any number of channels
+'''
+
+import numpy as np
+
+from .instrument import Instrument
+from .. import clock
+
+class SimulatedData(Instrument):
+
+	BOX_TYPE = 'SIMDATA'
+
+	# Standard deviation of each random walk step
+	STEP_SIZE = 0.01
+
+	# 'delta_sync'	If given, each update is stored with a sync number
+	#				that increases by delta_sync per update
+	def __init__(self, channels=[], delta_sync=None, **kwargs):
+
+		assert (delta_sync is None) or (int(delta_sync) == delta_sync), "delta_sync should be an integer"
+
+		# Any number of channels is allowed
+		self.NUM_SENSORS = len(channels)
+
+		self._delta_sync = delta_sync
+		self._sync_num = 0
+
+		Instrument.__init__(self, channels=channels, **kwargs)
+
+		# Keyed by sensor handle so publish_frame skips the lookups
+		self._values = {sensor: 0.0 for sensor in self._sensors.values()}
+		self._rng = np.random.default_rng()
+
+	# Take one random walk step on every sensor.
+	# Implements Instrument.update_periodic
+	def update_periodic(self):
+
+		now = clock.now()
+
+		sync_num = None
+		if self._delta_sync is not None:
+			sync_num = self._sync_num
+			self._sync_num += self._delta_sync
+
+		steps = self._rng.normal(0, self.STEP_SIZE, len(self._values))
+		for (key, value), step in zip(list(self._values.items()), steps):
+			self._values[key] = value + step
+
+		self.publish_frame(self._values, now, sync_num)
@@ -0,0 +1,203 @@
+'''
+Channels computed from other sensors, such as heater power from a
+voltage or the difference between two thermometers.  Each channel has an
+expression over other sensors, written with the sensor names in braces:
+
+	"{4K Head} - {4K Plate}"				(same type as the channel)
+	"{HS 1:voltage}**2 / 100"				(explicit sensor type)
+
+All virtual channels (of every virtual instrument) form one dependency
+graph.  When a sensor changes, only the virtual channels that depend on
+it (directly or through other virtual channels) are recomputed, in
+dependency order, and their results are logged like any other sensor.
+
+Usage:
+	- Add an instrument of type "virtual" to the hardware config file,
+	  giving each channel an "expr"
+	- load_instruments() calls connect_virtual() once every device is
+	  built
+'''
+
+import re
+import sys
+import math
+import logging
+import threading
+import numpy as np
+
+from .instrument import Instrument
+from ..sensor_registry import SensorRegistry
+
+# A sensor reference: {name} or {name:type}
+_REFERENCE = re.compile(r'\{([^{}:]+)(?::([^{}]+))?\}')
+
+# Names available in expressions
+_NAMESPACE = {'__builtins__': {}, 'np': np, 'math': math, 'abs': abs, 'min': min, 'max': max,
+			  'sqrt': np.sqrt, 'exp': np.exp, 'log': np.log, 'log10': np.log10, 'nan': float('NaN')}
+
+class VirtualInstrument(Instrument):
+
+	BOX_TYPE = 'VIRTUAL'
+
+	VALID_CHAN_KEYS = Instrument.VALID_CHAN_KEYS + ['expr']
+
+	def __init__(self, channels=[], wait_time=60, **kwargs):
+
+		# Any number of channels is allowed
+		self.NUM_SENSORS = len(channels)
+
+		exprs = []
+		for c in channels:
+			if 'expr' not in c:
+				sys.exit("Virtual channel '%s' needs an 'expr'" % c.get('name', ''))
+			exprs.append(c['expr'])
+
+		# Nothing to poll, values are computed as inputs change
+		Instrument.__init__(self, channels=channels, wait_time=wait_time, **kwargs)
+
+		# (sensor, expression) for each channel, connected later by
+		# connect_virtual()
+		self.expressions = []
+		for chan_id, expr in zip(self.sensor_ids, exprs):
+			types = self.get_channel_types(chan_id)
+			if len(types) != 1:
+				sys.exit("Virtual channel '%s' should have a single type" % self.get_channel(chan_id)['name'])
+			self.expressions.append((self.get_sensor(chan_id, types[0]), expr))
+
+# A virtual channel: its sensor, its compiled expression, and the
+# sensors it reads
+class _VirtualNode:
+
+	__slots__ = ['sensor', 'expr', 'func', 'inputs', 'error_logged']
+
+	def __init__(self, sensor, expr, registry):
+
+		self.sensor = sensor
+		self.expr = expr
+		self.error_logged = False
+		self.inputs = []
+
+		# Replace each reference with an element of the input list
+		def replace(m):
+			name = m.group(1).strip()
+			sensor_type = (m.group(2) or sensor.sensor_type).strip()
+			s = registry.get(name, sensor_type)
+			if s is None:
+				sys.exit("Virtual channel '%s' refers to unknown sensor '%s' of type '%s'" % (sensor.name, name, sensor_type))
+			self.inputs.append(s)
+			return '_v[%i]' % (len(self.inputs) - 1)
+
+		body = _REFERENCE.sub(replace, expr)
+
+		try:
+			self.func = eval('lambda _v: ' + body, dict(_NAMESPACE))
+		except SyntaxError as e:
+			sys.exit("Bad expression for virtual channel '%s': %s (%s)" % (sensor.name, expr, str(e)))
+
+	# Compute and store the new value
+	def evaluate(self, update_time, sync_num):
+
+		try:
+			value = float(self.func([s.value for s in self.inputs]))
+		except Exception as e:
+			if not self.error_logged:
+				logging.error("Failed to compute virtual channel '%s' = %s: %s" % (self.sensor.name, self.expr, repr(e)))
+				self.error_logged = True
+			value = float('NaN')
+
+		self.sensor.set_value(value, update_time, sync_num)
+
+# The dependency graph of all virtual channels.  Listens for changes of
+# the sensors they read and recomputes the affected channels.
+class VirtualGraph:
+
+	# 'nodes' is a list of _VirtualNode
+	def __init__(self, nodes):
+
+		self._lock = threading.Lock()
+
+		# Order the nodes so each comes after the virtual channels it reads
+		by_sensor = {n.sensor: n for n in nodes}
+		self._nodes = []
+		state = {}
+		def visit(n, path):
+			if state.get(n) == 'done':
+				return
+			if state.get(n) == 'visiting':
+				sys.exit("Virtual channels depend on each other in a loop: " + " -> ".join([p.sensor.name for p in path + [n]]))
+			state[n] = 'visiting'
+			for s in n.inputs:
+				if s in by_sensor:
+					visit(by_sensor[s], path + [n])
+			state[n] = 'done'
+			self._nodes.append(n)
+		for n in nodes:
+			visit(n, [])
+		order = {n: i for i, n in enumerate(self._nodes)}
+
+		# The virtual channels that read each sensor directly
+		readers = {}
+		for n in self._nodes:
+			for s in n.inputs:
+				readers.setdefault(s, set()).add(n)
+
+		# For each real (not virtual) input sensor, every channel affected
+		# by a change, in dependency order
+		self._affected = {}
+		for s in readers:
+			if s in by_sensor:
+				continue
+			affected = set()
+			todo = list(readers[s])
+			while todo:
+				n = todo.pop()
+				if n not in affected:
+					affected.add(n)
+					todo += list(readers.get(n.sensor, []))
+			self._affected[s] = sorted(affected, key=order.get)
+			s.add_listener(self.on_change)
+
+		self._order = order
+
+		# Channels without inputs are constants
+		for n in self._nodes:
+			if len(n.inputs) == 0:
+				n.evaluate(None, None)
+
+	@property
+	def nodes(self):
+		return list(self._nodes)
+
+	# Sensor listener, recomputes the channels affected by 'sensors'
+	def on_change(self, sensors, update_time, sync_num):
+
+		if len(sensors) == 1:
+			affected = self._affected.get(sensors[0], [])
+		else:
+			affected = set()
+			for s in sensors:
+				affected.update(self._affected.get(s, []))
+			affected = sorted(affected, key=self._order.get)
+
+		with self._lock:
+			for n in affected:
+				n.evaluate(update_time, sync_num)
+
+# Connect the channels of every VirtualInstrument in 'instruments' to
+# the sensors they read, found in 'registry' (by default a SensorRegistry
+# of 'instruments').  Returns the VirtualGraph, or None if there are no
+# virtual channels.
+def connect_virtual(instruments, registry=None):
+
+	virtual = [inst for inst in instruments if isinstance(inst, VirtualInstrument)]
+	if len(virtual) == 0:
+		return None
+
+	if registry is None:
+		registry = SensorRegistry(instruments)
+
+	nodes = [_VirtualNode(sensor, expr, registry) for inst in virtual for sensor, expr in inst.expressions]
+
+	graph = VirtualGraph(nodes)
+	logging.info("Connected %i virtual channels" % len(nodes))
+	return graph
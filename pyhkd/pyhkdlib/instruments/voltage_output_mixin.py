@@ -4,8 +4,12 @@ common to all classes that contain setable voltages.  Such classes
 should have sensors of the type Sensor.TYPE_TARGET_VOLTAGE
 
 Usage:
-	- Inherit in an Instrument subclass
+	- Inherit in an Instrument subclass (listed before Instrument, so
+	  process_targets is used)
 	- Call VoltageOutputMixin.__init__ in the subclass's __init__
+	- New targets are applied as soon as they are set.  Optionally call
+	  process_voltage_targets() in the update loop to re-apply outputs
+	  that drift from their targets.
 
 '''
 
@@ -101,14 +105,22 @@ class VoltageOutputMixin:
 			
 		return p
 	
-	# Checks targets for all setable voltages and changed outputs as
-	# needed.  Call in the instrument update loop.  Returns True if
-	# any new voltages were applied, False otherwise.
-	def process_voltage_targets(self):
+	# Apply changed targets right away.
+	# Implements Instrument.process_targets
+	def process_targets(self, chan_ids):
+		self.process_voltage_targets(chan_ids)
+	
+	# Checks targets for the setable voltages of 'chan_ids' (default all
+	# channels) and changes outputs as needed.  Returns True if any new
+	# voltages were applied, False otherwise.
+	def process_voltage_targets(self, chan_ids=None):
 		
 		any_set = False
 		
-		for c_id in self.sensor_ids:
+		if chan_ids is None:
+			chan_ids = self.sensor_ids
+		
+		for c_id in chan_ids:
 			
 			# Look for setable voltages
 			sen_t = self.get_sensor(c_id, Sensor.TYPE_TARGET_VOLTAGE, none_on_fail = True)
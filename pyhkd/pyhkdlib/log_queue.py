@@ -0,0 +1,228 @@
+'''
+Moves logging off the threads that update sensors.  Once started,
+sensors queue each value for their loggers (SoloDateLogger file writes,
+the SyncFrameLogger, etc.) instead of calling them while holding their
+update lock, and a worker thread writes the queued values in batches.
+A single worker keeps every logger's values in order.
+
+When the queue is full, new values either wait for room (POLICY_BLOCK)
+or are dropped and counted (POLICY_DROP).  Values are queued while the
+sensor's update lock is held, so producers only wait for room in
+wait_for_room() after releasing it.
+
+Usage:
+	- Call start() once at startup, before instruments are created
+	- Call stop() at shutdown to write out everything queued (also done
+	  at exit)
+	- Call put_value() or put_frame(), then wait_for_room() once no locks
+	  are held
+	- Call to_dict() for the queue depth, drops, and lag
+'''
+
+import time
+import atexit
+import logging
+import threading
+import collections
+
+from .loop_stats import RollingHistogram
+
+POLICY_BLOCK = 'block'
+POLICY_DROP = 'drop'
+VALID_POLICIES = [POLICY_BLOCK, POLICY_DROP]
+
+# Record kinds
+_VALUE = 0
+_FRAME = 1
+
+# The running LogQueue, checked by Sensor on every update.  None when
+# loggers are called directly.
+active = None
+
+class LogQueue:
+
+	# Log dropped values and logger errors at most this often
+	WARN_INTERVAL = 60 # seconds
+
+	# 'max_depth'	Most records held before the policy applies
+	# 'policy'		One of VALID_POLICIES
+	# 'batch_time'	How often the worker wakes to write out the queue
+	def __init__(self, max_depth=100000, policy=POLICY_BLOCK, batch_time=0.05):
+
+		assert max_depth > 0, "max_depth should be a positive number of records"
+		assert policy in VALID_POLICIES, "Invalid log queue policy: " + str(policy)
+
+		self._max_depth = max_depth
+		self._policy = policy
+		self._batch_time = batch_time
+
+		# Appends and pops on a deque are atomic, so producers don't
+		# need a lock.  The condition wakes the worker early and lets
+		# blocked producers wait for room.
+		self._records = collections.deque()
+		self._cond = threading.Condition()
+		self._stopping = False
+
+		self._stats_lock = threading.Lock()
+		self.lag = RollingHistogram(min_value=1e-4, max_value=1e2)
+		self.num_written = 0
+		self.num_dropped = 0
+		self.num_errors = 0
+		self.max_depth_seen = 0
+		self.blocked_time = 0.0
+		self._last_drop_warning = 0
+		self._last_error_warning = 0
+		self._unlogged_drops = 0
+
+		self._thread = threading.Thread(target=self._run, name="Log Queue")
+		self._thread.daemon = True
+		self._thread.start()
+
+	# Queue a value for each logger in 'loggers' (Logger.log).  Never
+	# waits, with POLICY_BLOCK a full queue takes the value anyway and
+	# the caller waits in wait_for_room().
+	def put_value(self, loggers, sensor_name, sensor_type, value, update_time, sync_num):
+		self._put((_VALUE, time.perf_counter(), loggers, sensor_name, sensor_type, value, update_time, sync_num))
+
+	# Queue a frame of (sensor_name, sensor_type, value) entries for
+	# 'logger' (Logger.log_frame), like put_value()
+	def put_frame(self, logger, entries, update_time, sync_num):
+		self._put((_FRAME, time.perf_counter(), logger, entries, update_time, sync_num))
+
+	def _put(self, record):
+
+		depth = len(self._records)
+		if depth >= self._max_depth and self._policy == POLICY_DROP:
+			self._drop()
+			return
+		self._records.append(record)
+
+		# Unlocked, so racing producers can miss a new maximum by a few
+		if depth >= self.max_depth_seen:
+			self.max_depth_seen = depth + 1
+
+	# Count a value dropped from a full queue
+	def _drop(self):
+
+		with self._stats_lock:
+			self.num_dropped += 1
+			self._unlogged_drops += 1
+			now = time.time()
+			if (now - self._last_drop_warning) > self.WARN_INTERVAL:
+				logging.warning("Log queue is full (%i records), dropped %i value(s)" % (self._max_depth, self._unlogged_drops))
+				self._last_drop_warning = now
+				self._unlogged_drops = 0
+
+	# With POLICY_BLOCK, wait until the queue has room.  Call this
+	# without holding any sensor lock, so other threads can still update
+	# the sensors while this one waits.
+	def wait_for_room(self):
+
+		if self._policy != POLICY_BLOCK or len(self._records) < self._max_depth:
+			return
+
+		start_time = time.perf_counter()
+		with self._cond:
+			self._cond.notify_all()
+			while len(self._records) >= self._max_depth and not self._stopping:
+				self._cond.wait(self._batch_time)
+		with self._stats_lock:
+			self.blocked_time += time.perf_counter() - start_time
+
+	# Write out queued records until stopped
+	def _run(self):
+
+		while True:
+
+			with self._cond:
+				if len(self._records) == 0 and not self._stopping:
+					self._cond.wait(self._batch_time)
+				stopping = self._stopping
+
+			self._write_batch()
+
+			with self._cond:
+				self._cond.notify_all()
+
+			if stopping and len(self._records) == 0:
+				break
+
+	# Write out the records queued so far
+	def _write_batch(self):
+
+		n = len(self._records)
+		if n == 0:
+			return
+
+		lag = time.perf_counter() - self._records[0][1]
+		errors = 0
+
+		for _ in range(n):
+			record = self._records.popleft()
+			try:
+				if record[0] == _VALUE:
+					_, _, loggers, sensor_name, sensor_type, value, update_time, sync_num = record
+					for l in loggers:
+						l.log(sensor_name, sensor_type, value, update_time, sync_num)
+				else:
+					_, _, logger, entries, update_time, sync_num = record
+					logger.log_frame(entries, update_time, sync_num)
+			except Exception as e:
+				errors += 1
+				error = e
+
+		with self._stats_lock:
+			self.lag.add(lag)
+			self.num_written += n
+			self.num_errors += errors
+			now = time.time()
+			if errors > 0 and (now - self._last_error_warning) > self.WARN_INTERVAL:
+				logging.error("Log queue had %i logger error(s), the last was: %s" % (errors, repr(error)))
+				self._last_error_warning = now
+
+	# Write out everything queued and stop the worker
+	def stop(self, timeout=10):
+		with self._cond:
+			self._stopping = True
+			self._cond.notify_all()
+		self._thread.join(timeout)
+
+	# Return a JSON-friendly summary
+	def to_dict(self):
+		with self._stats_lock:
+			return {'policy': self._policy,
+					'max_depth': self._max_depth,
+					'depth': len(self._records),
+					'max_depth_seen': self.max_depth_seen,
+					'num_written': self.num_written,
+					'num_dropped': self.num_dropped,
+					'num_errors': self.num_errors,
+					'blocked_time': self.blocked_time,
+					'lag': self.lag.to_dict()}
+
+# Start queueing logger calls (see LogQueue for the arguments)
+def start(max_depth=100000, policy=POLICY_BLOCK, batch_time=0.05):
+
+	global active
+
+	if active is None:
+		active = LogQueue(max_depth, policy, batch_time)
+		atexit.register(stop)
+	return active
+
+# Write out everything queued, then call loggers directly again
+def stop():
+
+	global active
+
+	q = active
+	active = None
+	if q is not None:
+		q.stop()
+
+# Return a summary of the running queue, or None
+def to_dict():
+	q = active
+	if q is None:
+		return None
+	return q.to_dict()
@@ -4,6 +4,9 @@ Logger base class
 
 class Logger():
 	
+	# Lets subclasses use __slots__
+	__slots__ = ()
+	
 	# value:		The current value to save. This is typically a 
 	#				floating point number, but that is not guaranteed.
 	#				Strings, NaNs, None, etc are valid inputs.		 
@@ -20,4 +23,18 @@ class Logger():
 	
 	def log(self, sensor_name, sensor_type, value, update_time, sync_num = None):
 		raise NotImplementedError()
+	
+	# Log a frame of values that share one update_time and sync_num.
+	# entries:		A list of (sensor_name, sensor_type, value) tuples
+	# The default calls log() for each value.  Override this when a
+	# whole frame can be stored more cheaply than value by value.
+	def log_frame(self, entries, update_time, sync_num = None):
+		for sensor_name, sensor_type, value in entries:
+			self.log(sensor_name, sensor_type, value, update_time, sync_num)
 		
+	
+	# Write out anything held back for later (such as the last value
+	# skipped by a deadband).  Called at shutdown, the default does
+	# nothing.
+	def flush(self):
+		pass
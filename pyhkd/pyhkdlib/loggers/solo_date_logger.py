@@ -1,10 +1,30 @@
 '''
 Logs values for a single sensor in a date-based folder structure
+
+With a deadband or max_interval, a value is only written when it moves
+more than the deadband from the last written value, or when max_interval
+has passed since the last write.  The last skipped value is written just
+before a change so readers that draw straight lines between points show
+a held value and a step.  The first value of each day is always written
+and the last skipped value is written before the file changes (or by
+flush() at shutdown), so every day's file stands on its own.
+
+With a bin_time, values are collected into bins of that many seconds
+(aligned to multiples of bin_time) and each bin is written once, at its
+center time.  The mean of the bin goes to the usual file, and other
+statistics (min, max, std and count by default) go to sibling files
+named after the sensor, e.g. "T1.max.txt".  Those show up as separate
+values in the viewers, so the envelope of a noisy channel can be plotted
+next to its mean.  The partial bin is written by flush() at shutdown.
+
+The files are text ("T1.txt", a line of time, value and optional sync
+number per value), binary ("T1.bin", see pyhkdremote.binlog) or both,
+depending on file_format.
 '''
 
 import time
+import threading
 import urllib.request, urllib.parse, urllib.error
-import datetime
 import os
 import logging
 import numpy as np
@@ -16,15 +36,90 @@ except ImportError:
 	from scipy.stats import nanmedian
 
 from .logger import Logger
+from .. import clock
+from .. import file_writer
+from .. import file_pool
+from .. import rollover
+from pyhkdremote import binlog
 
 class SoloDateLogger(Logger):
 
+	# One of these exists per logged sensor, so skip the instance dict
+	__slots__ = ['_sensor_type', '_sensor_name', '_base_folder', '_fileobj', '_downsample', '_buffer', '_next_buf', '_ds_func',
+				 '_esc_sensor_type', '_esc_sensor_name', '_alias', '_last_filename_update', '_filedir', '_filename', '_filename_alias',
+				 '_deadband', '_max_interval', '_last_value', '_last_time', '_held',
+				 '_bin_time', '_bin_stats', '_bin_n', '_bin_count', '_bin_mean', '_bin_m2', '_bin_min', '_bin_max', '_bin_start', '_stat_files',
+				 '_text', '_binary', '_bin_files', '_open_failed', '_day_start', '_next_midnight', '_next', '__weakref__']
+	
+	# Statistics that can be written for each bin, besides the mean
+	BIN_STATS = ['min', 'max', 'std', 'count']
+	
+	# Added to the name of an existing file in the place of a binary log
+	# file that can't be appended to
+	INVALID_SUFFIX = '.invalid'
+	
+	# Guards swapping the prepared files in and out of _next.  Only held
+	# for the swap, so one is shared by every logger.
+	_next_lock = threading.Lock()
+	
+	FORMAT_TEXT = 'text'
+	FORMAT_BINARY = 'binary'
+	FORMAT_BOTH = 'both'
+	VALID_FORMATS = [FORMAT_TEXT, FORMAT_BINARY, FORMAT_BOTH]
+
 	# base_folder: location of the date-sorted log structure
 	# sensor_type: string name of the sensor type (used for folder names)
-	def __init__(self, base_folder, sensor_type, sensor_name, alias = None, downsample = 1):
+	# deadband: smallest change from the last written value to write,
+	#	or None to write every value (0 writes any change)
+	# max_interval: longest time in seconds between written values, or
+	#	None for no limit
+	# bin_time: length in seconds of the time bins, or None to write
+	#	each (downsampled) value
+	# bin_stats: list of statistics from BIN_STATS written to sibling
+	#	files for each bin (all of them by default)
+	# file_format: one of VALID_FORMATS
+	def __init__(self, base_folder, sensor_type, sensor_name, alias = None, downsample = 1, deadband = None, max_interval = None,
+				 bin_time = None, bin_stats = None, file_format = FORMAT_TEXT):
 		
 		assert downsample >= 1, "The downsample value must be >=1 samples, was given " + str(downsample)
 		assert int(downsample) == downsample, "The downsample factor should be an integer number of samples, was given " + str(downsample)
+		assert deadband is None or deadband >= 0, "The deadband should be >= 0, was given " + str(deadband)
+		assert max_interval is None or max_interval > 0, "The max_interval should be > 0 seconds, was given " + str(max_interval)
+		assert bin_time is None or bin_time > 0, "The bin_time should be > 0 seconds, was given " + str(bin_time)
+		assert bin_time is None or (downsample == 1 and deadband is None and max_interval is None), "The bin_time can't be combined with downsample, deadband or max_interval"
+		assert file_format in self.VALID_FORMATS, "Unknown log file format " + repr(file_format) + ", should be one of " + repr(self.VALID_FORMATS)
+		
+		self._text = file_format in [self.FORMAT_TEXT, self.FORMAT_BOTH]
+		self._binary = file_format in [self.FORMAT_BINARY, self.FORMAT_BOTH]
+		# stat (None for the main file) -> binary file object
+		self._bin_files = {}
+		self._open_failed = False
+		# Files of the next day opened by prepare_day(), see _open_day()
+		self._next = None
+		
+		if bin_stats is None:
+			bin_stats = self.BIN_STATS if bin_time is not None else []
+		for stat in bin_stats:
+			assert stat in self.BIN_STATS, "Unknown bin statistic " + repr(stat) + ", should be one of " + repr(self.BIN_STATS)
+		
+		# Running statistics of the current bin (see _add_to_bin), so
+		# long bins of fast channels take no more memory
+		self._bin_time = bin_time
+		self._bin_stats = list(bin_stats)
+		self._bin_start = None
+		self._reset_bin()
+		# stat -> file object for the sibling files
+		self._stat_files = {}
+		
+		# Only writing some values if either is given
+		if deadband is None and max_interval is not None:
+			deadband = 0.0
+		self._deadband = deadband
+		self._max_interval = max_interval
+		self._last_value = None
+		self._last_time = None
+		# (update_time, value, sync_num) of the last skipped value
+		self._held = None
 
 		self._sensor_type = sensor_type
 		self._sensor_name = sensor_name
@@ -51,48 +146,183 @@ class SoloDateLogger(Logger):
 			self._alias = None
 			
 		self._open_current_file()
+		rollover.loggers.add(self)
 	
 	def __del__(self):
+		
+		# Write out the partial bin
+		try:
+			self._flush_bin()
+		except Exception:
+			pass
 					
-		if self._fileobj is not None:
-			self._fileobj.close()
-			
-	def _open_current_file(self):
+		for fileobj in self._current_files():
+			file_writer.close(fileobj)
+		nxt = self._next
+		if nxt is not None:
+			for fileobj in nxt.fileobjs():
+				file_writer.close(fileobj)
+	
+	# Open (or create) a log file for appending, returns None if it fails
+	def _open(self, filename, alias_filename = None):
 		
-		d = datetime.date.today()
-		self._last_filename_update = d
+		if filename.endswith(binlog.EXTENSION) and not self._repair_binary(filename):
+			return None
 		
-		self._filedir = os.path.join(self._base_folder, 
-									 "%04d" % d.year,
-									 "%02d" % d.month,
-									 "%02d" % d.day,
-									 self._esc_sensor_type)
+		try:
+			pool = file_pool.active
+			if pool is not None:
+				fileobj = pool.open(filename)
+			else:
+				# Unbuffered, so each line (or batch of lines from the
+				# file_writer) is one write without holding a buffer
+				# per open file
+				fileobj = open(filename, 'ab', buffering=0)
+			logging.info("Opening log file: " + filename)
+		except OSError as e:
+			# Values are dropped until it opens, so make some noise
+			logging.error("Failed to open log file: %s (%s)" % (filename, e.strerror))
+			return None
+		
+		# New binary files start with the header
+		if filename.endswith(binlog.EXTENSION) and fileobj.tell() == 0:
+			fileobj.write(binlog.header())
+		
+		if alias_filename is not None:
+			try:
+				os.symlink(os.path.basename(filename), alias_filename)
+			except OSError:
+				pass
+		
+		return fileobj
+			
+	# Get an existing binary file ready to be appended to (see
+	# binlog.repair).  One that isn't a binary log file of this version
+	# is renamed with INVALID_SUFFIX to start a new one.  Returns False
+	# if the file can't be used.
+	def _repair_binary(self, filename):
 		
 		try:
-			os.makedirs(self._filedir)
-		except OSError:
-			pass
+			cut = binlog.repair(filename)
+			if cut is None:
+				logging.error("Not a binary log file of this version, renaming it to %s: %s" % (self.INVALID_SUFFIX, filename))
+				os.replace(filename, filename + self.INVALID_SUFFIX)
+			elif cut > 0:
+				logging.warning("Dropped %i bytes of a partly written record at the end of %s" % (cut, filename))
+		except OSError as e:
+			logging.error("Failed to open log file: %s (%s)" % (filename, e.strerror))
+			return False
+		return True
+	
+	# The open files of the current day
+	def _current_files(self):
+		files = [self._fileobj] + list(self._stat_files.values()) + list(self._bin_files.values())
+		return [f for f in files if f is not None]
+	
+	# Create the folder of day 'd' and open its files, without touching
+	# the current ones
+	def _open_day(self, d):
 		
-		self._filename = os.path.join(self._filedir,
-									  self._esc_sensor_name + ".txt")
-									 
-		if self._fileobj is not None:
-			self._fileobj.close()
+		day = _Day()
+		day.date = d
+		day.start, day.end = rollover.day_bounds(d)
+		day.filedir = os.path.join(self._base_folder, 
+								   "%04d" % d.year,
+								   "%02d" % d.month,
+								   "%02d" % d.day,
+								   self._esc_sensor_type)
 		
 		try:
-			# Open in text mode with line buffering
-			self._fileobj = open(self._filename, 'a', buffering=1)
-			logging.info("Opening log file: " + self._filename)
+			os.makedirs(day.filedir)
 		except OSError:
-			self._fileobj = None
-			logging.info("Failed to open log file: " + self._filename)
+			pass
 		
+		day.filename = os.path.join(day.filedir, self._esc_sensor_name + ".txt")
+		day.filename_alias = None
 		if self._alias is not None:
-			self._filename_alias = os.path.join(self._filedir, self._alias + ".txt")
-			try:
-				os.symlink(self._esc_sensor_name + ".txt", self._filename_alias)
-			except OSError:
-				pass
+			day.filename_alias = os.path.join(day.filedir, self._alias + ".txt")
+		
+		# The main file, and sibling files for the bin statistics
+		for stat in [None] + self._bin_stats:
+			
+			stem = self._esc_sensor_name if stat is None else self._esc_sensor_name + "." + stat
+			alias_stem = None
+			if self._alias is not None:
+				alias_stem = self._alias if stat is None else self._alias + "." + stat
+			
+			for ext, opened in [(".txt", self._text), (binlog.EXTENSION, self._binary)]:
+				
+				if not opened:
+					continue
+				
+				alias_filename = None
+				if alias_stem is not None:
+					alias_filename = os.path.join(day.filedir, alias_stem + ext)
+				fileobj = self._open(os.path.join(day.filedir, stem + ext), alias_filename)
+				
+				if ext == binlog.EXTENSION:
+					day.bin_files[stat] = fileobj
+				elif stat is None:
+					day.fileobj = fileobj
+				else:
+					day.stat_files[stat] = fileobj
+		
+		# Try again with the next value
+		day.open_failed = (self._text and day.fileobj is None) or (self._binary and day.bin_files.get(None) is None)
+		
+		return day
+	
+	# Open the files of day 'd' ahead of time, to be switched to by the
+	# first value of that day.  Called by the rollover manager thread.
+	def prepare_day(self, d):
+		
+		if d <= self._last_filename_update:
+			return
+		day = self._open_day(d)
+		
+		# Unless the logger got to day 'd' first, replace any files
+		# prepared before
+		with self._next_lock:
+			if d > self._last_filename_update:
+				day, self._next = self._next, day
+		if day is not None:
+			for fileobj in day.fileobjs():
+				file_writer.close(fileobj)
+	
+	# Switch to the files of the current day, opening them unless they
+	# were prepared
+	def _open_current_file(self):
+		
+		d = clock.today()
+		
+		with self._next_lock:
+			nxt, self._next = self._next, None
+			self._last_filename_update = d
+		if nxt is not None and (nxt.date != d or nxt.open_failed):
+			for fileobj in nxt.fileobjs():
+				file_writer.close(fileobj)
+			nxt = None
+		if nxt is None:
+			nxt = self._open_day(d)
+		
+		old_files = self._current_files()
+		
+		self._day_start = nxt.start
+		self._next_midnight = nxt.end
+		self._filedir = nxt.filedir
+		self._filename = nxt.filename
+		self._filename_alias = nxt.filename_alias
+		self._fileobj = nxt.fileobj
+		self._stat_files = nxt.stat_files
+		self._bin_files = nxt.bin_files
+		self._open_failed = nxt.open_failed
+		
+		# Values already queued in the file_writer are written first
+		rollover.retire(old_files, file_writer.close)
+	
+	# True if the files aren't for the current day (or failed to open)
+	def _need_new_file(self):
+		return self._open_failed or not (self._day_start <= clock.now() < self._next_midnight)
 
 	# Implements Logger.log, see base class for argument descriptions
 	def log(self, sensor_name, sensor_type, value, update_time, sync_num = None):
@@ -106,6 +336,10 @@ class SoloDateLogger(Logger):
 		if value is None:
 			value = np.nan
 		
+		if self._bin_time is not None:
+			self._add_to_bin(value, update_time)
+			return
+		
 		# Downsample if need be
 		if self._downsample > 1:
 			
@@ -127,21 +361,164 @@ class SoloDateLogger(Logger):
 				return
 
 		# Make sure we don't need to open a new file
-		if self._last_filename_update != datetime.date.today() or self._fileobj is None:
+		new_file = False
+		if self._need_new_file():
+			# Finish the old day with the value it was holding
+			if self._held is not None:
+				self._write(*self._held)
+				self._held = None
 			self._open_current_file()
+			new_file = True
 		
-		to_write = '%.3f\t' % (update_time,)
+		if self._deadband is not None:
+			
+			changed = new_file or self._last_time is None or self._changed(value)
+			
+			if not changed and (self._max_interval is None or (update_time - self._last_time) < self._max_interval):
+				self._held = (update_time, value, sync_num)
+				return
+			
+			# Show the old value held right up to the change
+			if changed and self._held is not None:
+				self._write(*self._held)
+			self._held = None
+			
+			self._last_value = value
+			self._last_time = update_time
+		
+		self._write(update_time, value, sync_num)
+	
+	# Write the last value skipped by the deadband, so the file shows it
+	# held until the end, and the partial bin.  Implements Logger.flush
+	def flush(self):
+		
+		if self._held is not None:
+			self._write(*self._held)
+			self._held = None
+		
+		if self._bin_time is not None:
+			self._flush_bin()
+	
+	# Returns True if 'value' is outside the deadband of the last
+	# written value
+	def _changed(self, value):
+		
+		last = self._last_value
 		
 		try:
-			to_write += '%0.8g' % value
+			# NaN to NaN is no change, NaN to a number always is
+			if value != value or last != last:
+				return (value == value) or (last == last)
+			return abs(value - last) > self._deadband
 		except TypeError:
-			to_write += str(value)
+			# Not a number
+			return value != last
+	
+	# Write a value to the main files, or to the sibling files of a bin
+	# statistic
+	def _write(self, update_time, value, sync_num, stat = None):
 		
-		if sync_num is not None:
-			to_write += '\t%i' % (sync_num,)	
+		if self._text:
+			
+			to_write = '%.3f\t' % (update_time,)
 			
-		to_write += '\n'
+			try:
+				to_write += '%0.8g' % value
+			except TypeError:
+				to_write += str(value)
+			
+			if sync_num is not None:
+				to_write += '\t%i' % (sync_num,)	
+				
+			to_write += '\n'
+			
+			fileobj = self._fileobj if stat is None else self._stat_files.get(stat)
+			if fileobj is not None:
+				file_writer.write(fileobj, to_write.encode())
+		
+		if self._binary:
+			fileobj = self._bin_files.get(stat)
+			if fileobj is not None:
+				file_writer.write(fileobj, binlog.pack(update_time, value, sync_num))
+	
+	# Add a value to the current time bin, writing out the previous bin
+	# first if this value is past its end
+	def _add_to_bin(self, value, update_time):
+		
+		if self._bin_start is not None and not (self._bin_start <= update_time < self._bin_start + self._bin_time):
+			self._flush_bin()
+		
+		if self._bin_start is None:
+			self._bin_start = update_time - (update_time % self._bin_time)
+		
+		self._bin_n += 1
+		
+		try:
+			value = float(value)
+		except (TypeError, ValueError):
+			return
+		if value != value:
+			return
 		
-		if self._fileobj is not None:
-			self._fileobj.write(to_write)
+		# Welford's update of the mean and sum of squared differences
+		self._bin_count += 1
+		delta = value - self._bin_mean
+		self._bin_mean += delta / self._bin_count
+		self._bin_m2 += delta * (value - self._bin_mean)
+		if value < self._bin_min:
+			self._bin_min = value
+		if value > self._bin_max:
+			self._bin_max = value
+	
+	# Start the statistics of a bin over
+	def _reset_bin(self):
+		# Values added, and those that weren't NaN
+		self._bin_n = 0
+		self._bin_count = 0
+		self._bin_mean = 0.0
+		self._bin_m2 = 0.0
+		self._bin_min = np.inf
+		self._bin_max = -np.inf
+	
+	# Write the statistics of the current bin and start a new one
+	def _flush_bin(self):
+		
+		n = self._bin_n
+		bin_start = self._bin_start
+		count = self._bin_count
+		stats = {'count': count}
+		if count > 0:
+			stats['mean'] = self._bin_mean
+			stats['min'] = self._bin_min
+			stats['max'] = self._bin_max
+			stats['std'] = np.sqrt(self._bin_m2 / count)
+		else:
+			stats['mean'] = stats['min'] = stats['max'] = stats['std'] = np.nan
+		
+		self._reset_bin()
+		self._bin_start = None
+		if n == 0:
+			return
+		
+		if self._need_new_file():
+			self._open_current_file()
+		
+		bin_center = bin_start + 0.5 * self._bin_time
+		self._write(bin_center, stats['mean'], None)
+		for stat in self._bin_stats:
+			self._write(bin_center, stats[stat], None, stat)
 
+# The files of one day, opened by SoloDateLogger._open_day()
+class _Day:
+	
+	__slots__ = ['date', 'start', 'end', 'filedir', 'filename', 'filename_alias', 'fileobj', 'stat_files', 'bin_files', 'open_failed']
+	
+	def __init__(self):
+		self.fileobj = None
+		self.stat_files = {}
+		self.bin_files = {}
+		self.open_failed = False
+	
+	def fileobjs(self):
+		files = [self.fileobj] + list(self.stat_files.values()) + list(self.bin_files.values())
+		return [f for f in files if f is not None]
@@ -115,53 +115,83 @@ class SyncFrameLogger(Logger):
 			return
 			
 		with self._lock:
+			self._store(sensor_name, sensor_type, sen_index, value, sync_num)
+	
+	# Implements Logger.log_frame, taking the lock once for the whole
+	# frame
+	def log_frame(self, entries, update_time, sync_num = None):
+		
+		values = []
+		for sensor_name, sensor_type, value in entries:
+			sen_index = self._indexes.get((sensor_name, sensor_type), None)
+			if sen_index is None:
+				continue
+			try:
+				values.append((sensor_name, sensor_type, sen_index, float(value)))
+			except:
+				logging.warning("SyncFrameLogger failed to save non-float value for sensor " + str((sensor_name, sensor_type)) + ": " + str(value))
+		
+		if len(values) == 0:
+			return
+		
+		if sync_num is None:
+			logging.warning("Failed to store a frame without sync number in SyncFrameLogger. Sensors: " + str([v[:2] for v in values]))
+			return
+		
+		with self._lock:
+			for sensor_name, sensor_type, sen_index, value in values:
+				self._store(sensor_name, sensor_type, sen_index, value, sync_num)
+	
+	# Store a value in the buffers, saving or rebasing them as needed.
+	# Assumes the caller holds self._lock
+	def _store(self, sensor_name, sensor_type, sen_index, value, sync_num):
+		
+		if self._base_sync is None:
+			self._base_sync = self._compute_base(sync_num)
+		
+		delta = (sync_num - self._base_sync)
+		
+		# Index of the file buffer the sync num appears in.
+		# The oldest file buffer is 0, the newest is 
+		# self._buffer_count - 1.  The next new one to be added
+		# is self._buffer_count.  Anything below 0 is too late to
+		# save.
+		buf = int(delta // self._frame_count)
+		
+		# Position offset within the buffer
+		pos = int(delta % self._frame_count)
+		
+		if buf < -10:
 			
-			if self._base_sync is None:
-				self._base_sync = self._compute_base(sync_num)
+			logging.info("SyncFrameLogger is rebasing to accomodate a far past sync number from sensor " + str((sensor_name, sensor_type)) + ": " + str(sync_num))
 			
-			delta = (sync_num - self._base_sync)
+			for n in range(self._buffer_count):
+				self._save_oldest()
+			self._base_sync = self._compute_base(sync_num)
 			
-			# Index of the file buffer the sync num appears in.
-			# The oldest file buffer is 0, the newest is 
-			# self._buffer_count - 1.  The next new one to be added
-			# is self._buffer_count.  Anything below 0 is too late to
-			# save.
-			buf = int(delta // self._frame_count)
+		elif buf < 0:
 			
-			# Position offset within the buffer
-			pos = int(delta % self._frame_count)
+			logging.warning("SyncFrameLogger found an skipped a late sync number for sensor " + str((sensor_name, sensor_type)) + ": " + str(sync_num))
+			return
 			
-			if buf < -10:
-				
-				logging.info("SyncFrameLogger is rebasing to accomodate a far past sync number from sensor " + str((sensor_name, sensor_type)) + ": " + str(sync_num))
+		elif buf >= self._buffer_count:
+			
+			# Value is in a future buffer, figure out where
+			num_to_flush = buf - self._buffer_count + 1
+			
+			# Save as many buffers as we need, but cap at saving
+			# all of the buffers we have
+			for n in range(min(num_to_flush, self._buffer_count)):
+				self._save_oldest()
 				
-				for n in range(self._buffer_count):
-					self._save_oldest()
+			# We flushed everything, rebase at the new sync num
+			if num_to_flush > self._buffer_count:
+				logging.info("SyncFrameLogger is rebasing to accomodate a far future sync number from sensor " + str((sensor_name, sensor_type)) + ": " + str(sync_num))
 				self._base_sync = self._compute_base(sync_num)
-				
-			elif buf < 0:
-				
-				logging.warning("SyncFrameLogger found an skipped a late sync number for sensor " + str((sensor_name, sensor_type)) + ": " + str(sync_num))
-				return
-				
-			elif buf >= self._buffer_count:
-				
-				# Value is in a future buffer, figure out where
-				num_to_flush = buf - self._buffer_count + 1
-				
-				# Save as many buffers as we need, but cap at saving
-				# all of the buffers we have
-				for n in range(min(num_to_flush, self._buffer_count)):
-					self._save_oldest()
-					
-				# We flushed everything, rebase at the new sync num
-				if num_to_flush > self._buffer_count:
-					logging.info("SyncFrameLogger is rebasing to accomodate a far future sync number from sensor " + str((sensor_name, sensor_type)) + ": " + str(sync_num))
-					self._base_sync = self._compute_base(sync_num)
-				
-			# Recompute in case we had to rebase
-			buf = int((sync_num - self._base_sync) // self._frame_count)
+			
+		# Recompute in case we had to rebase
+		buf = int((sync_num - self._base_sync) // self._frame_count)
 		
-			# Save
-			self._file_stack[buf][pos,sen_index] = value
-					
+		# Save
+		self._file_stack[buf][pos,sen_index] = value
+				
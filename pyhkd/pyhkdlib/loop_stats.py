@@ -0,0 +1,311 @@
+'''
+Rolling statistics on the health of the instrument update loop.  For
+every instrument, this tracks how long update_periodic() takes, the
+achieved period between updates compared to wait_time, and how late
+each update started compared to when it was due.
+
+Usage:
+	- Create a LoopStats and call attach() with each instrument
+	- Call check_overdue() now and then from a thread that isn't
+	  blocked by the updates, so instruments that stop updating count
+	  missed deadlines too
+	- Call to_dict() for a summary, or export() to write it to a file
+	- Optionally call start_export() to export periodically
+'''
+
+import os
+import json
+import math
+import time
+import logging
+import threading
+
+from . import clock
+
+# A histogram with log-spaced bins covering the last one to two
+# windows of samples.  Counts are kept for the current and previous
+# window, and the previous window is dropped each time a new one
+# starts.
+class RollingHistogram:
+
+	# 'min_value', 'max_value'	Range covered by the log-spaced bins (values
+	#							outside go into the underflow/overflow bins)
+	# 'bins_per_decade'			Bin resolution
+	# 'window'					Length of each window in seconds
+	def __init__(self, min_value=1e-4, max_value=1e3, bins_per_decade=5, window=600):
+
+		assert 0 < min_value < max_value, "RollingHistogram needs 0 < min_value < max_value"
+
+		self._log_min = math.log10(min_value)
+		self._bins_per_decade = bins_per_decade
+		self._window = window
+
+		# Bin 0 is underflow, the last bin is overflow
+		num_bins = int(math.ceil((math.log10(max_value) - self._log_min) * bins_per_decade)) + 2
+		self.edges = [min_value * 10**(i / bins_per_decade) for i in range(num_bins - 1)]
+
+		self._window_start = None
+		self._current = self._empty()
+		self._previous = self._empty()
+
+	def _empty(self):
+		return {'counts': [0] * (len(self.edges) + 1), 'n': 0, 'sum': 0.0, 'max': float('-inf'), 'min': float('inf')}
+
+	# Return the bin index for a value
+	def _bin(self, value):
+		if value <= 0:
+			return 0
+		i = int(math.floor((math.log10(value) - self._log_min) * self._bins_per_decade)) + 1
+		return min(max(i, 0), len(self.edges))
+
+	# Add a new sample
+	def add(self, value, now=None):
+
+		if now is None:
+			now = clock.now()
+
+		if self._window_start is None:
+			self._window_start = now
+		elif (now - self._window_start) > self._window:
+			self._previous = self._current
+			self._current = self._empty()
+			self._window_start = now
+
+		w = self._current
+		w['counts'][self._bin(value)] += 1
+		w['n'] += 1
+		w['sum'] += value
+		w['max'] = max(w['max'], value)
+		w['min'] = min(w['min'], value)
+
+	# Return the combined counts of the current and previous windows
+	@property
+	def counts(self):
+		return [a + b for a, b in zip(self._previous['counts'], self._current['counts'])]
+
+	# Return the approximate value below which a fraction 'q' of the
+	# samples fall (the upper edge of the bin containing it, but no more
+	# than the largest sample), or None if there are no samples
+	def quantile(self, q):
+
+		counts = self.counts
+		total = sum(counts)
+		if total < 1:
+			return None
+
+		cumulative = 0
+		for i, c in enumerate(counts):
+			cumulative += c
+			if cumulative >= q * total and i < len(self.edges):
+				return min(self.edges[i], self.max)
+
+		return self.max
+
+	@property
+	def n(self):
+		return self._previous['n'] + self._current['n']
+
+	@property
+	def mean(self):
+		n = self.n
+		if n < 1:
+			return None
+		return (self._previous['sum'] + self._current['sum']) / n
+
+	@property
+	def max(self):
+		if self.n < 1:
+			return None
+		return max(self._previous['max'], self._current['max'])
+
+	@property
+	def min(self):
+		if self.n < 1:
+			return None
+		return min(self._previous['min'], self._current['min'])
+
+	# Return a JSON-friendly summary
+	def to_dict(self, include_counts=False):
+		d = {'n': self.n, 'mean': self.mean, 'min': self.min, 'max': self.max,
+			 'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99)}
+		if include_counts:
+			d['edges'] = self.edges
+			d['counts'] = self.counts
+		return d
+
+# The loop statistics for a single instrument.  Filled in by
+# Instrument.update() each time update_periodic() runs.
+class InstrumentLoopStats:
+
+	# Log missed deadlines at most this often
+	MISS_LOG_INTERVAL = 60 # seconds
+
+	# 'wait_time', 'max_interval'	As the instrument's, if known before
+	#								the first update
+	def __init__(self, name, window=600, wait_time=None, max_interval=None):
+
+		self.name = name
+		self._lock = threading.Lock()
+
+		self.duration = RollingHistogram(window=window)
+		self.period = RollingHistogram(window=window)
+		self.lag = RollingHistogram(window=window)
+
+		self.wait_time = wait_time
+		self.max_interval = max_interval
+		self.num_updates = 0
+		self.deadline_misses = 0
+		self._created = clock.now()
+		self._last_start = None
+		self._last_miss_log = 0
+		self._unlogged_misses = 0
+		# The start time (or _created) of the gap already counted as a
+		# miss by check_overdue()
+		self._overdue_counted = None
+
+	# Record one update_periodic() call.  'due_time' is when the update
+	# was scheduled, 'start_time' and 'end_time' bracket the call.  If
+	# 'max_interval' is given, a longer gap since the previous call
+	# counts as a missed deadline.
+	def record(self, due_time, start_time, end_time, wait_time, max_interval=None):
+
+		with self._lock:
+
+			self.wait_time = wait_time
+			self.max_interval = max_interval
+			self.num_updates += 1
+
+			self.duration.add(end_time - start_time, end_time)
+			self.lag.add(max(start_time - due_time, 0), end_time)
+			if self._last_start is not None:
+				interval = start_time - self._last_start
+				self.period.add(interval, end_time)
+				if max_interval is not None and interval > max_interval and self._overdue_counted != self._last_start:
+					self._count_miss(end_time, "last gap %0.2f sec" % interval)
+			self._last_start = start_time
+
+	# Count a missed deadline, logging now and then.  Called with _lock
+	# held.
+	def _count_miss(self, now, detail):
+
+		self.deadline_misses += 1
+		self._unlogged_misses += 1
+
+		if (now - self._last_miss_log) > self.MISS_LOG_INTERVAL:
+			logging.warning("Instrument %s missed its %0.2f sec update deadline %i time(s) (%s)" % (self.name, self.max_interval, self._unlogged_misses, detail))
+			self._last_miss_log = now
+			self._unlogged_misses = 0
+
+	# Count a missed deadline if the instrument hasn't started an update
+	# within max_interval (once per gap), for instruments that are stuck
+	# in an update or never get to run
+	def check_overdue(self, now=None):
+
+		if now is None:
+			now = clock.now()
+
+		with self._lock:
+
+			if self.max_interval is None:
+				return
+
+			since = self._last_start if self._last_start is not None else self._created
+			if since == self._overdue_counted or (now - since) <= self.max_interval:
+				return
+
+			self._overdue_counted = since
+			self._count_miss(now, "no update for %0.2f sec" % (now - since))
+
+	# Return a JSON-friendly summary
+	def to_dict(self, include_counts=False):
+
+		with self._lock:
+
+			d = {'wait_time': self.wait_time,
+				 'max_interval': self.max_interval,
+				 'num_updates': self.num_updates,
+				 'deadline_misses': self.deadline_misses,
+				 'last_update': self._last_start,
+				 'duration': self.duration.to_dict(include_counts),
+				 'period': self.period.to_dict(include_counts),
+				 'lag': self.lag.to_dict(include_counts)}
+
+		# Achieved period relative to the configured one
+		if d['period']['mean'] is not None and self.wait_time:
+			d['period_ratio'] = d['period']['mean'] / self.wait_time
+		else:
+			d['period_ratio'] = None
+
+		return d
+
+# Loop statistics for all instruments
+class LoopStats:
+
+	def __init__(self, window=600):
+
+		self._window = window
+		self._stats = {}
+		self._names = {}
+		self._export_thread = None
+
+	# Start recording statistics for an instrument
+	def attach(self, inst):
+
+		# Give instruments of the same type distinct names
+		name = inst.BOX_TYPE
+		n = self._names.get(name, 0)
+		self._names[name] = n + 1
+		if n > 0:
+			name = "%s.%i" % (name, n)
+
+		stats = InstrumentLoopStats(name, self._window, inst.wait_time, inst.max_interval)
+		self._stats[name] = stats
+		inst.loop_stats = stats
+
+	# Return the statistics for a single instrument, or None
+	def get(self, name):
+		return self._stats.get(name, None)
+
+	# Return a JSON-friendly summary of all (or one) instruments
+	def to_dict(self, name=None, include_counts=False):
+
+		if name is not None:
+			stats = self.get(name)
+			if stats is None:
+				return {}
+			return {name: stats.to_dict(include_counts)}
+
+		return {n: s.to_dict(include_counts) for n, s in self._stats.items()}
+
+	# Count the missed deadlines of instruments that are overdue
+	def check_overdue(self, now=None):
+		for s in list(self._stats.values()):
+			s.check_overdue(now)
+
+	# Write the summary (with histogram counts) to a JSON file
+	def export(self, filename):
+
+		d = {'time': clock.now(), 'instruments': self.to_dict(include_counts=True)}
+
+		# Write and rename so readers never see a partial file
+		tmp_filename = filename + '.tmp'
+		with open(tmp_filename, 'w') as f:
+			json.dump(d, f, indent=1)
+		os.replace(tmp_filename, filename)
+
+	# Export to 'filename' every 'period' seconds from a daemon thread
+	def start_export(self, filename, period=60):
+
+		def export_loop():
+			while True:
+				time.sleep(period)
+				# In case the update loop itself is stuck
+				self.check_overdue()
+				try:
+					self.export(filename)
+				except (OSError, ValueError) as e:
+					logging.error("Failed to export loop statistics to %s: %s" % (filename, str(e)))
+
+		self._export_thread = threading.Thread(target=export_loop, name="Loop Stats Export")
+		self._export_thread.daemon = True
+		self._export_thread.start()
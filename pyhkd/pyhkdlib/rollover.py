@@ -0,0 +1,197 @@
+'''
+Prepares the log files of the next day ahead of midnight, so loggers
+don't all create folders, open files and make symlinks at the same
+instant.  Every SoloDateLogger registers itself here.  Once started,
+the manager thread wakes lead_time seconds before local midnight and
+has each logger create and open its files for the next day.  Loggers
+check for a new day by comparing the time with the bounds of their
+current day, and at the first value past midnight swap in the prepared
+files.  The old files are handed back to be closed by the manager
+retire_delay seconds later, off the logging path, which also covers
+loggers that only switch on a value long after midnight.
+
+Without a running manager, loggers open the new day's files and close
+the old ones themselves, as before.
+
+Usage:
+	- Call start() once at startup, and stop() at shutdown before the
+	  file_writer
+	- Call flush_loggers() at shutdown, once the log queue is stopped and
+	  before the file_writer, to write out the values loggers hold back
+'''
+
+import time
+import datetime
+import logging
+import threading
+import weakref
+import collections
+
+from . import clock
+
+# The running RolloverManager, or None
+active = None
+
+# Every SoloDateLogger, prepared by the manager before midnight
+loggers = weakref.WeakSet()
+
+# Returns the epoch times of the start of local day 'd' and of the next
+# day
+def day_bounds(d):
+	start = datetime.datetime.combine(d, datetime.time()).timestamp()
+	end = datetime.datetime.combine(d + datetime.timedelta(days=1), datetime.time()).timestamp()
+	return start, end
+
+# Close 'fileobjs' (replaced by a new day's files), soon if the manager
+# is running or now if it isn't
+def retire(fileobjs, close_func):
+	m = active
+	if m is None:
+		for f in fileobjs:
+			close_func(f)
+	else:
+		m.retire(fileobjs, close_func)
+
+# Flush every logger (see Logger.flush)
+def flush_loggers():
+	for logger in list(loggers):
+		try:
+			logger.flush()
+		except Exception as e:
+			logging.error("Failed to flush %s: %s" % (logger, repr(e)))
+
+class RolloverManager:
+
+	# 'lead_time'		Seconds before midnight to prepare the next day
+	# 'retire_delay'	Seconds after a logger switches files to close the
+	#					old ones
+	def __init__(self, lead_time=60, retire_delay=10):
+
+		assert lead_time > 0 and retire_delay >= 0
+
+		self._lead_time = lead_time
+		self._retire_delay = retire_delay
+		self._stop_event = threading.Event()
+
+		# Set to have the thread look at the retired files again
+		self._wake = threading.Event()
+
+		# (close time, fileobjs, close_func) of the replaced files, in the
+		# order they were replaced
+		self._retired = collections.deque()
+
+		self._stats_lock = threading.Lock()
+		self.num_prepared = 0
+		self.num_failed = 0
+		self.prepare_time = None
+		self.last_rollover = None
+
+		self._thread = threading.Thread(target=self._run, name="Rollover")
+		self._thread.daemon = True
+		self._thread.start()
+
+	def retire(self, fileobjs, close_func):
+		self._retired.append((clock.now() + self._retire_delay, fileobjs, close_func))
+		self._wake.set()
+
+	def _run(self):
+
+		# The last day prepared
+		prepared = None
+
+		while not self._stop_event.is_set():
+
+			tomorrow = clock.today() + datetime.timedelta(days=1)
+			prepare_time = day_bounds(tomorrow)[0] - self._lead_time
+			now = clock.now()
+
+			if prepared != tomorrow and now >= prepare_time:
+				self.prepare(tomorrow)
+				prepared = tomorrow
+				continue
+
+			self.close_retired(now)
+
+			# Sleep until the next preparation or the next files to close,
+			# waking now and then in case the clock was changed
+			wake_time = prepare_time
+			if prepared == tomorrow:
+				wake_time = day_bounds(tomorrow)[1] - self._lead_time
+			if len(self._retired) > 0:
+				wake_time = min(wake_time, self._retired[0][0])
+			self._wake.wait(min(clock.real_timeout(max(wake_time - now, 0)), 60))
+			self._wake.clear()
+
+		self.close_retired()
+
+	# Have every logger open its files for day 'd'
+	def prepare(self, d):
+
+		start_time = time.perf_counter()
+		num_prepared = 0
+		num_failed = 0
+
+		for logger in list(loggers):
+			try:
+				logger.prepare_day(d)
+				num_prepared += 1
+			except Exception as e:
+				num_failed += 1
+				logging.error("Failed to prepare the log files of %s for %s: %s" % (logger, d, repr(e)))
+
+		duration = time.perf_counter() - start_time
+		logging.info("Prepared the log files of %i loggers for %s in %0.2f sec" % (num_prepared, d, duration))
+
+		with self._stats_lock:
+			self.num_prepared = num_prepared
+			self.num_failed = num_failed
+			self.prepare_time = duration
+			self.last_rollover = str(d)
+
+	# Close the files due to be closed by clock time 'now' (all of them
+	# if None)
+	def close_retired(self, now=None):
+		while len(self._retired) > 0:
+			if now is not None and self._retired[0][0] > now:
+				break
+			close_time, fileobjs, close_func = self._retired.popleft()
+			for f in fileobjs:
+				try:
+					close_func(f)
+				except Exception as e:
+					logging.error("Failed to close an old log file: " + repr(e))
+
+	def stop(self, timeout=10):
+		self._stop_event.set()
+		self._wake.set()
+		self._thread.join(timeout)
+		self.close_retired()
+
+	# Return a JSON-friendly summary
+	def to_dict(self):
+		with self._stats_lock:
+			return {'lead_time': self._lead_time,
+					'last_rollover': self.last_rollover,
+					'num_prepared': self.num_prepared,
+					'num_failed': self.num_failed,
+					'prepare_time': self.prepare_time,
+					'num_retired': len(self._retired)}
+
+# Start preparing each new day (see RolloverManager for the arguments)
+def start(lead_time=60, retire_delay=10):
+
+	global active
+
+	if active is None:
+		active = RolloverManager(lead_time, retire_delay)
+	return active
+
+# Stop preparing, closing any old files still open
+def stop():
+
+	global active
+
+	m = active
+	active = None
+	if m is not None:
+		m.stop()
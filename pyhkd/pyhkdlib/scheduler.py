@@ -0,0 +1,221 @@
+'''
+A deadline-driven scheduler for instrument updates.  Instead of polling
+every instrument at a fixed rate, the scheduler keeps a heap of the
+time each instrument next needs update() and sleeps until the earliest
+one is due.  Commands submitted from other threads wake it early.
+When several instruments are due, higher priority instruments go first,
+and lower priority updates slip if they would make a higher priority
+instrument late.
+
+Usage:
+	- Create an UpdateScheduler with the instruments and a function
+	  that runs a single instrument update
+	- Call run() from the thread that should do all of the updates
+	- Call submit() from any thread to run a function in the
+	  scheduler thread as soon as possible
+	- Call stop() from any thread to make run() return
+'''
+
+import time
+import heapq
+import logging
+import threading
+import traceback
+import collections
+
+from . import clock
+
+class UpdateScheduler:
+
+	# Re-check for updates at least this often while sleeping, in case
+	# the system clock jumps
+	MAX_SLEEP = 1.0 # seconds
+
+	# Minimum delay before re-running an instrument whose next update
+	# time did not move forward (it is polling)
+	MIN_INTERVAL = 0.005 # seconds
+
+	# Lower priority updates can be put off for up to their wait_time
+	# (but at least this long) to keep higher priority ones on time
+	MIN_DEFER_LIMIT = 1.0 # seconds
+
+	# Weight of the newest update in each instrument's average update
+	# duration, used to predict whether an update would delay others
+	DURATION_WEIGHT = 0.3
+
+	# 'instruments' is a list of Instrument objects
+	# 'run_update' is a function taking one instrument that calls its
+	# 		update() (along with any locking or timing checks)
+	def __init__(self, instruments, run_update):
+
+		self._run_update = run_update
+		self._cond = threading.Condition()
+		self._commands = collections.deque()
+		self._running = False
+
+		# Average update duration per instrument
+		self._durations = {}
+		# When each currently deferred instrument was first put off
+		self._deferred_since = {}
+
+		# Entries are (due time, tie breaker, instrument).  The tie
+		# breaker keeps the config order for instruments due at the
+		# same time and avoids comparing instruments.
+		self._heap = [(inst.next_update_time, n, inst) for n, inst in enumerate(instruments)]
+		heapq.heapify(self._heap)
+
+	# Queue a function (with no arguments) to run in the scheduler
+	# thread and wake the scheduler
+	def submit(self, func):
+		with self._cond:
+			self._commands.append(func)
+			self._cond.notify()
+
+	# Wake the scheduler early to re-check for due updates
+	def wake(self):
+		with self._cond:
+			self._cond.notify()
+
+	# Ask run() to return after the current update
+	def stop(self):
+		with self._cond:
+			self._running = False
+			self._cond.notify()
+
+	# Return the (due time, instrument) of the next scheduled update, or
+	# (None, None) if there are no instruments
+	def peek(self):
+		with self._cond:
+			if len(self._heap) < 1:
+				return (None, None)
+			due, _, inst = self._heap[0]
+			return (due, inst)
+
+	# Run scheduled updates and submitted commands until stop() is called
+	def run(self):
+
+		with self._cond:
+			self._running = True
+
+		while True:
+
+			with self._cond:
+
+				# Sleep until the next update is due or we are woken
+				while self._running and len(self._commands) < 1:
+					if len(self._heap) > 0:
+						delay = self._heap[0][0] - clock.now()
+						if delay <= 0:
+							break
+					else:
+						delay = self.MAX_SLEEP
+					self._cond.wait(clock.real_timeout(min(delay, self.MAX_SLEEP)))
+
+				if not self._running:
+					break
+
+				commands = list(self._commands)
+				self._commands.clear()
+				waiting = [e[2] for e in self._heap]
+
+			# Instruments put off for too long count as missing their
+			# deadline, even before they get to run
+			now = clock.now()
+			for inst in waiting:
+				if inst.loop_stats is not None:
+					inst.loop_stats.check_overdue(now)
+
+			for func in commands:
+				try:
+					func()
+				except:
+					logging.error("Contained error in scheduled command. %s" % (traceback.format_exc(),))
+
+			self._run_due()
+
+	# Run instrument updates until none are due (or a command arrives),
+	# choosing the most important due instrument each time
+	def _run_due(self):
+
+		while True:
+
+			with self._cond:
+				if not self._running or len(self._commands) > 0:
+					break
+				entry = self._pop_next(clock.now())
+			if entry is None:
+				break
+
+			_, n, inst = entry
+			start_time = clock.now()
+
+			try:
+				self._run_update(inst)
+			finally:
+				finish_time = clock.now()
+				dt = finish_time - start_time
+				self._durations[inst] = self._durations.get(inst, dt) * (1 - self.DURATION_WEIGHT) + dt * self.DURATION_WEIGHT
+				self._deferred_since.pop(inst, None)
+				
+				# Polling instruments go to the back of the line so
+				# they cannot starve the others
+				due = inst.next_update_time
+				if due <= finish_time:
+					due = finish_time + self.MIN_INTERVAL
+				with self._cond:
+					heapq.heappush(self._heap, (due, n, inst))
+
+	# Remove and return the heap entry to run next, or None if nothing
+	# should run yet.  Among the due instruments, the highest priority
+	# runs first (then the earliest due).  A lower priority update is
+	# put off if its expected duration would push a higher priority
+	# instrument past its deadline.  Call with _cond held.
+	def _pop_next(self, now):
+
+		due_entries = []
+		while len(self._heap) > 0 and self._heap[0][0] <= now:
+			due_entries.append(heapq.heappop(self._heap))
+
+		due_entries.sort(key=lambda e: (-e[2].priority, e[0], e[1]))
+
+		chosen = None
+		for e in due_entries:
+			if chosen is None:
+				defer_until = self._defer_until(e[2], now)
+				if defer_until is None:
+					chosen = e
+					continue
+				e = (defer_until, e[1], e[2])
+			heapq.heappush(self._heap, e)
+
+		return chosen
+
+	# Returns the time to put off updating 'inst' until, or None if it
+	# should run now
+	def _defer_until(self, inst, now):
+
+		# Deferred updates run anyway once they have slipped a full cycle
+		deferred_since = self._deferred_since.get(inst, now)
+		if (now - deferred_since) > max(inst.wait_time, self.MIN_DEFER_LIMIT):
+			return None
+
+		finish_time = now + self._durations.get(inst, 0)
+
+		# Find the earliest higher priority instrument that this update
+		# would make late
+		defer_until = None
+		for due, _, other in self._heap:
+			if other.priority <= inst.priority:
+				continue
+			deadline = due
+			if other.max_interval is not None:
+				deadline = max(due, other.last_update_time + other.max_interval)
+			if finish_time > deadline and (defer_until is None or due < defer_until):
+				defer_until = due
+
+		if defer_until is not None:
+			self._deferred_since[inst] = deferred_since
+			# Run once the higher priority update is done
+			defer_until = max(defer_until, now + self.MIN_INTERVAL)
+
+		return defer_until
@@ -14,11 +14,36 @@ import numpy as np
 import threading
 
 from .loggers.solo_date_logger import SoloDateLogger
-from .settings import DATA_LOG_FOLDER
+from .history import SensorHistory
+from .settings import DATA_LOG_FOLDER, LOG_FILE_FORMAT, HISTORY_DEFAULT
+from . import clock
+from . import stall_tracer
+from . import log_queue
+
+# Shared by every sensor that hasn't been set yet
+_NAN = float('NaN')
+
+# Listeners that raised, so each one's error is only logged once
+_failed_listeners = set()
+
+# Call a listener (see Sensor.add_listener).  A listener that raises
+# is logged and skipped, so it can't break the update that called it.
+def call_listener(f, sensors, update_time, sync_num):
+	try:
+		f(sensors, update_time, sync_num)
+	except Exception:
+		if f not in _failed_listeners:
+			_failed_listeners.add(f)
+			logging.exception("A listener of sensor '%s' failed" % sensors[0].name)
 
 # Used to store a value
 class Sensor(object):
 	
+	# Large arrays can have tens of thousands of sensors, so skip the
+	# instance dict
+	__slots__ = ['_name', '_alias', '_sensor_type', '_value', '_last_update_time', '_save_deriv', '_save_fast', '_filt', '_filters',
+				 '_last_sync_num', '_loggers', '_extra_loggers', '_deriv_sensor', '_update_lock', '_history', '_listeners']
+	
 	# Regular sensors track the value of an input
 	TYPE_UNUSED = 'unused'				# Don't save the results
 	TYPE_FLOAT = 'float'				# Generic floating point number
@@ -64,6 +89,14 @@ class Sensor(object):
 	
 	VALID_NOLOG_TYPES = [TYPE_UNUSED]
 	
+	# Set to False to skip the per-sensor log files, for processes that
+	# forward values elsewhere instead of saving them
+	LOG_TO_FILES = True
+	
+	# Set to False to skip the in-memory history (see history.py) of
+	# every sensor, even those that ask for it
+	KEEP_HISTORY = True
+	
 	# Sometimes a physical sensor has multiple outputs (ex: resistance
 	# and temperature).  MULTI_TYPE names are use to indicate such
 	# objects in config files.  Each output will be a separate instance
@@ -102,10 +135,22 @@ class Sensor(object):
 	for t in VALID_DERIV_TYPES:
 		assert (t not in VALID_TARGET_TYPES)
 				    
-	def __init__(self, name = '', sensor_type = TYPE_UNUSED, alias = None, save_deriv = False, downsample = 1, save_fast = False, filt=1.0):
+	# 'filters'	A filters.FilterChain applied to each new value (before
+	#			the 'filt' moving average), or None
+	# 'deadband', 'max_interval'	Only write values to the log files
+	#			that change by more than 'deadband' or are 'max_interval'
+	#			seconds after the last (see SoloDateLogger)
+	# 'bin_time', 'bin_stats'	Write the mean (and 'bin_stats') of
+	#			each 'bin_time' seconds instead of each value (see
+	#			SoloDateLogger)
+	# 'history'	Keep the recent values in memory (see history.py), or
+	#			None for HISTORY_DEFAULT
+	# 'lock'	Lock held while updating, which may be shared by the sensors
+	#			of one instrument.  By default each sensor has its own.
+	def __init__(self, name = '', sensor_type = TYPE_UNUSED, alias = None, save_deriv = False, downsample = 1, save_fast = False, filt=1.0, filters=None, deadband=None, max_interval=None, bin_time=None, bin_stats=None, history=None, lock=None):
 		
 		assert(sensor_type in self.VALID_TYPES)
-		if save_deriv:
+		if save_deriv or filters is not None:
 			assert(sensor_type in self.VALID_NONTARGET_TYPES)
 		assert(downsample >= 1)
 		assert(len(name) > 0)
@@ -114,46 +159,72 @@ class Sensor(object):
 		# Don't downsample targets
 		if sensor_type in self.VALID_TARGET_TYPES:
 			downsample = 1
+			bin_time = None
 				
 		self._name = name
 		self._alias = alias
 		self._sensor_type = sensor_type
-		self._value = float('NaN')
+		self._value = _NAN
 		self._last_update_time = 0
 		self._save_deriv = save_deriv
 		self._save_fast = save_fast
 		self._filt = filt
+		self._filters = filters
 
 		self._last_sync_num = None
 		
-		self._loggers = []
+		# The per-sensor log files, and any loggers added with
+		# add_logger (which can receive whole frames).  Tuples, since
+		# they rarely change and most sensors share the empty one.
+		loggers = []
+		self._extra_loggers = ()
 		
-		if self._sensor_type not in self.VALID_NOLOG_TYPES:
+		if self._sensor_type not in self.VALID_NOLOG_TYPES and self.LOG_TO_FILES:
 			
 			# Main output, downsampled data
-			self._loggers.append(SoloDateLogger(DATA_LOG_FOLDER, sensor_type, name, alias, downsample))
+			loggers.append(SoloDateLogger(DATA_LOG_FOLDER, sensor_type, name, alias, downsample, deadband, max_interval, bin_time, bin_stats, LOG_FILE_FORMAT))
 			
 			# Save full speed data if requested
-			if self._save_fast and downsample > 1:
+			if self._save_fast and (downsample > 1 or bin_time is not None):
 				fast_name = name + '.fast'
 				fast_alias = None
 				if fast_alias is not None:
 					fast_alias = str(alias) + '.fast'
-				self._loggers.append(SoloDateLogger(DATA_LOG_FOLDER, sensor_type, fast_name, fast_alias, downsample = 1))
+				loggers.append(SoloDateLogger(DATA_LOG_FOLDER, sensor_type, fast_name, fast_alias, downsample = 1, deadband = deadband, max_interval = max_interval, file_format = LOG_FILE_FORMAT))
+		
+		self._loggers = tuple(loggers)
+		
+		# Called with (sensors, update_time, sync_num) after each update
+		self._listeners = ()
+		
+		# Created on the first numeric value, False if not kept.
+		# Derivatives can't be looked up by name, so skip those.
+		if history is None:
+			history = HISTORY_DEFAULT
+		if history and self.KEEP_HISTORY and (sensor_type not in self.VALID_NOLOG_TYPES) and (sensor_type not in self.VALID_DERIV_TYPES):
+			self._history = None
+		else:
+			self._history = False
 				
+		
+		if lock is None:
+			lock = threading.Lock()
+		self._update_lock = lock
 			
-		# Sometimes storing the derivative is useful
+		# Sometimes storing the derivative is useful.  It is only
+		# updated along with this sensor, so it shares our lock.
 		if self._save_deriv:
 			self._deriv_sensor = Sensor(name = name,
 										alias = alias,
 										sensor_type = sensor_type + Sensor.DERIV_SUFFIX, 
 										save_deriv = False, 
 										downsample = downsample,
-										filt = 1.0) # We filter the base value
+										bin_time = bin_time,
+										bin_stats = bin_stats,
+										filt = 1.0, # We filter the base value
+										lock = lock)
 		else:
 			self._deriv_sensor = None
-			
-		self._update_lock = threading.Lock()
 
 	
 	@property
@@ -180,6 +251,25 @@ class Sensor(object):
 	def value(self):
 		return self._value
 	
+	# Return the in-memory history as a dict of lists, or None if there
+	# isn't one.  'width' is None for the raw samples (time, value), or
+	# a bin width in seconds for binned values (time, min, max, mean,
+	# count).  'start' and 'stop' limit the time range.
+	def get_history(self, width = None, start = None, stop = None):
+		with self._update_lock:
+			if not self._history:
+				return None
+			if width is None:
+				return self._history.samples(start, stop)
+			return self._history.bins(width, start, stop)
+	
+	# Bin widths (in seconds) available from get_history()
+	@property
+	def history_widths(self):
+		if not self._history:
+			return []
+		return self._history.widths
+	
 	@value.setter
 	def value(self, val):
 		self.set_value(val)
@@ -189,46 +279,163 @@ class Sensor(object):
 	def add_logger(self, l):
 		with self._update_lock:
 			if self._sensor_type not in self.VALID_NOLOG_TYPES:
-				self._loggers.append(l)
+				self._extra_loggers += (l,)
+	
+	# Call f(sensors, update_time, sync_num) after this sensor is updated,
+	# where 'sensors' is a list of the sensors that changed together
+	# (this one, or every listened-to sensor of an instrument frame).
+	# Listeners are called without the update lock held.
+	def add_listener(self, f):
+		with self._update_lock:
+			self._listeners += (f,)
 	
 	def set_value(self, val, update_time = None, sync_num = None):
+		self._update(val, update_time, sync_num, None)
+	
+	# The functions added with add_listener
+	@property
+	def listeners(self):
+		return self._listeners
+	
+	# True if 'lock' guards the updates of this sensor (such as the lock
+	# shared by the sensors of an instrument)
+	def uses_lock(self, lock):
+		return self._update_lock is lock
+	
+	# Set a value as part of a frame of values published together (see
+	# Instrument.publish_frame).  Values for the loggers added with
+	# add_logger are appended to 'frame' as (logger, name, type, value)
+	# tuples for the caller to log as one frame, and the caller calls
+	# the listeners once the whole frame is set.  With 'locked' the
+	# caller already holds this sensor's update lock (see uses_lock), so
+	# a lock shared by many sensors is taken once per frame.
+	def update_in_frame(self, val, update_time, sync_num, frame, locked = False):
+		if locked:
+			self._update_locked(val, update_time, sync_num, frame)
+		else:
+			self._update(val, update_time, sync_num, frame)
+	
+	# Set a new value and log it.  If 'frame' is a list, values for the
+	# loggers added with add_logger are appended to it as (logger, name,
+	# type, value) tuples for the caller to log as one frame, instead of
+	# being logged here.
+	def _update(self, val, update_time, sync_num, frame):
 		
-		with self._update_lock:
-
-			old_value = self._value
-			old_time = self._last_update_time
-			
-			# Simple exponential moving average
-			if (self._filt < 1) and old_value and np.isfinite(old_value):
-				val = (1 - self._filt) * old_value + self._filt * val
-			
-			# Keep the newest value in memory, downsampling occurs
-			# at the file logging level if relevant (otherwise the
-			# filter would break)
-			self._value = val
+		if stall_tracer.enabled:
+			stall_tracer.timed_acquire(self._update_lock, stall_tracer.PHASE_SENSOR_LOCK)
+		else:
+			self._update_lock.acquire()
+		
+		try:
+			self._update_locked(val, update_time, sync_num, frame)
+			update_time = self._last_update_time
+		finally:
+			self._update_lock.release()
+		
+		# Wait for room in the log queue without the lock held.  Frames
+		# do this (and notify listeners) once all of their sensors are
+		# updated.
+		if frame is None:
+			q = log_queue.active
+			if q is not None:
+				q.wait_for_room()
+			for f in self._listeners:
+				call_listener(f, [self], update_time, sync_num)
+	
+	# The body of _update(), for callers that already hold the update
+	# lock (see update_in_frame)
+	def _update_locked(self, val, update_time, sync_num, frame):
+		
+		old_value = self._value
+		old_time = self._last_update_time
+		
+		if self._filters is not None:
+			val = self._filters(val)
+		
+		# Simple exponential moving average
+		if (self._filt < 1) and old_value and np.isfinite(old_value):
+			val = (1 - self._filt) * old_value + self._filt * val
+		
+		# Keep the newest value in memory, downsampling occurs
+		# at the file logging level if relevant (otherwise the
+		# filter would break)
+		self._value = val
+		
+		# If we don't know when this is from, assume it is now
+		if update_time is None:
+			self._last_update_time = clock.now()
+		else:
+			self._last_update_time = update_time
 			
-			# If we don't know when this is from, assume it is now
-			if update_time is None:
-				self._last_update_time = time.time()
+		self._last_sync_num = sync_num
+		
+		# Keep numeric values in memory
+		if self._history is not False:
+			if val is None:
+				hval = float('NaN')
 			else:
-				self._last_update_time = update_time
-				
-			self._last_sync_num = sync_num
-			
-			# Save the value
-			for l in self._loggers:
+				try:
+					hval = float(val)
+				except (TypeError, ValueError):
+					hval = None
+			if hval is not None:
+				if self._history is None:
+					self._history = SensorHistory()
+				self._history.add(hval, self._last_update_time)
+		
+		# Save the value (or queue it for the log queue's worker)
+		log_start = time.perf_counter() if stall_tracer.enabled else None
+		if frame is None:
+			loggers = self._loggers + self._extra_loggers
+		else:
+			loggers = self._loggers
+			for l in self._extra_loggers:
+				frame.append((l, self._name, self._sensor_type, val))
+		q = log_queue.active
+		if q is not None:
+			if loggers:
+				q.put_value(loggers, self._name, self._sensor_type, val, self._last_update_time, self._last_sync_num)
+		else:
+			for l in loggers:
 				l.log(sensor_name = self._name,
 					  sensor_type = self._sensor_type,
 					  value = val, 
 					  update_time = self._last_update_time, 
 					  sync_num = self._last_sync_num)
-			
-			# Save the derivative.  Note that, as implemented, downsampling
-			# can cause you to not save the same times as the regular
-			# value, since there is no derivative for the first point.
-			# This is probably harmless but causes some confusion so
-			# should be looked at again.
-			if (self._deriv_sensor is not None) and (old_time > 0) and ((self._last_update_time - old_time) > 0):
-				deriv = (self._value - old_value) / (self._last_update_time - old_time)
-				self._deriv_sensor.set_value(deriv, update_time, sync_num)
+		if log_start is not None:
+			stall_tracer.add(stall_tracer.PHASE_LOG_WRITE, time.perf_counter() - log_start)
+		
+		# Save the derivative.  Note that, as implemented, downsampling
+		# can cause you to not save the same times as the regular
+		# value, since there is no derivative for the first point.
+		# This is probably harmless but causes some confusion so
+		# should be looked at again.
+		if (self._deriv_sensor is not None) and (old_time > 0) and ((self._last_update_time - old_time) > 0):
+			deriv = (self._value - old_value) / (self._last_update_time - old_time)
+			self._deriv_sensor._update_locked(deriv, update_time, sync_num, frame)
 				
+
+# Stands in for sensors that don't exist (see Instrument.get_sensor), so
+# callers can keep setting values.  Values are dropped and counted.
+class NullSensor(Sensor):
+	
+	__slots__ = ['num_dropped']
+	
+	def __init__(self):
+		Sensor.__init__(self, name = "Missing Sensor")
+		self.num_dropped = 0
+	
+	def add_logger(self, l):
+		pass
+	
+	def add_listener(self, f):
+		pass
+	
+	def _update(self, val, update_time, sync_num, frame):
+		self.num_dropped += 1
+	
+	def _update_locked(self, val, update_time, sync_num, frame):
+		self.num_dropped += 1
+
+# The one NullSensor shared by all instruments
+NULL_SENSOR = NullSensor()
@@ -0,0 +1,58 @@
+'''
+Finds any sensor of any instrument by name (or alias) and type.  The
+global registry is filled once at startup, so commands, queries, and
+virtual channels resolve sensors with a single dict lookup instead of
+searching the instruments.
+
+Usage:
+	- Call registry.add_instruments() with the loaded instruments (done by
+	  load_instruments and DataAcqController)
+	- Call registry.get(name, sensor_type) to look up a sensor, and
+	  registry.owner(sensor) for the instrument it belongs to
+'''
+
+import logging
+
+class SensorRegistry:
+
+	def __init__(self, instruments=[]):
+
+		self._sensors = {}
+		self._owners = {}
+		self._instruments = set()
+
+		self.add_instruments(instruments)
+
+	# Add the sensors of each instrument not added yet
+	def add_instruments(self, instruments):
+
+		for inst in instruments:
+
+			if inst in self._instruments:
+				continue
+			self._instruments.add(inst)
+
+			for s in inst.sensors:
+				self._owners[s] = inst
+				for name in [s.name, s.alias]:
+					if name is None:
+						continue
+					key = (name, s.sensor_type)
+					other = self._sensors.get(key, None)
+					if other is not None and other is not s:
+						logging.warning("More than one sensor is named '%s' with type %s, using the one from %s" % (name, s.sensor_type, inst.BOX_TYPE))
+					self._sensors[key] = s
+
+	# Return the sensor with a name or alias and type, or 'default'
+	def get(self, name, sensor_type, default=None):
+		return self._sensors.get((name, sensor_type), default)
+
+	# Return the instrument a sensor belongs to, or None
+	def owner(self, sensor):
+		return self._owners.get(sensor, None)
+
+	def __len__(self):
+		return len(self._owners)
+
+# The registry of every loaded instrument
+registry = SensorRegistry()
@@ -9,6 +9,21 @@ APP_LOG_FILENAME = 'pyhkd.log'
 APP_LOG_FORMAT = '[%(asctime)s] %(levelname)s: %(message)s'
 RECV_PORT = 7945
 PYHKD_PROCNAME = 'pyhkd'
+LOOP_STATS_FILENAME = 'loop_health.json' # Saved in DATA_LOG_FOLDER
+LOOP_STATS_EXPORT_PERIOD = 60 # seconds
+INSTRUMENT_LOAD_THREADS = 8 # Devices constructed at once at startup
+HISTORY_DEFAULT = False # Keep the in-memory history of every numeric sensor, or only of channels with "history": true
+HISTORY_SAMPLES = 600 # Raw samples kept in memory per sensor
+HISTORY_LEVELS = [(10, 360), (60, 1440)] # (seconds, bins): 10 sec bins for 1 hour, 1 min bins for 24 hours
+LOG_QUEUE_DEPTH = 100000 # Values queued for the loggers before LOG_QUEUE_POLICY applies
+LOG_QUEUE_POLICY = 'block' # 'block' waits for room in the log queue, 'drop' drops new values
+LOG_FILE_FORMAT = 'text' # 'text' log files, 'binary' packed records (see pyhkdremote.binlog), or 'both'
+COMPRESS_AFTER_DAYS = 0 # Compress the log files of days this many days old or older (at least 2) in the background, 0 never compresses
+FILE_FLUSH_TIME = 1.0 # Seconds log file lines are held to be written in batches, 0 writes each line as it comes
+FILE_FLUSH_BYTES = 1048576 # Bytes held (across all log files) that start an early flush
+FILE_POOL_SIZE = 768 # Most log files kept open at once (others are opened again as needed), 0 keeps them all open
+FILE_FSYNC_INTERVAL = 0 # Seconds between fsyncs of the written log files, 0 leaves it to the OS
+ROLLOVER_LEAD_TIME = 60 # Seconds before midnight the next day's log files are opened, 0 opens them at the first value of the day
 COMMON_CODE_DIR = os.path.abspath(os.path.join(__file__,'..','..','..','common'))
 
 # Make sure the folders exists
@@ -0,0 +1,204 @@
+'''
+An opt-in tracer that breaks down where the time goes in each
+instrument update, to explain stalls of the update loop.  The time of
+each update is split into:
+	- lock_wait		waiting for the update lock (_action_lock or the
+					instrument's action_lock)
+	- sensor_lock	waiting for Sensor locks
+	- log_write		Sensor loggers (such as SoloDateLogger file writes), or
+					queueing values for them if the log queue is running
+	- gc			garbage collection pauses (from gc.callbacks)
+	- driver		everything else (the instrument's own code)
+The slowest updates are kept with their breakdown.  GC pauses are also
+counted for the whole program, so the effect of freeze_startup_objects()
+(gc.freeze) can be measured.
+
+AsyncInstrument updates share one thread with every other coroutine, so
+only thread-based instrument updates are traced.
+
+Usage:
+	- Call enable() at startup (pyhkd.py --trace-stalls)
+	- Optionally call freeze_startup_objects() once startup is done
+	- Call report() to log the worst stalls, or to_dict() for a summary
+'''
+
+import gc
+import time
+import heapq
+import logging
+import threading
+import itertools
+
+from . import clock
+
+PHASE_LOCK_WAIT = 'lock_wait'
+PHASE_SENSOR_LOCK = 'sensor_lock'
+PHASE_LOG_WRITE = 'log_write'
+PHASE_GC = 'gc'
+PHASE_DRIVER = 'driver'
+PHASES = [PHASE_DRIVER, PHASE_LOCK_WAIT, PHASE_SENSOR_LOCK, PHASE_LOG_WRITE, PHASE_GC]
+
+# Checked on the hot path before doing any timing
+enabled = False
+
+_num_worst = 20
+_lock = threading.Lock()
+_worst = [] # Min heap of (total time, tie breaker, record)
+_counter = itertools.count()
+_local = threading.local()
+
+# Program-wide GC pause statistics, per generation
+_gc_stats = {}
+_gc_start = threading.local()
+
+# The time of a full collection before and after gc.freeze()
+_freeze_info = None
+
+# The timing of a single instrument update, from begin() to end()
+class UpdateTrace:
+
+	__slots__ = ['name', 'start', 'lock_acquired', 'phases']
+
+	def __init__(self, name):
+		self.name = name
+		self.start = time.perf_counter()
+		self.lock_acquired = None
+		self.phases = dict.fromkeys(PHASES, 0.0)
+
+	# Call once the update lock is held
+	def mark_lock_acquired(self):
+		self.lock_acquired = time.perf_counter()
+		self.phases[PHASE_LOCK_WAIT] += self.lock_acquired - self.start
+
+# Start tracing, keeping the 'num_worst' slowest updates
+def enable(num_worst=20):
+
+	global enabled, _num_worst
+
+	_num_worst = num_worst
+	if not enabled:
+		gc.callbacks.append(_gc_callback)
+	enabled = True
+
+# Stop tracing (recorded results are kept)
+def disable():
+
+	global enabled
+
+	if enabled:
+		gc.callbacks.remove(_gc_callback)
+	enabled = False
+
+# Start tracing an update of instrument 'name' in this thread.  Returns
+# an UpdateTrace to pass to end(), or None if tracing is off.
+def begin(name):
+
+	if not enabled:
+		return None
+
+	trace = UpdateTrace(name)
+	_local.trace = trace
+	return trace
+
+# Finish tracing an update started with begin()
+def end(trace):
+
+	if trace is None:
+		return
+
+	_local.trace = None
+
+	total = time.perf_counter() - trace.start
+	trace.phases[PHASE_DRIVER] = max(total - sum(trace.phases.values()), 0)
+
+	record = {'instrument': trace.name, 'time': clock.now(), 'total': total, 'phases': trace.phases}
+
+	with _lock:
+		entry = (total, next(_counter), record)
+		if len(_worst) < _num_worst:
+			heapq.heappush(_worst, entry)
+		elif total > _worst[0][0]:
+			heapq.heapreplace(_worst, entry)
+
+# Add time spent in 'phase' to the update being traced in this thread
+def add(phase, seconds):
+	trace = getattr(_local, 'trace', None)
+	if trace is not None:
+		trace.phases[phase] += seconds
+
+# Acquire 'lock', counting the wait as 'phase'
+def timed_acquire(lock, phase):
+	start_time = time.perf_counter()
+	lock.acquire()
+	add(phase, time.perf_counter() - start_time)
+
+# Called by the garbage collector before and after each collection
+def _gc_callback(phase, info):
+
+	if phase == 'start':
+		_gc_start.time = time.perf_counter()
+		return
+
+	start_time = getattr(_gc_start, 'time', None)
+	if start_time is None:
+		return
+	_gc_start.time = None
+
+	dt = time.perf_counter() - start_time
+	add(PHASE_GC, dt)
+
+	gen = info.get('generation', -1)
+	with _lock:
+		s = _gc_stats.setdefault(gen, {'count': 0, 'total': 0.0, 'max': 0.0, 'collected': 0})
+		s['count'] += 1
+		s['total'] += dt
+		s['max'] = max(s['max'], dt)
+		s['collected'] += info.get('collected', 0)
+
+# Move every object that exists now (instruments, sensors, loggers,
+# imported modules) out of the garbage collector's reach, so later
+# collections do not have to scan them.  Logs and returns the time of a
+# full collection before and after.
+def freeze_startup_objects():
+
+	global _freeze_info
+
+	start_time = time.perf_counter()
+	gc.collect()
+	before = time.perf_counter() - start_time
+
+	gc.freeze()
+
+	start_time = time.perf_counter()
+	gc.collect()
+	after = time.perf_counter() - start_time
+
+	_freeze_info = {'frozen_objects': gc.get_freeze_count(), 'full_collect_before': before, 'full_collect_after': after}
+	logging.info("Froze %i startup objects out of garbage collection, full collection time %0.1f ms -> %0.1f ms" % (gc.get_freeze_count(), before * 1e3, after * 1e3))
+
+	return _freeze_info
+
+# Return the recorded stalls (slowest first) and GC statistics
+def to_dict():
+
+	with _lock:
+		worst = [r for t, n, r in sorted(_worst, reverse=True)]
+		gc_stats = {str(k): dict(v) for k, v in _gc_stats.items()}
+
+	return {'enabled': enabled, 'worst': worst, 'gc': gc_stats, 'freeze': _freeze_info}
+
+# Log the slowest updates with their breakdown, and the GC statistics
+def report():
+
+	d = to_dict()
+
+	lines = ["Slowest instrument updates (ms: total = " + " + ".join(PHASES) + "):"]
+	for r in d['worst']:
+		lines.append("  %s %s: %0.1f = %s" % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r['time'])), r['instrument'], r['total'] * 1e3,
+					 " + ".join(["%0.1f" % (r['phases'][p] * 1e3) for p in PHASES])))
+
+	for gen in sorted(d['gc'].keys()):
+		s = d['gc'][gen]
+		lines.append("  GC generation %s: %i collections, %0.1f ms total, %0.1f ms max" % (gen, s['count'], s['total'] * 1e3, s['max'] * 1e3))
+
+	logging.info("\n".join(lines))
@@ -0,0 +1,63 @@
+'''
+Records how long each step of pyhkd startup takes (dependency checks,
+module imports, and device construction), so regressions in cold
+start time are easy to spot.
+
+Usage:
+	- Wrap a startup step in "with startup_profile.timed(category, name):"
+	  or call record() with a measured duration
+	- Call report() to log the breakdown (pyhkd.py --profile-startup)
+'''
+
+import time
+import logging
+import threading
+import contextlib
+
+# When this module was first imported, close to the start of pyhkd
+_start_time = time.time()
+
+_lock = threading.Lock()
+_entries = []
+
+# Record that step 'name' in 'category' took 'seconds'
+def record(category, name, seconds):
+	with _lock:
+		_entries.append((category, name, seconds))
+
+# Context manager that records the time spent inside it
+@contextlib.contextmanager
+def timed(category, name):
+	start_time = time.time()
+	try:
+		yield
+	finally:
+		record(category, name, time.time() - start_time)
+
+# Return the recorded steps as a list of (category, name, seconds)
+def entries():
+	with _lock:
+		return list(_entries)
+
+# Log the time of each recorded step, grouped by category (slowest
+# first), and the total time since startup
+def report():
+
+	all_entries = entries()
+
+	lines = ["Startup profile:"]
+
+	categories = []
+	for c, n, t in all_entries:
+		if c not in categories:
+			categories.append(c)
+
+	for c in categories:
+		steps = sorted([(t, n) for cc, n, t in all_entries if cc == c], reverse=True)
+		lines.append("  %s: %0.3f sec total" % (c, sum(t for t, n in steps)))
+		for t, n in steps:
+			lines.append("    %8.3f  %s" % (t, n))
+
+	lines.append("  %0.3f sec since startup" % (time.time() - _start_time))
+
+	logging.info("\n".join(lines))
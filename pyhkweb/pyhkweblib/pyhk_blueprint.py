@@ -13,15 +13,20 @@ import numpy as np
 
 from collections import OrderedDict
 
-from pyhkdremote.data_loader import pyhkd_get_filename, pyhkd_get_latest, pyhkd_get_config_dir, pyhkd_get_names
+from pyhkdremote.data_loader import pyhkd_get_latest, pyhkd_get_config_dir, pyhkd_get_names, pyhkd_load_records, pyhkd_read_text, thin_indices
+from pyhkdremote import binlog
 from pyhkdremote.settings import DATA_LOG_FOLDER
-from pyhkdremote.control import pyhkd_set
+from pyhkdremote.control import pyhkd_set, pyhkd_get_latest_values, pyhkd_get_histories
 from livecfg.livecfg import LiveCfg
 from .cache import cache
 import units.units as units
 import gitinfo
 from pyhkdlib.instruments.gpib.thales_XPCDE4865 import ThalesXPCDE4865
 
+# Seconds to wait for pyhkd to answer a query before reading the log
+# files instead
+PYHKD_QUERY_TIMEOUT = 1
+
 # Returns the correct function to convert between two units ("K", "C", etc).
 # Returns None on failure
 def get_unit_func(start, finish):
@@ -157,9 +162,18 @@ def get_data_current(subfolder_label, value_names, units_name='default'):
 		logging.error("Bad value names passed to get_data_current: " + str(value_names))
 		return "", 400
 		
+	# pyhkd has the newest values in memory, the log files are only read
+	# for the sensors it doesn't know (or when it isn't running)
+	latest = pyhkd_get_latest_values(subfolder_label, value_names, timeout = PYHKD_QUERY_TIMEOUT)
+	if latest is None:
+		latest = {}
+	
 	results = OrderedDict()
 	for n in value_names:
-		ts, v = pyhkd_get_latest(DATA_LOG_FOLDER, subfolder_label, n, return_as_datetime = False)
+		if n in latest:
+			ts, v = latest[n]
+		else:
+			ts, v = pyhkd_get_latest(DATA_LOG_FOLDER, subfolder_label, n, return_as_datetime = False)
 		if ts is not None:
 			
 			if v is not None:
@@ -292,59 +306,86 @@ def get_data_archive_helper(subfolder_label, value_names, target_date,
 
 	logging.debug("Using plot mode " + str(plot_mode))
 	
+	# Ask pyhkd once for the history of every sensor kept in memory, if
+	# today is plotted.  Without a reply the log files are read.
+	histories = {}
+	day_start = time.mktime(datetime.date.today().timetuple())
+	if plot_mode != PLOTMODE_FASTDATA and any(datetime.date.today() in dates for dates in dates_list):
+		histories = pyhkd_get_histories(subfolder_label, value_names, start = day_start, timeout = PYHKD_QUERY_TIMEOUT)
+		if histories is None:
+			histories = {}
+	
 	for iii in range(len(dates_list)):
 		dates = dates_list[iii]
 		timeshift_ms = timeshift_ms_list[iii]
 		for vi in range(num_names):
 			for d in dates:
-				filename = pyhkd_get_filename(DATA_LOG_FOLDER, subfolder_label, value_names[vi], d) 
-				if os.path.exists(filename):	
-					with open(filename, 'r') as fhandle:
-			
-						lines = fhandle.read().split('\n')
-						nlines = len(lines)
-						
-						# Check if we should be downsampling or returning
-						# the newest data.  Either way, we need to limit
-						# to at most max_points_each points.
-						downsample = max(1, nlines // max_points_each)
-						startline = 0
-						if (plot_mode == PLOTMODE_FASTDATA) and downsample > 1:
-							downsample = 1
-							startline = int(nlines - max_points_each)
-							logging.debug("Returning only the latest points for %s on %s" % (value_names[vi], d))
-							
-						if downsample > 1:
-							logging.debug("Downsampling %s on %s by a factor of %i" % (value_names[vi], d, downsample))
-			
-						for l in range(startline, nlines):
 				
-							if (l % downsample) != 0:
-								continue
+				# Today comes from pyhkd's memory if it keeps the sensor's
+				# history
+				if d == datetime.date.today() and value_names[vi] in histories:
+					points = get_history_points(histories[value_names[vi]], day_start, max_points_each, conv_func, timeshift_ms, vi + iii*num_names, num_entries)
+					if points is not None:
+						data += points
+						continue
+				
+				# Binary files are used as they are, without parsing
+				records = pyhkd_load_records(DATA_LOG_FOLDER, subfolder_label, value_names[vi], d)
+				if records is not None:
+					data += get_binary_archive_points(records, max_points_each, plot_mode, conv_func, timeshift_ms, vi + iii*num_names, num_entries)
+					continue
+				
+				text = pyhkd_read_text(DATA_LOG_FOLDER, subfolder_label, value_names[vi], d)
+				if text is not None:
+					
+					lines = text.split('\n')
+					nlines = len(lines)
+					
+					# Skip the empty lines at the end
+					while nlines > 0 and lines[nlines-1] == '':
+						nlines -= 1
+					
+					# Check if we should be downsampling or returning
+					# the newest data.  Either way, we need to limit
+					# to at most max_points_each points.
+					downsample = max(1, 2 * nlines // max_points_each)
+					startline = 0
+					if (plot_mode == PLOTMODE_FASTDATA) and downsample > 1:
+						downsample = 1
+						startline = max(0, int(nlines - max_points_each))
+						logging.debug("Returning only the latest points for %s on %s" % (value_names[vi], d))
+						
+					if downsample > 1:
+						logging.debug("Downsampling %s on %s by a factor of %i" % (value_names[vi], d, downsample))
+					
+					# Keeps the line before each kept one and the last
+					# line, so channels logged with a deadband still
+					# show steps and hold their value to the end
+					for l in thin_indices(nlines, downsample, startline).tolist():
 
-							lines[l] = lines[l].split('\t')
+						lines[l] = lines[l].split('\t')
 				
-							# Each line should have at least 2 fields, but
-							# can possibly have more (sync num)
-							if len(lines[l]) < 2:
-								lines[l] = None
-								print("Bad line: " + str(lines[l]))
-								continue
+						# Each line should have at least 2 fields, but
+						# can possibly have more (sync num)
+						if len(lines[l]) < 2:
+							lines[l] = None
+							print("Bad line: " + str(lines[l]))
+							continue
 					
-							try:
-								if conv_func is not None:
-									lines[l][1] = "%0.5g" % (conv_func(float(lines[l][1])))
+						try:
+							if conv_func is not None:
+								lines[l][1] = "%0.5g" % (conv_func(float(lines[l][1])))
 					
-								# Insert null values for the other curves at this timestamp
-								lines[l][0] = int(1000*float(lines[l][0])) + timeshift_ms
-								vis = vi + iii*num_names
-								lines[l][1] = ','*vis + lines[l][1] + ','*(num_entries-(vis+1))
-							except:
-								lines[l] = None
-								print("Bad line: " + str(lines[l]))
-								continue
+							# Insert null values for the other curves at this timestamp
+							lines[l][0] = int(1000*float(lines[l][0])) + timeshift_ms
+							vis = vi + iii*num_names
+							lines[l][1] = ','*vis + lines[l][1] + ','*(num_entries-(vis+1))
+						except:
+							lines[l] = None
+							print("Bad line: " + str(lines[l]))
+							continue
 					
-							data.append(lines[l])
+						data.append(lines[l])
 				else:
 					#logging.debug("File doesn't exist: " + str(filenames[f]))
 					pass
@@ -413,6 +454,84 @@ def about():
 	
 	return flask.render_template("about.html", **kwargs)		
 
+# Returns the [time in ms, csv values] entries of get_data_archive_helper
+# for the records of one binary log file, picked the same way as the
+# lines of a text file.  'vis' is the column of this value out of
+# 'num_entries'.
+def get_binary_archive_points(records, max_points_each, plot_mode, conv_func, timeshift_ms, vis, num_entries):
+	
+	n = len(records)
+	if n == 0:
+		return []
+	
+	downsample = max(1, int(2 * n // max_points_each))
+	start = 0
+	if (plot_mode == PLOTMODE_FASTDATA) and downsample > 1:
+		downsample = 1
+		start = max(0, int(n - max_points_each))
+	
+	# The held value before each kept record and the last record are
+	# kept, as for the text files
+	index = thin_indices(n, downsample, start)
+	
+	times_ms = (records['t'][index] * 1000).astype(np.int64) + timeshift_ms
+	values = records['v'][index]
+	
+	before = ',' * vis
+	after = ',' * (num_entries - (vis + 1))
+	
+	points = []
+	for t, v in zip(times_ms.tolist(), values.tolist()):
+		if conv_func is not None:
+			v = "%0.5g" % (conv_func(v),)
+		else:
+			v = "%0.8g" % (v,)
+		points.append([t, before + v + after])
+	return points
+
+# Returns the get_data_archive_helper entries for today from the
+# in-memory history of a sensor in pyhkd ('history', an entry of
+# pyhkd_get_histories from 'day_start'): the coarsest bins, then the
+# finer bins and raw samples from where each of them starts.  Returns
+# None if the history has no bins or doesn't reach back to midnight, so
+# the log file is read instead.
+def get_history_points(history, day_start, max_points_each, conv_func, timeshift_ms, vis, num_entries):
+	
+	raw = history['samples']
+	if len(history['bins']) == 0:
+		return None
+	
+	# Coarsest first, bins are plotted at their center
+	levels = []
+	for width, bins in sorted(history['bins'], key=lambda wb: wb[0], reverse=True):
+		if bins is None:
+			return None
+		if len(levels) == 0 and (len(bins['time']) == 0 or bins['time'][0] > day_start):
+			return None
+		levels.append(([t + width / 2 for t in bins['time']], bins['mean']))
+	levels.append((raw['time'], raw['value']))
+	
+	# Each level is used up to where the next finer one starts
+	times = []
+	values = []
+	for i in range(len(levels)):
+		stop = None
+		for t, v in levels[i+1:]:
+			if len(t) > 0:
+				stop = t[0]
+				break
+		for t, v in zip(*levels[i]):
+			if stop is not None and t >= stop:
+				break
+			if v is not None and np.isfinite(v):
+				times.append(t)
+				values.append(v)
+	
+	records = np.zeros(len(times), dtype=[('t', 'f8'), ('v', 'f8')])
+	records['t'] = times
+	records['v'] = values
+	return get_binary_archive_points(records, max_points_each, PLOTMODE_NORMAL, conv_func, timeshift_ms, vis, num_entries)
+
 @pyhkpage.route("/data/export/<subfolder_label>/<date_start>/<date_stop>/names")
 def get_export_names(subfolder_label, date_start, date_stop):
 	
@@ -464,10 +583,18 @@ def get_export_data(subfolder_label, date_start, date_stop, value_name):
 	txt = ''
 	d = date_start
 	while (d <= date_stop):
-		input_filename = pyhkd_get_filename(DATA_LOG_FOLDER, subfolder_label, value_name, d)			
-		if os.path.exists(input_filename):
-			with open(input_filename, 'r') as fin:
-				txt += fin.read()
+		day_txt = pyhkd_read_text(DATA_LOG_FOLDER, subfolder_label, value_name, d)
+		if day_txt is not None:
+			txt += day_txt
+		else:
+			# Export binary files in the text format
+			records = pyhkd_load_records(DATA_LOG_FOLDER, subfolder_label, value_name, d)
+			if records is not None:
+				for t, v, sync_num in records.tolist():
+					txt += '%.3f\t%0.8g' % (t, v)
+					if sync_num != binlog.NO_SYNC:
+						txt += '\t%i' % (sync_num,)
+					txt += '\n'
 		d += datetime.timedelta(days=1)
 
 	response = flask.make_response(txt)
@@ -0,0 +1,76 @@
+'''
+Scaffolding shared by the unit tests.  Import it after adding the pyhkd
+and common folders to sys.path, as each test file does.
+'''
+
+import time
+import unittest
+import tempfile
+
+from pyhkdlib.sensor import Sensor
+from pyhkdlib.instruments.instrument import Instrument
+
+# An instrument without hardware, with one sensor per channel dict
+class FakeInstrument(Instrument):
+
+	BOX_TYPE = 'TEST'
+
+	def __init__(self, channels, **kwargs):
+		self.NUM_SENSORS = len(channels)
+		Instrument.__init__(self, channels=channels, **kwargs)
+
+# Counts its updates on channel 0, and copies the target of channel 1
+# to its readback.  Sleeps for 'start_delay' seconds when constructed.
+class CountingInstrument(FakeInstrument):
+
+	def __init__(self, channels, start_delay=0, **kwargs):
+		time.sleep(start_delay)
+		self.count = 0
+		FakeInstrument.__init__(self, channels, **kwargs)
+
+	def update_periodic(self):
+		self.count += 1
+		self.get_sensor(0, 'voltage').value = float(self.count)
+
+	def process_targets(self, chan_ids):
+		if 1 in chan_ids:
+			self.get_sensor(1, 'voltage').value = self.get_sensor(1, 'vtarg').value
+
+# Wait (in real time) for 'condition' to return True, returns its last
+# result
+def wait_for(condition, timeout=10):
+	stop_time = time.monotonic() + timeout
+	while not condition() and time.monotonic() < stop_time:
+		time.sleep(0.01)
+	return condition()
+
+# Sensors made during each test don't write log files
+class NoLogFilesTestCase(unittest.TestCase):
+
+	def setUp(self):
+		Sensor.LOG_TO_FILES = False
+
+	def tearDown(self):
+		Sensor.LOG_TO_FILES = True
+
+# Each test gets an empty log folder, self.tmpdir.name
+class LogFolderTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.TemporaryDirectory()
+
+	def tearDown(self):
+		self.tmpdir.cleanup()
+
+	# Returns the lines of the text log file of 'logger' (or of its
+	# sibling file for the bin statistic 'stat')
+	def read_lines(self, logger, stat=None):
+		filename = logger._filename
+		if stat is not None:
+			filename = filename[:-len('.txt')] + '.' + stat + '.txt'
+		with open(filename) as f:
+			return f.read().splitlines()
+
+	# Returns the (time, value) pairs of the text log file of 'logger'
+	def read_values(self, logger, stat=None):
+		return [(float(l.split('\t')[0]), float(l.split('\t')[1])) for l in self.read_lines(logger, stat)]
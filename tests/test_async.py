@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import asyncio
+import threading
+import subprocess
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib import data_acq
+from pyhkdlib.data_acq import DataAcqController
+from pyhkdlib.instruments.async_instrument import AsyncInstrument
+from helpers import CountingInstrument, NoLogFilesTestCase
+
+class AsyncHeater(AsyncInstrument):
+
+	BOX_TYPE = 'TEST_ASYNC'
+	NUM_SENSORS = 1
+
+	def __init__(self, **kwargs):
+		self.events = []
+		self.thread_ids = set()
+		AsyncInstrument.__init__(self, **kwargs)
+
+	async def open_async(self):
+		self.events.append('open')
+
+	async def close_async(self):
+		self.events.append('close')
+
+	async def update_periodic_async(self):
+		self.thread_ids.add(threading.get_ident())
+		await asyncio.sleep(0)
+		self.get_sensor(0, 'temperature').value = float(len(self.events))
+		self.events.append('update')
+
+	def process_targets(self, chan_ids):
+		self.thread_ids.add(threading.get_ident())
+		self.events.append(('targets', set(chan_ids)))
+
+# Instruments add to the channel dicts, so each gets its own
+def heater_channels():
+	return [{'name': 'AH', 'type': ['temperature', 'starg']}]
+
+class TestAsyncInstrument(NoLogFilesTestCase):
+
+	def test_update_async(self):
+
+		inst = AsyncHeater(channels=heater_channels(), wait_time=0.05)
+
+		# Only run from the event loop
+		with self.assertRaises(RuntimeError):
+			inst.update()
+
+		async def run():
+			await inst.update_async()
+			await asyncio.sleep(0.06)
+			await inst.update_async()
+			await inst.update_async()
+			inst.get_sensor(0, 'starg').value = 1
+			await inst.update_async()
+		asyncio.run(run())
+
+		# One periodic update per wait_time, targets on any update
+		self.assertEqual(inst.events, ['update', ('targets', {0})])
+
+class TestAsyncioLoop(NoLogFilesTestCase):
+
+	def setUp(self):
+		NoLogFilesTestCase.setUp(self)
+		self.old_port = data_acq.RECV_PORT
+		data_acq.RECV_PORT = 0
+
+	def tearDown(self):
+		data_acq.RECV_PORT = self.old_port
+		NoLogFilesTestCase.tearDown(self)
+
+	def test_loop_and_commands(self):
+
+		heater = AsyncHeater(channels=heater_channels(), wait_time=0.02)
+		counter = CountingInstrument(channels=[{'name': 'AI0', 'type': 'voltage'}, {'name': 'H1', 'type': ['voltage', 'vtarg']}], wait_time=0.02)
+		ctrl = DataAcqController([heater, counter], [], loop_mode=DataAcqController.LOOP_ASYNCIO)
+
+		async def run():
+
+			loop_thread = threading.get_ident()
+			main = asyncio.create_task(ctrl._async_main())
+
+			async def wait_for(condition):
+				for i in range(500):
+					if condition():
+						return True
+					await asyncio.sleep(0.01)
+				return False
+
+			# Both kinds of instrument are updated
+			self.assertTrue(await wait_for(lambda: heater.events.count('update') >= 3 and counter.count >= 3))
+			self.assertEqual(heater.events[0], 'open')
+			self.assertEqual(heater.thread_ids, {loop_thread})
+
+			# Commands from the packet server thread are run on the event
+			# loop, or in the executor for thread-based instruments
+			loop = asyncio.get_running_loop()
+			await loop.run_in_executor(None, ctrl.handle_packet, 'sset,AH,1')
+			await loop.run_in_executor(None, ctrl.handle_packet, 'vset,H1,2.5')
+			self.assertTrue(await wait_for(lambda: ('targets', {0}) in heater.events and counter.get_sensor(1, 'voltage').value == 2.5))
+			self.assertEqual(heater.get_sensor(0, 'starg').value, 1)
+			self.assertEqual(heater.thread_ids, {loop_thread})
+
+			main.cancel()
+			with self.assertRaises(asyncio.CancelledError):
+				await main
+
+		try:
+			asyncio.run(run())
+		finally:
+			ctrl._threads_running = False
+			ctrl._thread_rx.join()
+
+		self.assertEqual(heater.events[-1], 'close')
+		self.assertIsNone(ctrl._event_loop)
+
+class TestImports(unittest.TestCase):
+
+	def test_lazy_import(self):
+
+		# The asyncio instruments (and serial) are only imported when an
+		# instrument needs them
+		code = "import sys; from pyhkdlib import data_acq; print('pyhkdlib.instruments.async_instrument' in sys.modules)"
+		env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(basepath, 'pyhkd'), os.path.join(basepath, 'common')]))
+		out = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True).stdout
+		self.assertEqual(out.strip(), 'False')
+
+if __name__ == '__main__':
+	unittest.main()
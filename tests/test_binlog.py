@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import unittest
+import math
+import sys
+import os
+import datetime
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib import clock
+from pyhkdlib.loggers.solo_date_logger import SoloDateLogger
+from pyhkdremote import binlog
+from pyhkdremote.data_loader import pyhkd_load_day, pyhkd_get_latest, pyhkd_get_names, pyhkd_get_bin_filename
+from helpers import LogFolderTestCase
+
+class TestBinLog(LogFolderTestCase):
+
+	def test_both(self):
+
+		logger = SoloDateLogger(self.tmpdir.name, 'temperature', 'T 1', alias='Head', file_format='both')
+		logger.log('T 1', 'temperature', 4.2, 100.0)
+		logger.log('T 1', 'temperature', None, 101.0, sync_num=7)
+		logger.log('T 1', 'temperature', 'open', 102.0)
+
+		filename = pyhkd_get_bin_filename(self.tmpdir.name, 'temperature', 'T 1', clock.today())
+		records = binlog.load(filename)
+		self.assertEqual(records['t'].tolist(), [100.0, 101.0, 102.0])
+		self.assertEqual(records['v'][0], 4.2)
+		self.assertTrue(math.isnan(records['v'][1]))
+		self.assertTrue(math.isnan(records['v'][2]))
+		self.assertEqual(records['sync'].tolist(), [binlog.NO_SYNC, 7, binlog.NO_SYNC])
+
+		# Both files, under the name and the alias
+		self.assertEqual(pyhkd_get_names(self.tmpdir.name, 'temperature', clock.today()), ['Head', 'T 1'])
+		self.assertEqual(len(binlog.load(filename.replace('T%201', 'Head'))), 3)
+
+	def test_binary_only(self):
+
+		logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI0', file_format='binary')
+		for t in range(5):
+			logger.log('AI0', 'voltage', float(t), 100.0 + t)
+		self.assertFalse(os.path.exists(logger._filename))
+
+		t, v = pyhkd_load_day(self.tmpdir.name, 'voltage', 'AI0', clock.today())
+		self.assertEqual(v.tolist(), [0.0, 1.0, 2.0, 3.0, 4.0])
+		self.assertEqual(pyhkd_get_latest(self.tmpdir.name, 'voltage', 'AI0', datetime.date.today(), False), (104.0, 4.0))
+
+		# A partly written record is left out
+		filename = pyhkd_get_bin_filename(self.tmpdir.name, 'voltage', 'AI0', clock.today())
+		with open(filename, 'ab') as f:
+			f.write(binlog.pack(105.0, 5.0)[:10])
+		self.assertEqual(len(binlog.load(filename)), 5)
+
+		# Appending to the file again doesn't repeat the header
+		del logger
+		logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI1', file_format='binary')
+		logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI1', file_format='binary')
+		logger.log('AI1', 'voltage', 1.0, 100.0)
+		self.assertEqual(len(binlog.load(pyhkd_get_bin_filename(self.tmpdir.name, 'voltage', 'AI1', clock.today()))), 1)
+
+	def test_reopen(self):
+
+		logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI0', file_format='binary')
+		for t in range(3):
+			logger.log('AI0', 'voltage', float(t), 100.0 + t)
+		filename = pyhkd_get_bin_filename(self.tmpdir.name, 'voltage', 'AI0', clock.today())
+		with open(filename, 'ab') as f:
+			f.write(binlog.pack(103.0, 3.0)[:10])
+
+		# Reopening the file after a crash drops the partial record, so
+		# the next records line up
+		del logger
+		with self.assertLogs(level='WARNING'):
+			logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI0', file_format='binary')
+		logger.log('AI0', 'voltage', 4.0, 104.0)
+		records = binlog.load(filename)
+		self.assertEqual(records['t'].tolist(), [100.0, 101.0, 102.0, 104.0])
+		self.assertEqual(records['v'].tolist(), [0.0, 1.0, 2.0, 4.0])
+		self.assertEqual(os.path.getsize(filename), binlog.HEADER_SIZE + 4 * binlog.RECORD.itemsize)
+
+	def test_invalid_file(self):
+
+		filename = pyhkd_get_bin_filename(self.tmpdir.name, 'voltage', 'AI0', clock.today())
+		os.makedirs(os.path.dirname(filename))
+		with open(filename, 'wb') as f:
+			f.write(b'not a binary log file' * 10)
+
+		# Kept under another name, and a new file is started
+		with self.assertLogs(level='ERROR'):
+			logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI0', file_format='binary')
+		logger.log('AI0', 'voltage', 1.0, 100.0)
+		self.assertEqual(binlog.load(filename)['v'].tolist(), [1.0])
+		self.assertTrue(os.path.exists(filename + SoloDateLogger.INVALID_SUFFIX))
+
+	def test_text(self):
+
+		logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI0')
+		logger.log('AI0', 'voltage', 1.5, 100.0, sync_num=3)
+		t, v = pyhkd_load_day(self.tmpdir.name, 'voltage', 'AI0', clock.today())
+		self.assertEqual((t.tolist(), v.tolist()), ([100.0], [1.5]))
+		self.assertIsNone(binlog.load(pyhkd_get_bin_filename(self.tmpdir.name, 'voltage', 'AI0', clock.today())))
+
+if __name__ == '__main__':
+	unittest.main()
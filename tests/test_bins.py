@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import unittest
+import math
+import sys
+import os
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib import rollover
+from pyhkdlib.loggers.solo_date_logger import SoloDateLogger
+from helpers import LogFolderTestCase
+
+class TestBins(LogFolderTestCase):
+
+	def test_stats(self):
+
+		logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI0', bin_time=10)
+
+		# Jittery sample times, two bins and the start of a third
+		for t, v in [(100.2, 1.0), (103.9, 3.0), (109.99, None), (110.0, 5.0), (125.0, 0.0)]:
+			logger.log('AI0', 'voltage', v, t)
+
+		self.assertEqual(self.read_values(logger), [(105.0, 2.0), (115.0, 5.0)])
+		self.assertEqual(self.read_values(logger, 'min'), [(105.0, 1.0), (115.0, 5.0)])
+		self.assertEqual(self.read_values(logger, 'max'), [(105.0, 3.0), (115.0, 5.0)])
+		self.assertEqual(self.read_values(logger, 'std'), [(105.0, 1.0), (115.0, 0.0)])
+		self.assertEqual(self.read_values(logger, 'count'), [(105.0, 2.0), (115.0, 1.0)])
+
+	def test_long_bin(self):
+
+		logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI0', bin_time=1000, bin_stats=['max'])
+		for i in range(500):
+			logger.log('AI0', 'voltage', float(i), i)
+		logger.log('AI0', 'voltage', float('nan'), 1000)
+		logger.log('AI0', 'voltage', 0.0, 2000)
+
+		# Long bins are fine, and a bin of only NaN has a NaN mean
+		lines = self.read_values(logger)
+		self.assertEqual(lines[0], (500.0, 249.5))
+		self.assertEqual(lines[1][0], 1500.0)
+		self.assertTrue(math.isnan(lines[1][1]))
+		self.assertEqual(len(lines), 2)
+		self.assertEqual(self.read_values(logger, 'max')[0], (500.0, 499.0))
+		self.assertFalse(os.path.exists(logger._filename[:-len('.txt')] + '.min.txt'))
+
+	def test_flush(self):
+
+		logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI0', bin_time=10, bin_stats=['count'])
+		logger.log('AI0', 'voltage', 1.0, 101.0)
+		logger.log('AI0', 'voltage', 2.0, 102.0)
+		self.assertEqual(self.read_values(logger), [])
+
+		# At shutdown the partial bin is written, once
+		rollover.flush_loggers()
+		rollover.flush_loggers()
+		self.assertEqual(self.read_values(logger), [(105.0, 1.5)])
+		self.assertEqual(self.read_values(logger, 'count'), [(105.0, 2.0)])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import time
+import datetime
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib import clock
+from pyhkdlib.day_compressor import DayCompressor
+from pyhkdlib.loggers.solo_date_logger import SoloDateLogger
+from pyhkdremote import blockzip
+from pyhkdremote.data_loader import pyhkd_load_day, pyhkd_get_latest, pyhkd_get_names, pyhkd_read_text, pyhkd_get_filename
+from helpers import LogFolderTestCase
+
+class TestBlockZip(LogFolderTestCase):
+
+	def setUp(self):
+		LogFolderTestCase.setUp(self)
+		self.day = datetime.date.today() - datetime.timedelta(days=3)
+		clock.set_clock(clock.VirtualClock(start=datetime.datetime.combine(self.day, datetime.time(12)).timestamp()))
+
+	def tearDown(self):
+		clock.set_clock(clock.WallClock())
+		LogFolderTestCase.tearDown(self)
+
+	def log_day(self, file_format, n=20000, times=None, idle=True):
+		if times is None:
+			times = [1000.0 + i for i in range(n)]
+		logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI 0', alias='Heater', file_format=file_format)
+		for i, t in enumerate(times):
+			logger.log('AI 0', 'voltage', i * 0.5, t, sync_num=i if i % 2 else None)
+		del logger
+		clock.set_clock(clock.WallClock())
+		if idle:
+			self.make_idle()
+
+	# Date the log files as not written to for a while
+	def make_idle(self):
+		old = time.time() - 2 * DayCompressor.MIN_IDLE_TIME
+		for folder, dirs, files in os.walk(self.tmpdir.name):
+			for name in files:
+				os.utime(os.path.join(folder, name), (old, old))
+
+	def test_text(self):
+
+		self.log_day('text')
+		before = pyhkd_read_text(self.tmpdir.name, 'voltage', 'AI 0', self.day)
+
+		compressor = DayCompressor(self.tmpdir.name, after_days=2)
+		compressor.compress_old_days()
+		self.assertEqual(compressor.to_dict()['num_files'], 1)
+
+		filename = pyhkd_get_filename(self.tmpdir.name, 'voltage', 'AI 0', self.day)
+		self.assertFalse(os.path.exists(filename))
+		self.assertTrue(os.path.exists(filename + blockzip.EXTENSION))
+		self.assertLess(os.path.getsize(filename + blockzip.EXTENSION), len(before) / 3)
+
+		# Read back the same, under the name and the alias
+		self.assertEqual(pyhkd_read_text(self.tmpdir.name, 'voltage', 'AI 0', self.day), before)
+		self.assertEqual(pyhkd_read_text(self.tmpdir.name, 'voltage', 'Heater', self.day), before)
+		self.assertEqual(pyhkd_get_names(self.tmpdir.name, 'voltage', self.day), ['AI 0', 'Heater'])
+		self.assertEqual(pyhkd_get_latest(self.tmpdir.name, 'voltage', 'AI 0', self.day, False), (20999.0, 9999.5))
+
+		# A range reads only some blocks
+		partial = pyhkd_read_text(self.tmpdir.name, 'voltage', 'AI 0', self.day, 5000.0, 5100.0)
+		self.assertLess(len(partial), len(before) / 3)
+		t, v = pyhkd_load_day(self.tmpdir.name, 'voltage', 'AI 0', self.day, 5000.0, 5100.0)
+		self.assertEqual(t.tolist(), [5000.0 + i for i in range(101)])
+
+		# Nothing left to do
+		compressor.compress_old_days()
+		self.assertEqual(compressor.to_dict()['num_files'], 1)
+
+	def test_binary(self):
+
+		self.log_day('binary')
+		t_before, v_before = pyhkd_load_day(self.tmpdir.name, 'voltage', 'AI 0', self.day)
+		t_before, v_before = t_before.tolist(), v_before.tolist()
+
+		DayCompressor(self.tmpdir.name, after_days=2).compress_old_days()
+
+		t, v = pyhkd_load_day(self.tmpdir.name, 'voltage', 'AI 0', self.day)
+		self.assertEqual((t.tolist(), v.tolist()), (t_before, v_before))
+		self.assertEqual(pyhkd_get_latest(self.tmpdir.name, 'voltage', 'Heater', self.day, False), (20999.0, 9999.5))
+
+	def test_out_of_order(self):
+
+		# The clock was set back for a while in the middle of a block
+		times = [1000.0 + i for i in range(20000)]
+		times[10000:10100] = [500.0 + i for i in range(100)]
+		self.log_day('binary', times=times)
+		DayCompressor(self.tmpdir.name, after_days=2).compress_old_days()
+
+		t, v = pyhkd_load_day(self.tmpdir.name, 'voltage', 'AI 0', self.day, 550.0, 560.0)
+		self.assertEqual(t.tolist(), [550.0 + i for i in range(11)])
+
+	def test_still_written(self):
+
+		self.log_day('text', 10, idle=False)
+		compressor = DayCompressor(self.tmpdir.name, after_days=2)
+		filename = pyhkd_get_filename(self.tmpdir.name, 'voltage', 'AI 0', self.day)
+
+		# Left alone until it hasn't changed for a while
+		compressor.compress_old_days()
+		self.assertTrue(os.path.exists(filename))
+		self.make_idle()
+		compressor.compress_old_days()
+		self.assertFalse(os.path.exists(filename))
+		self.assertTrue(os.path.exists(filename + blockzip.EXTENSION))
+
+		# A plain file next to the compressed one (from an interrupted
+		# run) is ignored
+		before = pyhkd_read_text(self.tmpdir.name, 'voltage', 'AI 0', self.day)
+		with open(filename, 'w') as f:
+			f.write('1000.000\t-1\n')
+		self.assertEqual(pyhkd_read_text(self.tmpdir.name, 'voltage', 'AI 0', self.day), before)
+		self.assertEqual(pyhkd_get_latest(self.tmpdir.name, 'voltage', 'AI 0', self.day, False), (1009.0, 4.5))
+
+		with self.assertRaises(AssertionError):
+			DayCompressor(self.tmpdir.name, after_days=1)
+
+	def test_recent_days(self):
+
+		self.log_day('text', 10)
+		DayCompressor(self.tmpdir.name, after_days=4).compress_old_days()
+		self.assertTrue(os.path.exists(pyhkd_get_filename(self.tmpdir.name, 'voltage', 'AI 0', self.day)))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import time
+import datetime
+import tempfile
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib import clock
+from pyhkdlib.loggers.solo_date_logger import SoloDateLogger
+
+class TestVirtualClock(unittest.TestCase):
+
+	def tearDown(self):
+		clock.set_clock(clock.WallClock())
+
+	def test_rate(self):
+
+		clock.set_clock(clock.VirtualClock(rate=1000, start=0))
+		time.sleep(0.05)
+		self.assertGreater(clock.now(), 40)
+		self.assertLess(clock.now(), 500)
+		self.assertAlmostEqual(clock.real_timeout(10), 0.01)
+
+	def test_day_rollover(self):
+
+		# Start one second before local midnight
+		tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+		midnight = datetime.datetime.combine(tomorrow, datetime.time()).timestamp()
+		clock.set_clock(clock.VirtualClock(rate=100, start=midnight - 1))
+
+		with tempfile.TemporaryDirectory() as base_folder:
+
+			logger = SoloDateLogger(base_folder, 'voltage', 'AI0')
+			logger.log('AI0', 'voltage', 1.0, clock.now())
+			clock.sleep(2)
+			logger.log('AI0', 'voltage', 2.0, clock.now())
+
+			folder = os.path.join(base_folder, tomorrow.strftime('%Y'), tomorrow.strftime('%m'), tomorrow.strftime('%d'), 'voltage')
+			self.assertTrue(os.path.exists(os.path.join(folder, 'AI0.txt')))
+
+if __name__ == '__main__':
+	unittest.main()
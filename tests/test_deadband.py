@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import unittest
+import math
+import datetime
+import sys
+import os
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib import clock
+from pyhkdlib import rollover
+from pyhkdlib.loggers.solo_date_logger import SoloDateLogger
+from pyhkdremote.data_loader import hold_values, thin_indices, DataLoader
+from helpers import LogFolderTestCase
+
+class TestDeadband(LogFolderTestCase):
+
+	def log_all(self, logger, values):
+		for t, v in enumerate(values):
+			logger.log('T1', 'temperature', v, 100.0 + t)
+		return self.read_values(logger)
+
+	def test_deadband(self):
+
+		logger = SoloDateLogger(self.tmpdir.name, 'temperature', 'T1', deadband=0.5)
+		lines = self.log_all(logger, [1.0, 1.2, 1.4, 1.3, 2.0, 2.1])
+
+		# The held value is written just before the step
+		self.assertEqual(lines, [(100.0, 1.0), (103.0, 1.3), (104.0, 2.0)])
+
+	def test_max_interval(self):
+
+		logger = SoloDateLogger(self.tmpdir.name, 'temperature', 'T1', max_interval=2)
+		lines = self.log_all(logger, [1.0, 1.0, 1.0, 1.0, 1.0, 2.0])
+		self.assertEqual(lines, [(100.0, 1.0), (102.0, 1.0), (104.0, 1.0), (105.0, 2.0)])
+
+	def test_nan(self):
+
+		logger = SoloDateLogger(self.tmpdir.name, 'temperature', 'T1', deadband=1)
+		lines = self.log_all(logger, [1.0, None, float('nan'), 1.0])
+		self.assertEqual(len(lines), 4)
+		self.assertTrue(math.isnan(lines[1][1]))
+		self.assertTrue(math.isnan(lines[2][1]))
+
+	def test_flush(self):
+
+		logger = SoloDateLogger(self.tmpdir.name, 'temperature', 'T1', deadband=0.5)
+		self.assertEqual(self.log_all(logger, [1.0, 1.2, 1.1]), [(100.0, 1.0)])
+
+		# At shutdown the held value is written, once
+		rollover.flush_loggers()
+		rollover.flush_loggers()
+		self.assertEqual(self.read_values(logger), [(100.0, 1.0), (102.0, 1.1)])
+
+	def test_every_value(self):
+
+		logger = SoloDateLogger(self.tmpdir.name, 'temperature', 'T1')
+		self.assertEqual(len(self.log_all(logger, [1.0, 1.0, 1.0])), 3)
+
+	def test_hold_values(self):
+
+		y = hold_values([100.0, 103.0, 104.0], [1.0, 1.3, 2.0], [99.0, 100.0, 102.5, 103.5, 110.0])
+		self.assertTrue(math.isnan(y[0]))
+		self.assertEqual(y[1:].tolist(), [1.0, 1.0, 1.3, 2.0])
+		self.assertTrue(math.isnan(hold_values([], [], [1.0])[0]))
+
+	def test_thin_indices(self):
+
+		# The sample before each kept one, and the last one
+		self.assertEqual(thin_indices(10, 4).tolist(), [0, 3, 4, 7, 8, 9])
+		self.assertEqual(thin_indices(10, 4, start=2).tolist(), [2, 5, 6, 9])
+		self.assertEqual(thin_indices(3, 1).tolist(), [0, 1, 2])
+		self.assertEqual(len(thin_indices(0, 4)), 0)
+
+	def test_load_aligned(self):
+
+		day = datetime.date.today()
+		midnight = rollover.day_bounds(day)[0]
+		clock.set_clock(clock.VirtualClock(start=midnight + 100))
+		try:
+			held = SoloDateLogger(self.tmpdir.name, 'temperature', 'T1', deadband=0.5)
+			every = SoloDateLogger(self.tmpdir.name, 'temperature', 'T2')
+			for i, v in enumerate([1.0, 1.2, 2.0, 2.1]):
+				held.log('T1', 'temperature', v, midnight + 100 + 10*i)
+				every.log('T2', 'temperature', v, midnight + 100 + 10*i)
+		finally:
+			clock.set_clock(clock.WallClock())
+
+		loader = DataLoader(self.tmpdir.name, 'temperature', ['T1', 'T2'], None)
+		values = loader.load_aligned(day, day, [midnight + 115, midnight + 135])
+		self.assertEqual(values.tolist(), [[1.2, 2.0], [1.2, 2.1]])
+
+if __name__ == '__main__':
+	unittest.main()
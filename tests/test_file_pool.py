@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib import file_pool
+from pyhkdlib import file_writer
+from pyhkdlib.loggers.solo_date_logger import SoloDateLogger
+from pyhkdremote import binlog
+from helpers import LogFolderTestCase
+
+class TestFilePool(LogFolderTestCase):
+
+	def setUp(self):
+		LogFolderTestCase.setUp(self)
+		self.pool = file_pool.start(max_open=3)
+
+	def tearDown(self):
+		file_writer.stop()
+		file_pool.stop()
+		LogFolderTestCase.tearDown(self)
+
+	def test_lru(self):
+
+		loggers = [SoloDateLogger(self.tmpdir.name, 'voltage', 'AI%i' % i) for i in range(5)]
+		self.assertEqual(self.pool.to_dict()['num_open'], 3)
+
+		for t in range(4):
+			for l in loggers:
+				l.log(l._sensor_name, 'voltage', float(t), 100.0 + t)
+
+		for l in loggers:
+			self.assertEqual(len(self.read_lines(l)), 4)
+
+		stats = self.pool.to_dict()
+		self.assertEqual(stats['num_open'], 3)
+		self.assertEqual(stats['num_misses'], 25)
+		self.assertEqual(stats['num_evictions'], 22)
+
+		# Writing to the same file again is a hit
+		loggers[4].log('AI4', 'voltage', 1.0, 200.0)
+		self.assertEqual(self.pool.to_dict()['num_hits'], 1)
+
+	def test_closed(self):
+
+		loggers = [SoloDateLogger(self.tmpdir.name, 'voltage', 'AI%i' % i) for i in range(5)]
+		evicted = loggers[0]._fileobj
+		closed = loggers[1]._fileobj
+		closed.close()
+		self.assertTrue(closed.closed)
+		self.assertFalse(evicted.closed)
+
+		# A file closed by its owner isn't opened again by a late write,
+		# which would make a new file
+		os.remove(closed.name)
+		with self.assertRaises(ValueError):
+			closed.write(b'1.000\t1\n')
+		with self.assertRaises(ValueError):
+			closed.tell()
+		self.assertFalse(os.path.exists(closed.name))
+
+		# One closed to make room opens again
+		evicted.write(b'1.000\t1\n')
+		self.assertEqual(self.read_lines(loggers[0]), ['1.000\t1'])
+
+	def test_with_writer(self):
+
+		writer = file_writer.start(flush_time=100, fsync_interval=1)
+		loggers = [SoloDateLogger(self.tmpdir.name, 'voltage', 'AI%i' % i, file_format='both') for i in range(4)]
+
+		for t in range(10):
+			for l in loggers:
+				l.log(l._sensor_name, 'voltage', float(t), 100.0 + t)
+		file_writer.stop()
+
+		# One write per file, and the binary files have their header once
+		self.assertEqual(writer.to_dict()['num_writes'], 8)
+		for l in loggers:
+			self.assertEqual(len(self.read_lines(l)), 10)
+			self.assertEqual(len(binlog.load(l._filename[:-len('.txt')] + binlog.EXTENSION)), 10)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import time
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib import file_writer
+from pyhkdlib.loggers.solo_date_logger import SoloDateLogger
+from helpers import LogFolderTestCase
+
+class TestFileWriter(LogFolderTestCase):
+
+	def setUp(self):
+		LogFolderTestCase.setUp(self)
+
+	def tearDown(self):
+		file_writer.stop()
+		LogFolderTestCase.tearDown(self)
+
+	def test_batches(self):
+
+		writer = file_writer.start(flush_time=100, fsync_interval=1)
+		loggers = [SoloDateLogger(self.tmpdir.name, 'voltage', 'AI%i' % i) for i in range(3)]
+
+		for t in range(10):
+			for l in loggers:
+				l.log(l._sensor_name, 'voltage', float(t), 100.0 + t)
+
+		# Held until a flush
+		self.assertEqual(self.read_lines(loggers[0]), [])
+		writer.flush()
+		self.assertEqual(len(self.read_lines(loggers[0])), 10)
+
+		stats = writer.to_dict()
+		self.assertEqual(stats['num_lines'], 30)
+		self.assertEqual(stats['num_writes'], 3)
+		self.assertEqual(stats['lines_per_write'], 10)
+
+		# Written out when stopped
+		loggers[1].log('AI1', 'voltage', 1.0, 200.0)
+		file_writer.stop()
+		self.assertEqual(self.read_lines(loggers[1])[-1], '200.000\t1')
+		self.assertGreater(writer.to_dict()['num_fsyncs'], 0)
+
+		# And written directly afterwards
+		loggers[2].log('AI2', 'voltage', 1.0, 300.0)
+		self.assertEqual(self.read_lines(loggers[2])[-1], '300.000\t1')
+
+	def test_size_and_close(self):
+
+		writer = file_writer.start(flush_time=100, max_pending=100)
+		logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI0')
+
+		for t in range(10):
+			logger.log('AI0', 'voltage', 1.0, 100.0 + t)
+
+		# Enough held to start a flush early
+		for i in range(100):
+			if writer.to_dict()['num_writes'] > 0:
+				break
+			time.sleep(0.01)
+		self.assertGreater(writer.to_dict()['num_writes'], 0)
+
+		# Closing a file (as on a new day) writes out its lines
+		logger.log('AI0', 'voltage', 2.0, 500.0)
+		file_writer.close(logger._fileobj)
+		self.assertEqual(self.read_lines(logger)[-1], '500.000\t2')
+		logger._fileobj = None
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import unittest
+import math
+import random
+import statistics
+import sys
+import os
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib import filters
+from pyhkdlib.sensor import Sensor
+from helpers import FakeInstrument, NoLogFilesTestCase
+
+class TestFilters(NoLogFilesTestCase):
+
+	def test_windows(self):
+
+		median = filters.Median(3)
+		self.assertEqual([median(x) for x in [1.0, 5.0, 3.0, 10.0, 2.0]], [1.0, 3.0, 3.0, 5.0, 3.0])
+
+		mavg = filters.MovingAverage(2)
+		self.assertEqual([mavg(x) for x in [1.0, 3.0, 5.0, 6.0]], [1.0, 2.0, 4.0, 5.5])
+
+		# Values near 1e6 with a small spread, so the variance needs
+		# care to stay accurate
+		spike = filters.SpikeFilter(20, 3.0)
+		values = [1e6 + 0.001 * (i % 3) for i in range(50)]
+		self.assertEqual([spike(x) for x in values], values)
+		self.assertEqual(spike(1e6 + 1), 1e6 + 0.001)
+		self.assertEqual(spike(1e6), 1e6)
+
+	def test_median(self):
+
+		rng = random.Random(1)
+		for window in [1, 2, 5, 20]:
+			median = filters.Median(window)
+			values = []
+			for i in range(2000):
+				values.append(rng.choice([float(rng.randint(0, 3)), rng.gauss(0, 1), 0.01 * i]))
+				self.assertEqual(median(values[-1]), statistics.median(values[-window:]))
+
+		# Rising values leave the removed ones buried in the heaps, which
+		# are rebuilt so they don't grow without bound
+		median = filters.Median(10)
+		for i in range(10000):
+			median(float(i))
+		self.assertLessEqual(len(median._win.heaps), 30)
+
+	def test_ema(self):
+		ema = filters.EMA(0.5)
+		self.assertEqual([ema(x) for x in [2.0, 4.0, 4.0]], [2.0, 3.0, 3.5])
+
+	def test_butterworth(self):
+
+		for order in [1, 2, 3, 4]:
+
+			# Starts at the first value
+			butter = filters.Butterworth(order, 0.1)
+			self.assertAlmostEqual(butter(5.0), 5.0)
+			self.assertAlmostEqual(butter(5.0), 5.0)
+
+			# Settles on a new level
+			for i in range(500):
+				y = butter(1.0)
+			self.assertAlmostEqual(y, 1.0)
+
+			# Attenuates at the Nyquist frequency
+			for i in range(500):
+				y = butter(1.0 if i % 2 else -1.0)
+			self.assertLess(abs(y), 0.01)
+
+	def test_chain(self):
+
+		chain = filters.build_chain([["median", 3], ["ema", 0.5]])
+		self.assertEqual(len(chain), 2)
+		self.assertEqual(chain(1.0), 1.0)
+
+		# Non-finite values pass through without changing the state
+		self.assertTrue(math.isnan(chain(float('nan'))))
+		self.assertIsNone(chain(None))
+		self.assertEqual(chain(3), 1.5)
+
+		chain.reset()
+		self.assertEqual(chain(7.0), 7.0)
+
+		for spec in ["median", [["median"]], [["lowpass", 3]], [["butter", 2, 1.5]], [["ema", 0]]]:
+			with self.assertRaises(SystemExit):
+				filters.build_chain(spec, 'test')
+
+	def test_channel(self):
+
+		inst = FakeInstrument(channels=[{'name': 'P', 'type': ['pressure', 'starg'], 'filters': [["median", 3]]}])
+
+		sen = inst.get_sensor(0, Sensor.TYPE_PRESSURE)
+		for x in [1.0, 100.0, 2.0]:
+			sen.value = x
+		self.assertEqual(sen.value, 2.0)
+
+		# Targets are not filtered
+		target = inst.get_sensor(0, Sensor.TYPE_TARGET_STATE)
+		target.value = 100.0
+		self.assertEqual(target.value, 100.0)
+
+if __name__ == '__main__':
+	unittest.main()
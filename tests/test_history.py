@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import math
+import json
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib import data_acq
+from pyhkdlib.data_acq import DataAcqController
+from pyhkdlib.history import SensorHistory
+from pyhkdlib.sensor import Sensor
+from helpers import FakeInstrument, NoLogFilesTestCase
+
+class TestSensorHistory(unittest.TestCase):
+
+	def test_samples(self):
+
+		h = SensorHistory(num_samples=5, levels=[])
+		for i in range(8):
+			h.add(float(i), 100.0 + i)
+
+		# Only the newest samples are kept, oldest first
+		d = h.samples()
+		self.assertEqual(d['time'], [103.0, 104.0, 105.0, 106.0, 107.0])
+		self.assertEqual(d['value'], [3.0, 4.0, 5.0, 6.0, 7.0])
+
+		d = h.samples(start=105, stop=106)
+		self.assertEqual(d['value'], [5.0, 6.0])
+
+	def test_bins(self):
+
+		h = SensorHistory(num_samples=0, levels=[(10, 3)])
+		for t in range(0, 50):
+			h.add(float(t), float(t))
+		h.add(float('NaN'), 50.0)
+
+		# Three bins, including the one being filled
+		d = h.bins(10)
+		self.assertEqual(d['time'], [30, 40, 50])
+		self.assertEqual(d['min'][:2], [30.0, 40.0])
+		self.assertEqual(d['max'][:2], [39.0, 49.0])
+		self.assertEqual(d['mean'][:2], [34.5, 44.5])
+		self.assertEqual(d['count'], [10, 10, 0])
+		self.assertTrue(math.isnan(d['mean'][2]))
+
+		self.assertEqual(h.bins(10, start=35, stop=45)['time'], [30, 40])
+		self.assertIsNone(h.bins(60))
+
+class TestSensorOptIn(NoLogFilesTestCase):
+
+	def test_channel_history(self):
+
+		inst = FakeInstrument(channels=[{'name': 'T1', 'type': 'temperature'}, {'name': 'T2', 'type': 'temperature', 'history': True}])
+		for i in range(3):
+			inst.get_sensor(0, 'temperature').value = float(i)
+			inst.get_sensor(1, 'temperature').value = float(i)
+
+		# Only channels that ask for it keep a history
+		self.assertIsNone(inst.get_sensor(0, 'temperature').get_history())
+		self.assertEqual(inst.get_sensor(1, 'temperature').get_history()['value'], [0.0, 1.0, 2.0])
+
+		# Unless it is turned off for the whole process
+		Sensor.KEEP_HISTORY = False
+		try:
+			s = Sensor('T3', 'temperature', history=True)
+		finally:
+			Sensor.KEEP_HISTORY = True
+		s.value = 1.0
+		self.assertIsNone(s.get_history())
+
+	def test_histories_query(self):
+
+		inst = FakeInstrument(channels=[{'name': 'T1', 'type': 'temperature'}, {'name': 'T2', 'type': 'temperature', 'history': True}])
+		for i in range(3):
+			inst.get_sensor(1, 'temperature').value = float(i)
+
+		old_port = data_acq.RECV_PORT
+		data_acq.RECV_PORT = 0
+		ctrl = DataAcqController([inst], [])
+		try:
+			reply = json.loads(ctrl.handle_packet('histories,temperature,,T1,T2,T9'))
+		finally:
+			ctrl._threads_running = False
+			ctrl._thread_rx.join()
+			data_acq.RECV_PORT = old_port
+
+		# One reply with every level, only for sensors keeping a history
+		self.assertEqual(list(reply), ['T2'])
+		self.assertEqual(reply['T2']['samples']['value'], [0.0, 1.0, 2.0])
+		self.assertEqual([w for w, bins in reply['T2']['bins']], inst.get_sensor(1, 'temperature').history_widths)
+
+if __name__ == '__main__':
+	unittest.main()
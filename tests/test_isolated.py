@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import time
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib.instruments.isolated_instrument import IsolatedInstrument
+from helpers import NoLogFilesTestCase, wait_for
+
+CONFIG = {'channels': [{'name': 'AI0', 'type': 'voltage'}, {'name': 'H1', 'type': ['voltage', 'vtarg']}], 'wait_time': 0.05}
+
+# Returns the messages given, then acts like a closed pipe
+class FakeConn:
+
+	def __init__(self, msgs):
+		self.msgs = list(msgs)
+
+	def recv(self):
+		if len(self.msgs) == 0:
+			raise EOFError()
+		return self.msgs.pop(0)
+
+class TestIsolated(NoLogFilesTestCase):
+
+	def setUp(self):
+		NoLogFilesTestCase.setUp(self)
+		self.inst = IsolatedInstrument('helpers', 'CountingInstrument', dict(CONFIG), isolate_timeout=5)
+
+	def tearDown(self):
+		self.inst.close()
+		NoLogFilesTestCase.tearDown(self)
+
+	def test_values_and_targets(self):
+
+		inst = self.inst
+		self.assertEqual(inst.BOX_TYPE, 'TEST')
+		self.assertEqual(inst.lookup_id, {'AI0': 0, 'H1': 1})
+
+		count = inst.get_sensor(0, 'voltage')
+		self.assertTrue(wait_for(lambda: count.value == count.value and count.value > 2))
+
+		# A target is forwarded by the next update
+		inst.get_sensor(1, 'vtarg').value = 3.0
+		inst.update()
+		readback = inst.get_sensor(1, 'voltage')
+		self.assertTrue(wait_for(lambda: readback.value == 3.0))
+
+		# The child's copy of a target doesn't replace a newer one
+		inst.get_sensor(1, 'vtarg').value = 4.0
+		inst._loop_rx(FakeConn([('frame', [('H1', 'vtarg', 3.0), ('H1', 'voltage', 3.5)], 200.0, None)]))
+		self.assertEqual(inst.get_sensor(1, 'vtarg').value, 4.0)
+		self.assertEqual(readback.value, 3.5)
+
+	def test_restart(self):
+
+		inst = self.inst
+		inst.RESTART_TIME = 0
+		inst.get_sensor(1, 'vtarg').value = 2.0
+		inst.update()
+
+		old_pid = inst._proc.pid
+		inst._proc.terminate()
+		inst._proc.join()
+
+		# The new child is slow to start, which doesn't hold up updates
+		inst._config['start_delay'] = 1.0
+		start_time = time.monotonic()
+		inst.update_periodic()
+		inst.update_periodic()
+		self.assertLess(time.monotonic() - start_time, 0.5)
+		self.assertIsNotNone(inst._restart_thread)
+
+		def restarted():
+			inst.update_periodic()
+			return inst._restart_thread is None
+		self.assertTrue(wait_for(restarted))
+		self.assertNotEqual(inst._proc.pid, old_pid)
+
+		# Values arrive from the new child, and it gets the targets again
+		count = inst.get_sensor(0, 'voltage')
+		count.value = float('nan')
+		self.assertTrue(wait_for(lambda: count.value == count.value))
+		inst.update()
+		self.assertTrue(wait_for(lambda: inst.get_sensor(1, 'voltage').value == 2.0))
+
+if __name__ == '__main__':
+	unittest.main()
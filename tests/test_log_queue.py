@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import time
+import threading
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib import log_queue
+from pyhkdlib.sensor import Sensor
+from pyhkdlib.loggers.logger import Logger
+from helpers import wait_for
+
+class SlowLogger(Logger):
+
+	def __init__(self, delay=0):
+		self.delay = delay
+		self.values = []
+
+	def log(self, sensor_name, sensor_type, value, update_time, sync_num = None):
+		time.sleep(self.delay)
+		self.values.append(value)
+
+# Holds up the worker on the first value until 'release' is set
+class BlockingLogger(SlowLogger):
+
+	def __init__(self, release):
+		SlowLogger.__init__(self)
+		self.release = release
+
+	def log(self, sensor_name, sensor_type, value, update_time, sync_num = None):
+		self.release.wait()
+		SlowLogger.log(self, sensor_name, sensor_type, value, update_time, sync_num)
+
+class TestLogQueue(unittest.TestCase):
+
+	def tearDown(self):
+		log_queue.stop()
+
+	def test_in_order(self):
+
+		log_queue.start()
+
+		sen = Sensor("Test Sensor", Sensor.TYPE_FLOAT)
+		logger = SlowLogger()
+		sen.add_logger(logger)
+
+		for i in range(1000):
+			sen.set_value(float(i))
+
+		# Written by the worker, everything is out once stopped
+		log_queue.stop()
+		self.assertEqual(logger.values, [float(i) for i in range(1000)])
+
+	def test_drop(self):
+
+		q = log_queue.start(max_depth=5, policy=log_queue.POLICY_DROP, batch_time=1)
+
+		logger = SlowLogger(delay=0.01)
+		for i in range(20):
+			q.put_value((logger,), 'a', Sensor.TYPE_FLOAT, i, 0, None)
+
+		d = log_queue.to_dict()
+		self.assertEqual(d['num_dropped'], 15)
+
+		log_queue.stop()
+		self.assertEqual(logger.values, list(range(5)))
+
+	def test_block_without_lock(self):
+
+		q = log_queue.start(max_depth=2, policy=log_queue.POLICY_BLOCK, batch_time=0.01)
+
+		sen = Sensor("Test Sensor", Sensor.TYPE_FLOAT)
+		release = threading.Event()
+		logger = BlockingLogger(release)
+		sen.add_logger(logger)
+
+		def produce():
+			for i in range(6):
+				sen.set_value(float(i))
+		producer = threading.Thread(target=produce)
+		producer.start()
+
+		# The producer waits for room, but not while holding the
+		# sensor's lock
+		self.assertTrue(wait_for(lambda: len(q._records) >= 2))
+		time.sleep(0.05)
+		self.assertTrue(producer.is_alive())
+		self.assertTrue(sen._update_lock.acquire(timeout=1))
+		sen._update_lock.release()
+
+		release.set()
+		producer.join()
+		log_queue.stop()
+		self.assertEqual(logger.values, [float(i) for i in range(6)])
+
+		# The deepest the queue got, not the size of a batch
+		self.assertEqual(q.to_dict()['max_depth_seen'], 2)
+
+if __name__ == '__main__':
+	unittest.main()
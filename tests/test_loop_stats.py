@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib.loop_stats import RollingHistogram, InstrumentLoopStats
+
+class TestRollingHistogram(unittest.TestCase):
+
+	def test_quantiles(self):
+
+		h = RollingHistogram(window=100)
+		for i in range(99):
+			h.add(0.01, now=0)
+		h.add(2.0, now=0)
+
+		self.assertEqual(h.n, 100)
+		self.assertAlmostEqual(h.max, 2.0)
+		self.assertLess(h.quantile(0.5), 0.02)
+		self.assertGreaterEqual(h.quantile(0.5), 0.01)
+		self.assertAlmostEqual(h.quantile(1.0), 2.0)
+
+	def test_window_rotation(self):
+
+		h = RollingHistogram(window=10)
+		h.add(1.0, now=0)
+		h.add(1.0, now=15) # Starts a second window
+		self.assertEqual(h.n, 2)
+		h.add(1.0, now=30) # Drops the first window
+		self.assertEqual(h.n, 2)
+
+class TestInstrumentLoopStats(unittest.TestCase):
+
+	def test_record(self):
+
+		stats = InstrumentLoopStats('TEST')
+		for i in range(10):
+			start = 100 + i + 0.01
+			stats.record(100 + i, start, start + 0.002, 1.0)
+
+		d = stats.to_dict()
+		self.assertEqual(d['num_updates'], 10)
+		self.assertEqual(d['period']['n'], 9)
+		self.assertAlmostEqual(d['period_ratio'], 1.0)
+		self.assertAlmostEqual(d['lag']['mean'], 0.01)
+		self.assertAlmostEqual(d['duration']['mean'], 0.002)
+
+	def test_overdue(self):
+
+		stats = InstrumentLoopStats('TEST', wait_time=1, max_interval=2)
+		t0 = stats._created
+
+		# Never updated, counted once per gap
+		stats.check_overdue(t0 + 1)
+		self.assertEqual(stats.deadline_misses, 0)
+		stats.check_overdue(t0 + 3)
+		stats.check_overdue(t0 + 4)
+		self.assertEqual(stats.deadline_misses, 1)
+
+		# A late update already counted isn't counted again
+		stats.record(t0, t0 + 5, t0 + 5, 1, 2)
+		stats.check_overdue(t0 + 7.5)
+		stats.record(t0, t0 + 8, t0 + 8, 1, 2)
+		self.assertEqual(stats.deadline_misses, 2)
+
+		# One that wasn't checked in between is
+		stats.record(t0, t0 + 11, t0 + 11, 1, 2)
+		self.assertEqual(stats.deadline_misses, 3)
+		self.assertEqual(stats.to_dict()['deadline_misses'], 3)
+
+if __name__ == '__main__':
+	unittest.main()
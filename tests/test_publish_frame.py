@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib.loggers.logger import Logger
+from helpers import FakeInstrument, NoLogFilesTestCase
+
+class FrameLogger(Logger):
+
+	def __init__(self):
+		self.values = []
+		self.frames = []
+
+	def log(self, sensor_name, sensor_type, value, update_time, sync_num = None):
+		self.values.append((sensor_name, sensor_type, value, update_time, sync_num))
+
+	def log_frame(self, entries, update_time, sync_num = None):
+		self.frames.append((entries, update_time, sync_num))
+
+class TestPublishFrame(NoLogFilesTestCase):
+
+	def test_frame(self):
+
+		channels = [{'name': 'T%i' % i, 'type': 'temperature'} for i in range(3)]
+		inst = FakeInstrument(channels=channels)
+
+		logger = FrameLogger()
+		inst.add_logger(logger)
+
+		inst.publish_frame({(i, 'temperature'): float(i) for i in range(3)}, 100.0, 7)
+
+		# One frame for the whole reading, nothing logged value by value
+		self.assertEqual(logger.values, [])
+		self.assertEqual(logger.frames, [([('T0', 'temperature', 0.0), ('T1', 'temperature', 1.0), ('T2', 'temperature', 2.0)], 100.0, 7)])
+
+		for i in range(3):
+			sen = inst.get_sensor(i, 'temperature')
+			self.assertEqual(sen.value, float(i))
+			self.assertEqual(sen.last_update_time, 100.0)
+
+		# Single updates still go through log()
+		inst.get_sensor(0, 'temperature').set_value(5.0, 101.0)
+		self.assertEqual(logger.values, [('T0', 'temperature', 5.0, 101.0, None)])
+
+	def test_update_in_frame(self):
+
+		inst = FakeInstrument(channels=[{'name': 'T0', 'type': 'temperature'}])
+		sen = inst.get_sensor(0, 'temperature')
+		logger = FrameLogger()
+		sen.add_logger(logger)
+
+		# The instrument's sensors share its lock, which the caller holds
+		self.assertTrue(sen.uses_lock(inst._sensor_lock))
+		frame = []
+		with inst._sensor_lock:
+			sen.update_in_frame(2.0, 100.0, None, frame, locked=True)
+		sen.update_in_frame(3.0, 101.0, None, frame)
+
+		# Logged by the caller, not by the sensor
+		self.assertEqual(logger.values, [])
+		self.assertEqual(frame, [(logger, 'T0', 'temperature', 2.0), (logger, 'T0', 'temperature', 3.0)])
+		self.assertEqual(sen.value, 3.0)
+
+	def test_deriv(self):
+
+		# Derivative sensors share the instrument's lock
+		channels = [{'name': 'T%i' % i, 'type': 'temperature', 'save_deriv': True} for i in range(3)]
+		inst = FakeInstrument(channels=channels)
+
+		inst.publish_frame({(0, 'temperature'): 1.0}, 100.0)
+		inst.publish_frame({(0, 'temperature'): 3.0}, 102.0)
+		inst.get_sensor(0, 'temperature').set_value(4.0, 103.0)
+
+		self.assertEqual(inst.get_sensor(0, 'temperature')._deriv_sensor.value, 1.0)
+
+	def test_failed_listener(self):
+
+		channels = [{'name': 'T%i' % i, 'type': 'temperature'} for i in range(2)]
+		inst = FakeInstrument(channels=channels)
+
+		def fail(sensors, update_time, sync_num):
+			raise RuntimeError("listener failed")
+		heard = []
+		for i in range(2):
+			inst.get_sensor(i, 'temperature').add_listener(fail)
+			inst.get_sensor(i, 'temperature').add_listener(lambda sensors, update_time, sync_num: heard.append([s.name for s in sensors]))
+
+		# The update and the other listeners go on, the error is logged
+		# once
+		with self.assertLogs(level='ERROR') as logs:
+			inst.publish_frame({(0, 'temperature'): 1.0, (1, 'temperature'): 2.0}, 100.0)
+			inst.get_sensor(0, 'temperature').set_value(3.0, 101.0)
+		self.assertEqual(len(logs.output), 1)
+		self.assertEqual(inst.get_sensor(0, 'temperature').value, 3.0)
+		self.assertEqual(inst.get_sensor(1, 'temperature').value, 2.0)
+		self.assertEqual(heard, [['T0'], ['T1'], ['T0']])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import datetime
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib import clock
+from pyhkdlib import rollover
+from pyhkdlib.loggers.solo_date_logger import SoloDateLogger
+from helpers import LogFolderTestCase, wait_for
+
+class TestRollover(LogFolderTestCase):
+
+	def setUp(self):
+		LogFolderTestCase.setUp(self)
+		self.tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+		self.midnight = rollover.day_bounds(self.tomorrow)[0]
+
+	def tearDown(self):
+		rollover.stop()
+		clock.set_clock(clock.WallClock())
+		LogFolderTestCase.tearDown(self)
+
+	def tomorrow_file(self, name):
+		d = self.tomorrow
+		return os.path.join(self.tmpdir.name, '%04d' % d.year, '%02d' % d.month, '%02d' % d.day, 'voltage', name)
+
+	def test_prepare_day(self):
+
+		clock.set_clock(clock.VirtualClock(rate=100, start=self.midnight - 2))
+
+		logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI0', alias='Stage')
+		logger.log('AI0', 'voltage', 1.0, clock.now())
+		old_file = logger._fileobj
+
+		logger.prepare_day(self.tomorrow)
+		self.assertTrue(os.path.exists(self.tomorrow_file('AI0.txt')))
+		self.assertTrue(os.path.islink(self.tomorrow_file('Stage.txt')))
+		self.assertNotEqual(logger._filename, self.tomorrow_file('AI0.txt'))
+		prepared = logger._next.fileobj
+
+		clock.sleep(3)
+		logger.log('AI0', 'voltage', 2.0, clock.now())
+
+		# Switched to the prepared file, and without a manager the old one
+		# is closed right away
+		self.assertIs(logger._fileobj, prepared)
+		self.assertIsNone(logger._next)
+		self.assertTrue(old_file.closed)
+		with open(self.tomorrow_file('AI0.txt')) as f:
+			self.assertEqual(len(f.read().splitlines()), 1)
+
+	def test_stale_prepared_day(self):
+
+		clock.set_clock(clock.VirtualClock(rate=100, start=self.midnight - 2))
+
+		logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI0')
+
+		# Preparing the current day does nothing
+		logger.prepare_day(datetime.date.today())
+		self.assertIsNone(logger._next)
+
+		# Files prepared for a day that isn't the new day are dropped
+		later = self.tomorrow + datetime.timedelta(days=1)
+		logger.prepare_day(later)
+		stale = logger._next.fileobj
+
+		clock.sleep(3)
+		logger.log('AI0', 'voltage', 2.0, clock.now())
+		self.assertTrue(stale.closed)
+		self.assertEqual(logger._filename, self.tomorrow_file('AI0.txt'))
+
+	def test_manager(self):
+
+		clock.set_clock(clock.VirtualClock(rate=100, start=self.midnight - 70))
+		manager = rollover.start(lead_time=60, retire_delay=100)
+
+		logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI0')
+		logger.log('AI0', 'voltage', 1.0, clock.now())
+		old_file = logger._fileobj
+
+		# Prepared lead_time before midnight
+		self.assertTrue(wait_for(lambda: logger._next is not None))
+		self.assertTrue(os.path.exists(self.tomorrow_file('AI0.txt')))
+		self.assertEqual(manager.to_dict()['num_prepared'], 1)
+
+		self.assertTrue(wait_for(lambda: clock.now() > self.midnight))
+		logger.log('AI0', 'voltage', 2.0, clock.now())
+		self.assertEqual(logger._filename, self.tomorrow_file('AI0.txt'))
+
+		# The old file is closed by the manager after retire_delay
+		self.assertFalse(old_file.closed)
+		self.assertTrue(wait_for(lambda: old_file.closed))
+
+	def test_late_switch(self):
+
+		clock.set_clock(clock.VirtualClock(rate=100, start=self.midnight - 70))
+		manager = rollover.start(lead_time=60, retire_delay=100)
+
+		logger = SoloDateLogger(self.tmpdir.name, 'voltage', 'AI0')
+		logger.log('AI0', 'voltage', 1.0, clock.now())
+		old_file = logger._fileobj
+
+		# The first value of the day comes well after midnight
+		self.assertTrue(wait_for(lambda: clock.now() > self.midnight + 200))
+		logger.log('AI0', 'voltage', 2.0, clock.now())
+		switch_time = clock.now()
+
+		# Still closed retire_delay after the switch
+		self.assertEqual(manager.to_dict()['num_retired'], 1)
+		self.assertTrue(wait_for(lambda: old_file.closed))
+		self.assertGreaterEqual(clock.now(), switch_time + 100)
+
+	def test_switch_while_preparing(self):
+
+		clock.set_clock(clock.VirtualClock(rate=100, start=self.midnight - 2))
+
+		logger = RacingLogger(self.tmpdir.name, 'voltage', 'AI0')
+		logger.race = True
+		logger.prepare_day(self.tomorrow)
+
+		# The logger switched on its own while the files were prepared,
+		# so the prepared ones are closed instead of kept for a day
+		self.assertEqual(logger._filename, self.tomorrow_file('AI0.txt'))
+		self.assertIsNone(logger._next)
+		self.assertTrue(all(f.closed for f in logger.prepared.fileobjs()))
+		self.assertFalse(logger._fileobj.closed)
+
+# Logs a value after midnight in the middle of preparing the next day
+class RacingLogger(SoloDateLogger):
+
+	race = False
+
+	def _open_day(self, d):
+		day = SoloDateLogger._open_day(self, d)
+		if self.race:
+			self.race = False
+			self.prepared = day
+			clock.sleep(3)
+			self.log('AI0', 'voltage', 2.0, clock.now())
+		return day
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import time
+import threading
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib.instruments.instrument import Instrument
+from pyhkdlib.scheduler import UpdateScheduler
+
+class CountingInstrument(Instrument):
+
+	def __init__(self, duration=0, **kwargs):
+		Instrument.__init__(self, **kwargs)
+		self.duration = duration
+		self.update_times = []
+
+	def update_periodic(self):
+		self.update_times.append(time.time())
+		time.sleep(self.duration)
+
+class TestUpdateScheduler(unittest.TestCase):
+
+	def _run_scheduler(self, sched, duration):
+		t = threading.Thread(target=sched.run)
+		t.start()
+		time.sleep(duration)
+		sched.stop()
+		t.join()
+
+	def test_phase_grid(self):
+
+		inst = CountingInstrument(wait_time=0.1, phase=0.05)
+		sched = UpdateScheduler([inst], lambda i: i.update())
+		self._run_scheduler(sched, 0.55)
+
+		self.assertGreaterEqual(len(inst.update_times), 4)
+
+		# Every update lands just after a grid point
+		for t in inst.update_times:
+			offset = (t - 0.05) % 0.1
+			self.assertLess(offset, 0.03)
+
+	def test_independent_periods(self):
+
+		fast = CountingInstrument(wait_time=0.05)
+		slow = CountingInstrument(wait_time=0.25)
+		sched = UpdateScheduler([slow, fast], lambda i: i.update())
+		self._run_scheduler(sched, 0.6)
+
+		self.assertGreaterEqual(len(fast.update_times), 9)
+		self.assertLessEqual(len(slow.update_times), 3)
+
+	def test_submit_wakes_early(self):
+
+		inst = CountingInstrument(wait_time=100)
+		sched = UpdateScheduler([inst], lambda i: i.update())
+
+		t = threading.Thread(target=sched.run)
+		t.start()
+		time.sleep(0.05)
+
+		done = threading.Event()
+		start_time = time.time()
+		sched.submit(done.set)
+		self.assertTrue(done.wait(0.5))
+		self.assertLess(time.time() - start_time, 0.1)
+
+		sched.stop()
+		t.join()
+
+		self.assertEqual(len(inst.update_times), 0)
+
+	def test_priority_defers_slow_update(self):
+
+		# The slow update would run into the control update every cycle
+		control = CountingInstrument(wait_time=0.1, phase=0, priority='high')
+		housekeeping = CountingInstrument(wait_time=0.1, phase=0.05, duration=0.08, priority='low')
+		sched = UpdateScheduler([housekeeping, control], lambda i: i.update())
+		self._run_scheduler(sched, 1.05)
+
+		# The control updates stay on the grid
+		self.assertGreaterEqual(len(control.update_times), 9)
+		for t in control.update_times[2:]:
+			self.assertLess(t % 0.1, 0.02)
+
+		# The housekeeping updates slip but still run
+		self.assertGreaterEqual(len(housekeeping.update_times), 7)
+
+if __name__ == '__main__':
+	unittest.main()
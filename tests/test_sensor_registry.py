@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib.sensor import Sensor, NULL_SENSOR
+from pyhkdlib.sensor_registry import SensorRegistry
+from helpers import FakeInstrument, NoLogFilesTestCase
+
+class TestSensorRegistry(NoLogFilesTestCase):
+
+	def setUp(self):
+		NoLogFilesTestCase.setUp(self)
+		self.inst = FakeInstrument(channels=[{'name': 'T1', 'type': 'temperature', 'alias': 'Head'}, {'name': 'HS', 'type': ['voltage', 'vtarg']}])
+
+	def test_lookup(self):
+
+		registry = SensorRegistry([self.inst])
+		t1 = self.inst.get_sensor(0, Sensor.TYPE_TEMPERATURE)
+
+		self.assertIs(registry.get('T1', Sensor.TYPE_TEMPERATURE), t1)
+		self.assertIs(registry.get('Head', Sensor.TYPE_TEMPERATURE), t1)
+		self.assertIs(registry.get('HS', Sensor.TYPE_TARGET_VOLTAGE), self.inst.get_sensor(1, Sensor.TYPE_TARGET_VOLTAGE))
+		self.assertIsNone(registry.get('T1', Sensor.TYPE_VOLTAGE))
+		self.assertIs(registry.owner(t1), self.inst)
+		self.assertEqual(len(registry), 3)
+
+		# Adding the same instrument again changes nothing
+		registry.add_instruments([self.inst])
+		self.assertEqual(len(registry), 3)
+
+	def test_missing_sensor(self):
+
+		dropped = NULL_SENSOR.num_dropped
+
+		for i in range(3):
+			s = self.inst.get_sensor(0, Sensor.TYPE_PRESSURE)
+			self.assertIs(s, NULL_SENSOR)
+			s.value = 1.0
+
+		self.assertEqual(self.inst.missing_sensors, {(0, Sensor.TYPE_PRESSURE): 3})
+		self.assertEqual(NULL_SENSOR.num_dropped - dropped, 3)
+		self.assertIsNone(self.inst.get_sensor(0, Sensor.TYPE_PRESSURE, none_on_fail=True))
+
+		# Handles and missing sensors can be mixed in a frame
+		t1 = self.inst.get_sensor(0, Sensor.TYPE_TEMPERATURE)
+		self.inst.publish_frame({t1: 4.0, (1, Sensor.TYPE_PRESSURE): 2.0}, 100.0)
+		self.assertEqual(t1.value, 4.0)
+		self.assertEqual(NULL_SENSOR.num_dropped - dropped, 4)
+
+if __name__ == '__main__':
+	unittest.main()
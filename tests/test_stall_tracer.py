@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import gc
+import time
+import threading
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib import stall_tracer
+from pyhkdlib.sensor import Sensor
+
+class TestStallTracer(unittest.TestCase):
+
+	def tearDown(self):
+		stall_tracer.disable()
+
+	def test_breakdown(self):
+
+		stall_tracer.enable(num_worst=2)
+
+		sen = Sensor("Test Sensor")
+		lock = threading.Lock()
+
+		totals = {}
+		for sleep_time in [0.01, 0.1, 0.04]:
+			name = 'TEST %g' % sleep_time
+			trace = stall_tracer.begin(name)
+			with lock:
+				trace.mark_lock_acquired()
+				time.sleep(sleep_time)
+				sen.set_value(1.0)
+				gc.collect()
+			stall_tracer.end(trace)
+			totals[name] = sum(trace.phases.values())
+
+		worst = stall_tracer.to_dict()['worst']
+
+		# Only the two slowest are kept, slowest first
+		expected = sorted(totals, key=lambda name: -totals[name])[:2]
+		self.assertEqual([r['instrument'] for r in worst], expected)
+		self.assertGreaterEqual(worst[0]['total'], worst[1]['total'])
+
+		for r in worst:
+			# The phases add up to the total
+			self.assertAlmostEqual(sum(r['phases'].values()), r['total'], places=6)
+			self.assertGreater(r['phases'][stall_tracer.PHASE_GC], 0)
+			# The sleep is in the driver phase, not in the GC time
+			self.assertGreaterEqual(r['phases'][stall_tracer.PHASE_DRIVER], float(r['instrument'].split()[1]))
+
+	def test_disabled(self):
+		self.assertIsNone(stall_tracer.begin('TEST'))
+		stall_tracer.end(None)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib.sensor import Sensor
+from pyhkdlib.instruments.gpib.lakeshore_336 import AbstractLakeshore336
+from helpers import FakeInstrument, NoLogFilesTestCase
+
+class Heaters(FakeInstrument):
+
+	def __init__(self, **kwargs):
+		self.processed = []
+		self.retry = False
+		FakeInstrument.__init__(self, **kwargs)
+
+	def process_targets(self, chan_ids):
+		self.processed.append(set(chan_ids))
+		if self.retry:
+			for chan_id in chan_ids:
+				self.mark_target_dirty(chan_id)
+
+# The LS336 heater logic, with the packets it sends recorded
+class FakeLakeshore336(AbstractLakeshore336, FakeInstrument):
+
+	responsive = True
+
+	def __init__(self, **kwargs):
+		self.sent = []
+		FakeInstrument.__init__(self, **kwargs)
+
+	def send_packet(self, packet, resp_callback=None):
+		self.sent.append(packet)
+
+class TestTargets(NoLogFilesTestCase):
+
+	def setUp(self):
+		NoLogFilesTestCase.setUp(self)
+		self.inst = Heaters(channels=[{'name': 'H1', 'type': ['voltage', 'vtarg']},
+									  {'name': 'H2', 'type': ['voltage', 'vtarg']},
+									  {'name': 'T1', 'type': 'temperature'}], wait_time=100)
+
+	def test_dirty_channels(self):
+
+		# Readings don't mark anything
+		self.inst.get_sensor(0, Sensor.TYPE_VOLTAGE).value = 1.0
+		self.inst.get_sensor(2, Sensor.TYPE_TEMPERATURE).value = 4.0
+		self.assertEqual(self.inst.dirty_targets, set())
+
+		self.inst.get_sensor(1, Sensor.TYPE_TARGET_VOLTAGE).value = 2.0
+		self.assertEqual(self.inst.dirty_targets, {1})
+
+		self.inst.process_dirty_targets()
+		self.assertEqual(self.inst.processed, [{1}])
+		self.assertEqual(self.inst.dirty_targets, set())
+
+		# Nothing to do
+		self.inst.process_dirty_targets()
+		self.assertEqual(len(self.inst.processed), 1)
+
+	def test_update(self):
+
+		# update() applies targets even when no periodic update is due
+		self.inst.get_sensor(0, Sensor.TYPE_TARGET_VOLTAGE).value = 2.0
+		self.inst.update()
+		self.assertEqual(self.inst.processed, [{0}])
+
+		# Channels marked again are retried on the next update
+		self.inst.retry = True
+		self.inst.get_sensor(1, Sensor.TYPE_TARGET_VOLTAGE).value = 3.0
+		self.inst.update()
+		self.inst.update()
+		self.assertEqual(self.inst.processed, [{0}, {1}, {1}])
+
+class TestLakeshore336Targets(NoLogFilesTestCase):
+
+	def test_maintained(self):
+
+		heater_types = ['state', 'starg', 'percentage', 'percenttarg']
+		inst = FakeLakeshore336(channels=[{'name': 'H1', 'id': 'I1', 'type': heater_types},
+										  {'name': 'H2', 'id': 'I2', 'type': heater_types}], wait_time=100)
+		inst.handle_heater_val('2', 0, Sensor.TYPE_STATE)
+		inst.handle_heater_val('0', 1, Sensor.TYPE_STATE)
+
+		# A target that is already met is kept, and not checked again on
+		# every update
+		inst.get_sensor('I1', 'starg').value = 2
+		inst.process_dirty_targets()
+		self.assertEqual(inst.sent, [])
+		self.assertEqual(inst._dirty_targets, set())
+		inst.handle_heater_val('2', 0, Sensor.TYPE_STATE)
+		self.assertEqual(inst._dirty_targets, set())
+
+		# Until a readback no longer matches
+		inst.handle_heater_val('0', 0, Sensor.TYPE_STATE)
+		self.assertEqual(inst._dirty_targets, {'I1'})
+		inst.process_dirty_targets()
+		inst.process_dirty_targets()
+		self.assertEqual(inst.sent, ['RANGE 1 2'])
+		self.assertEqual(inst._dirty_targets, set())
+
+		# A new target is sent right away
+		inst.get_sensor('I2', 'starg').value = 3
+		inst.process_dirty_targets()
+		self.assertEqual(inst.sent, ['RANGE 1 2', 'RANGE 2 3'])
+
+if __name__ == '__main__':
+	unittest.main()
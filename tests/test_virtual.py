@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+basepath = os.path.abspath(os.path.join(__file__,'..','..'))
+sys.path.append(os.path.join(basepath, 'pyhkd'))
+sys.path.append(os.path.join(basepath, 'common'))
+
+from pyhkdlib.instruments.virtual_instrument import VirtualInstrument, connect_virtual
+from helpers import FakeInstrument, NoLogFilesTestCase
+
+class TestVirtual(NoLogFilesTestCase):
+
+	def _build(self, virtual_channels):
+		inst = FakeInstrument(channels=[{'name': 'T1', 'type': 'temperature'}, {'name': 'T2', 'type': 'temperature'}, {'name': 'HS', 'type': 'voltage'}])
+		virtual = VirtualInstrument(channels=virtual_channels)
+		graph = connect_virtual([inst, virtual])
+		return inst, virtual, graph
+
+	def test_incremental(self):
+
+		inst, virtual, graph = self._build([{'name': 'dT', 'type': 'temperature', 'expr': '{T1} - {T2}'},
+											{'name': 'P', 'type': 'power', 'expr': '{HS:voltage}**2 / 100'},
+											{'name': 'dT2', 'type': 'temperature', 'expr': '2 * {dT}'}])
+
+		counts = {}
+		for n in graph.nodes:
+			counts[n.sensor.name] = 0
+			def func(values, n=n, orig=n.func):
+				counts[n.sensor.name] += 1
+				return orig(values)
+			n.func = func
+
+		inst.publish_frame({(0, 'temperature'): 5.0, (1, 'temperature'): 3.0}, 100.0)
+
+		# Each affected channel is computed once per frame, in order
+		self.assertEqual(counts, {'dT': 1, 'P': 0, 'dT2': 1})
+		self.assertEqual(virtual.get_sensor(0, 'temperature').value, 2.0)
+		self.assertEqual(virtual.get_sensor(2, 'temperature').value, 4.0)
+		self.assertEqual(virtual.get_sensor(2, 'temperature').last_update_time, 100.0)
+
+		inst.get_sensor(2, 'voltage').value = 10.0
+		self.assertEqual(counts, {'dT': 1, 'P': 1, 'dT2': 1})
+		self.assertEqual(virtual.get_sensor(1, 'power').value, 1.0)
+
+	def test_error(self):
+
+		inst, virtual, graph = self._build([{'name': 'Bad', 'type': 'temperature', 'expr': '{T1}.foo'},
+											{'name': 'dT', 'type': 'temperature', 'expr': '{T1} - {T2}'}])
+
+		# Any error gives NaN, and doesn't stop the other channels
+		with self.assertLogs(level='ERROR') as logs:
+			inst.publish_frame({(0, 'temperature'): 5.0, (1, 'temperature'): 3.0}, 100.0)
+			inst.publish_frame({(0, 'temperature'): 6.0}, 101.0)
+		self.assertEqual(len(logs.output), 1)
+		bad = virtual.get_sensor(0, 'temperature').value
+		self.assertNotEqual(bad, bad)
+		self.assertEqual(virtual.get_sensor(1, 'temperature').value, 3.0)
+
+	def test_loop(self):
+		with self.assertRaises(SystemExit):
+			self._build([{'name': 'A', 'type': 'temperature', 'expr': '{B} + {T1}'},
+						 {'name': 'B', 'type': 'temperature', 'expr': '{A}'}])
+
+if __name__ == '__main__':
+	unittest.main()